@@ -0,0 +1,117 @@
+"""
+竞价引擎吞吐基准
+
+不连接数据库，只测量内存中的出价处理速度：
+  1. 单个热门拍品上的持续出价 (所有出价串行经过同一把锁)
+  2. 多个拍品并行出价 (多线程，各拍品互不阻塞)
+
+用法: python benchmarks/bench_bid_engine.py [--bids 200000] [--items 100] [--threads 8]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bid_engine import BidEngine, ItemBook
+
+
+def make_book(item_id, now):
+    # 截止时间足够远，避免触发防狙击延时
+    return ItemBook(item_id, seller_id=1, start_price='100.00', price='100.00',
+                    increment='1.00', leader_id=None, end_time=now + timedelta(days=1))
+
+
+def drain(engine):
+    n = 0
+    while engine._pending:
+        n += len(engine._drain())
+    return n
+
+
+def bench_single_item(n_bids):
+    engine = BidEngine()
+    now = datetime.now()
+    engine.put_book(make_book(1, now))
+    price = Decimal('100.00')
+    step = Decimal('1.00')
+    accepted = 0
+    t0 = time.perf_counter()
+    for i in range(n_bids):
+        # 两个用户交替出价，每次都是合法加价
+        price += step
+        if engine.place_bid(1, 2 + (i & 1), price, now)['ok']:
+            accepted += 1
+    elapsed = time.perf_counter() - t0
+    assert drain(engine) == accepted
+    return accepted, elapsed
+
+
+def bench_rejections(n_bids):
+    engine = BidEngine()
+    now = datetime.now()
+    engine.put_book(make_book(1, now))
+    low = Decimal('1.00')
+    t0 = time.perf_counter()
+    for i in range(n_bids):
+        engine.place_bid(1, 2 + (i & 1), low, now)
+    return n_bids, time.perf_counter() - t0
+
+
+def bench_many_items(n_bids, n_items, n_threads):
+    engine = BidEngine()
+    now = datetime.now()
+    for item_id in range(1, n_items + 1):
+        engine.put_book(make_book(item_id, now))
+    per_thread = n_bids // n_threads
+    counts = [0] * n_threads
+    step = Decimal('1.00')
+
+    def worker(idx):
+        ok = 0
+        books = engine._books
+        for i in range(per_thread):
+            seq = i * n_threads + idx
+            item_id = 1 + seq % n_items
+            # 按当前价加价；与其他线程竞争同一拍品时可能被拒
+            r = engine.place_bid(item_id, 1000 + seq, books[item_id].price + step, now)
+            if r['ok']:
+                ok += 1
+        counts[idx] = ok
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_threads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return per_thread * n_threads, sum(counts), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bids', type=int, default=200000)
+    parser.add_argument('--items', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    accepted, elapsed = bench_single_item(args.bids)
+    print(f"single item : {accepted} accepted in {elapsed:.3f}s -> {accepted / elapsed:,.0f} bids/s "
+          f"({elapsed / accepted * 1e6:.2f} us/bid)")
+
+    rejected, elapsed = bench_rejections(args.bids)
+    print(f"rejections  : {rejected} rejected in {elapsed:.3f}s -> {rejected / elapsed:,.0f} bids/s "
+          f"({elapsed / rejected * 1e6:.2f} us/bid)")
+
+    total, accepted, elapsed = bench_many_items(args.bids, args.items, args.threads)
+    print(f"{args.items} items x {args.threads} threads: {total} bids ({accepted} accepted) in {elapsed:.3f}s "
+          f"-> {total / elapsed:,.0f} bids/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+并发连接基准：对比 threading (Werkzeug 每连接一个线程) 与 eventlet (每连接一个协程)
+
+对每种模式：
+  1. 以该模式启动 serve.py (临时 SQLite 数据库，单进程)
+  2. 按阶梯逐步建立 N 个 Socket.IO websocket 长连接 (engine.io v4 握手: 0{...} -> 40 -> 40{sid})，
+     连接保持打开并响应服务端心跳
+  3. 每一阶梯记录：成功建立的连接数、失败数、此时 HTTP 首页的响应延迟、服务端进程的 RSS 与线程数
+
+客户端直接基于 wsproto 并使用 eventlet 协程，数千个连接不会先耗尽客户端的线程。
+用法: python benchmarks/bench_connections.py [--modes threading,eventlet] [--steps 100,500,1000,2000]
+                                             [--port 5055] [--hold 3]
+注意: 连接数较大时需先调高文件描述符限制 (ulimit -n 65536)。
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import CloseConnection, Message, Ping, RejectConnection, Request, TextMessage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(mode, port, database_url, extra_env=None):
+    """以指定异步模式启动单进程 serve.py，等待首页可访问后返回进程"""
+    env = dict(os.environ, AUCTION_ASYNC_MODE=mode, PORT=str(port), HOST='127.0.0.1',
+               DATABASE_URL=database_url, AUCTION_WORKERS='1', SOCKETIO_LOG='0', **(extra_env or {}))
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'serve.py')], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'{mode} 服务启动失败 (退出码 {proc.returncode})')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+            return proc
+        except Exception:
+            eventlet.sleep(0.3)
+    proc.kill()
+    raise RuntimeError(f'{mode} 服务启动超时')
+
+
+def process_stats(pid):
+    """服务端进程的 RSS (MB) 与线程数，读取 /proc (非 Linux 返回 None)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None, None
+    rss = int(fields['VmRSS'].split()[0]) / 1024
+    return rss, int(fields['Threads'])
+
+
+class Connection:
+    """
+    一个保持打开的 Socket.IO 连接 (直接基于 wsproto，只实现握手、心跳与事件收发)
+    :param cookie: 登录后的 Cookie 头 (以该用户身份连接)
+    :param on_event: 收到服务端事件时调用 on_event(name, *args)
+    """
+
+    def __init__(self, port, cookie=None, on_event=None):
+        self.on_event = on_event
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=10)
+        self.ws = WSConnection(ConnectionType.CLIENT)
+        self.pending = []
+        headers = [('Cookie', cookie)] if cookie else []
+        self.sock.sendall(self.ws.send(Request(host=f'127.0.0.1:{port}', extra_headers=headers,
+                                               target='/socket.io/?EIO=4&transport=websocket')))
+        opened = self.receive()
+        if not opened.startswith('0'):
+            raise RuntimeError(f'engine.io 握手失败: {opened!r}')
+        self.send('40')
+        while True:
+            packet = self.receive()
+            if packet == '2':
+                self.send('3')
+            elif packet.startswith('40'):
+                break
+        self.sock.settimeout(None)
+        self.alive = True
+        self.thread = eventlet.spawn(self._heartbeat)
+
+    def send(self, text):
+        self.sock.sendall(self.ws.send(Message(data=text)))
+
+    def emit(self, event, data):
+        self.send('42' + json.dumps([event, data]))
+
+    def receive(self):
+        """下一条完整的文本消息"""
+        message = ''
+        while True:
+            while self.pending:
+                event = self.pending.pop(0)
+                if isinstance(event, TextMessage):
+                    message += event.data
+                    if event.message_finished:
+                        return message
+                elif isinstance(event, Ping):
+                    self.sock.sendall(self.ws.send(event.response()))
+                elif isinstance(event, (CloseConnection, RejectConnection)):
+                    raise ConnectionError('服务端关闭了连接')
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError('连接已断开')
+            self.ws.receive_data(data)
+            self.pending.extend(self.ws.events())
+
+    def _heartbeat(self):
+        try:
+            while True:
+                packet = self.receive()
+                if packet == '2':
+                    self.send('3')
+                elif packet.startswith('42') and self.on_event:
+                    self.on_event(*json.loads(packet[2:]))
+        except Exception:
+            self.alive = False
+
+    def close(self):
+        self.thread.kill()
+        self.sock.close()
+
+
+def open_connection(port):
+    try:
+        return Connection(port)
+    except Exception:
+        return None
+
+
+def http_latency(port, samples=5):
+    """首页平均响应时间 (ms)，失败返回 None"""
+    total = 0.0
+    for _ in range(samples):
+        t0 = time.perf_counter()
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=10).read()
+        except Exception:
+            return None
+        total += time.perf_counter() - t0
+    return total / samples * 1000
+
+
+def run_mode(mode, steps, port, hold):
+    fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    proc = start_server(mode, port, f'sqlite:///{db_path}')
+    conns = []
+    failed = 0
+    results = []
+    pool = eventlet.GreenPool(200)
+    try:
+        for target in steps:
+            t0 = time.perf_counter()
+            need = target - len(conns)
+            for conn in pool.imap(lambda _: open_connection(port), range(max(need, 0))):
+                if conn is None:
+                    failed += 1
+                else:
+                    conns.append(conn)
+            ramp = time.perf_counter() - t0
+            eventlet.sleep(hold)
+            alive = sum(1 for c in conns if c.alive)
+            rss, threads = process_stats(proc.pid)
+            latency = http_latency(port)
+            results.append({'mode': mode, 'target': target, 'connected': alive, 'failed': failed,
+                            'ramp_s': round(ramp, 2), 'http_ms': latency and round(latency, 1),
+                            'rss_mb': rss and round(rss, 1), 'threads': threads})
+            print(f"  [{mode}] 目标 {target:>6}  在线 {alive:>6}  失败 {failed:>5}  建连 {ramp:6.2f}s  "
+                  f"首页 {'超时' if latency is None else f'{latency:7.1f}ms'}  "
+                  f"RSS {rss or 0:7.1f}MB  线程 {threads}")
+            if latency is None or alive < target * 0.5:
+                # 服务已无法响应，更高阶梯没有意义
+                break
+    finally:
+        for conn in conns:
+            conn.close()
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        os.unlink(db_path)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='threading,eventlet')
+    parser.add_argument('--steps', default='100,500,1000,2000')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--hold', type=float, default=3, help='每个阶梯建连后保持的秒数 (期间经历心跳)')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出全部结果')
+    args = parser.parse_args()
+
+    steps = [int(s) for s in args.steps.split(',')]
+    results = []
+    for mode in args.modes.split(','):
+        print(f"== {mode} ==")
+        results.extend(run_mode(mode, steps, args.port, args.hold))
+
+    print()
+    print(f"{'模式':<10} {'目标':>6} {'在线':>6} {'首页(ms)':>9} {'RSS(MB)':>8} {'线程':>6}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['target']:>6} {r['connected']:>6} {str(r['http_ms']):>9} "
+              f"{str(r['rss_mb']):>8} {str(r['threads']):>6}")
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+上传图片处理基准
+
+不连接数据库，用合成照片 (带噪点的渐变，接近真实照片的压缩率) 测量：
+  1. 上传请求内的耗时：保存原图 (store_upload) 与旧方式直接写文件对比
+  2. 后台生成衍生图的耗时 (单线程 / 线程池并行)
+  3. 首页卡片图的字节数：原图与 card 衍生图对比
+
+用法: python benchmarks/bench_images.py [--images 8] [--width 4000] [--height 3000]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from images import store_upload, make_variants, IMAGE_WORKERS
+
+
+def make_photo(width, height, seed):
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed)
+    im = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    buf = io.BytesIO()
+    im.save(buf, 'JPEG', quality=92)
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=8)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    args = parser.parse_args()
+
+    photos = [make_photo(args.width, args.height, i) for i in range(args.images)]
+    total_mb = sum(len(p) for p in photos) / 1024 / 1024
+    print(f"{args.images} photos {args.width}x{args.height}, {total_mb:.1f} MB in total")
+
+    with tempfile.TemporaryDirectory() as folder:
+        t = time.perf_counter()
+        for i, data in enumerate(photos):
+            with open(os.path.join(folder, f"{i}_raw.jpg"), 'wb') as f:
+                f.write(data)
+        raw = time.perf_counter() - t
+
+        t = time.perf_counter()
+        names = [store_upload(io.BytesIO(data), folder) for data in photos]
+        stored = time.perf_counter() - t
+        print(f"upload path : raw save {raw / len(photos) * 1000:.1f} ms/img, "
+              f"store_upload {stored / len(photos) * 1000:.1f} ms/img")
+
+        paths = [os.path.join(folder, name) for name in names]
+        t = time.perf_counter()
+        make_variants(paths[0])
+        single = time.perf_counter() - t
+        print(f"variants    : {single * 1000:.0f} ms/img (1 thread)")
+
+        t = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as pool:
+            list(pool.map(make_variants, paths[1:]))
+        pooled = time.perf_counter() - t
+        if len(paths) > 1:
+            print(f"variants    : {(len(paths) - 1) / pooled:.1f} img/s ({IMAGE_WORKERS} threads)")
+
+        original = sum(len(p) for p in photos) / len(photos)
+        card = sum(os.path.getsize(f"{os.path.splitext(p)[0]}_card.webp") for p in paths) / len(paths)
+        print(f"card bytes  : original {original / 1024:.0f} KB -> card {card / 1024:.1f} KB "
+              f"({original / card:.0f}x smaller)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+全文检索基准
+
+不连接数据库，直接向索引写入合成拍品后测量：
+  1. 建索引速度与词条数
+  2. 不同选择度查询的耗时 (中文双字 / 英文前缀 / 精确单词 / 多词组合)
+
+用法: python benchmarks/bench_search.py [--items 1000000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import SearchIndex
+
+WORDS = ['手机', '电脑', '相机', '耳机', '键盘', '鼠标', '球鞋', '手办', '吉他', '茶叶', '红酒', '书籍',
+         '手表', '背包', '台灯', '音箱', '镜头', '滑板', '钢笔', '盲盒']
+CATEGORIES = ['二手数码产品', '户外装备', '动漫潮玩 & 手办盲盒', '乐器设备', '其他']
+STATUSES = ['active', 'approved', 'ended', 'ended', 'ended']
+
+QUERIES = ['手机', '手机电脑', '吉他 model1', 'mod', 'model123', 'seller42', 'seller42 手表']
+
+
+def build(n_items):
+    index = SearchIndex()
+    rnd = random.Random(42)
+    t0 = time.perf_counter()
+    for item_id in range(1, n_items + 1):
+        name = ''.join(rnd.sample(WORDS, 3)) + f' model{item_id % 9973}'
+        index._index(item_id, name, '九成新，功能正常，' + rnd.choice(WORDS), rnd.choice(CATEGORIES), None,
+                     rnd.choice(STATUSES), item_id % 5000, None, f'seller{item_id % 5000}', None)
+    index._loaded = True
+    index._last_refresh = float('inf')
+    return index, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    index, elapsed = build(args.items)
+    print(f"build       : {args.items} items in {elapsed:.1f}s, {len(index._postings)} tokens")
+
+    for q in QUERIES:
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            ids = index.search(q, limit=1000)
+        ms = (time.perf_counter() - t0) / args.repeat * 1000
+        print(f"{q:<14}: {len(ids):>5} hits (top 1000)         {ms:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
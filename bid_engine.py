@@ -0,0 +1,335 @@
+"""
+内存竞价引擎
+
+- 每个进行中拍品的 当前价 / 领先者 / 加价幅度 / 截止时间 常驻内存 (ItemBook)
+- 同一拍品的出价在该拍品自己的锁内严格串行处理，不同拍品之间互不阻塞
+- 出价在内存中完成校验与防狙击判断后立即返回，
+  成交记录进入写入队列，由后台线程批量写入 bids / items 表
+- 每个拍品附带出价汇总 (bid_summary.BidSummary)，防狙击的窗口计数直接读汇总，
+  随每批写入一起把汇总检查点写回 bid_summaries 表
+- 多进程部署时 (shared 模式) 同一拍品可能在多个进程中被出价，内存状态只作为预判：
+  每笔出价以 "当前价 + 截止时间未变" 为条件直接 UPDATE items (compare-and-set)，
+  条件不成立说明其他进程已接受了出价，重新从数据库加载后再判断
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import and_
+from extensions import db, socketio
+from models import Item, Bid
+from bid_summary import BidSummary, load_summaries, save_summaries
+
+# 防狙击规则参数 (与原 on_bid 保持一致)
+SNIPE_WINDOW = timedelta(minutes=3)      # 策略1: 截止前3分钟窗口
+SNIPE_WINDOW_BIDS = 3                    # 窗口内第3笔出价触发
+SNIPE_WINDOW_EXTEND = timedelta(minutes=5)
+LAST_CALL = timedelta(seconds=30)        # 策略2: 最后30秒出价
+LAST_CALL_EXTEND = timedelta(minutes=3)
+# shared 模式下 compare-and-set 失败后的最多重试次数
+SHARED_MAX_ATTEMPTS = 3
+
+
+class ItemBook:
+    """单个拍品在内存中的竞价状态"""
+    __slots__ = ('item_id', 'seller_id', 'start_price', 'price', 'increment',
+                 'leader_id', 'end_time', 'closed', 'summary')
+
+    def __init__(self, item_id, seller_id, start_price, price, increment, leader_id, end_time, summary=None):
+        self.item_id = item_id
+        self.seller_id = seller_id
+        self.start_price = Decimal(start_price)
+        self.price = Decimal(price)
+        self.increment = Decimal(increment if increment is not None else '10.00')
+        self.leader_id = leader_id
+        self.end_time = end_time
+        self.closed = False
+        # 出价汇总：总次数 / 出价用户 / 最近出价环形缓冲 (防狙击窗口计数)
+        self.summary = summary if summary is not None else BidSummary(item_id)
+
+    def min_bid(self):
+        if self.leader_id is None:
+            return self.start_price
+        return self.price + self.increment
+
+
+class BidEngine:
+    def __init__(self, flush_interval=0.05, batch_size=500):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._books = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        # 待写库的已成交出价 (按接受顺序)
+        self._pending = deque()
+        self._retry = []
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = False
+        # 多进程部署时由 app.py 打开，见模块说明
+        self.shared = False
+
+    # --- 内存状态 ---
+    def _lock_for(self, item_id):
+        lock = self._locks.get(item_id)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(item_id, threading.Lock())
+        return lock
+
+    def put_book(self, book):
+        """直接放入一个拍品状态 (用于预热和基准测试)"""
+        with self._lock_for(book.item_id):
+            self._books[book.item_id] = book
+
+    def _load(self, item_id, now):
+        """
+        从数据库加载拍品状态，调用方需持有该拍品的锁
+        (不能在这里 flush：flush 会逐个获取拍品的锁，而拍品锁不可重入，见 place_bid)
+        """
+        # populate_existing：shared 模式下需要读到其他进程刚提交的价格
+        item = Item.query.populate_existing().filter_by(id=item_id).first()
+        if not item or item.status != 'active':
+            return None
+        summary = load_summaries([item_id])[item_id]
+        book = ItemBook(item.id, item.seller_id, item.start_price, item.current_price,
+                        item.increment, item.highest_bidder_id, item.end_time, summary)
+        self._books[item_id] = book
+        return book
+
+    def place_bid(self, item_id, user_id, amount, now=None):
+        """
+        处理一笔出价
+        :return: dict, ok=True 时包含 price / end_time / extended / total_bids / unique_bidders；
+                 ok=False 时 msg 为提示信息 (None 表示静默忽略)，ended 表示拍卖已结束
+        """
+        if now is None:
+            now = datetime.now()
+        if not self.shared and item_id not in self._books and (self._pending or self._retry):
+            # 需要从数据库加载时，先在锁外写入尚未落库的出价，避免读到旧价格
+            # (锁顺序始终为 _flush_lock -> 拍品锁，持有拍品锁时不调用 flush)
+            self.flush()
+        with self._lock_for(item_id):
+            if not self.shared:
+                book = self._books.get(item_id)
+                if book is None:
+                    book = self._load(item_id, now)
+                result = self._decide(book, user_id, amount, now)
+                if result['ok']:
+                    self._accept(book, user_id, amount, now, result['end_time'], result)
+                    # 在锁内入队，保证同一拍品的写入顺序与接受顺序一致
+                    self._pending.append((item_id, user_id, amount, now, result['end_time']))
+            else:
+                result = self._place_shared(item_id, user_id, amount, now)
+        if result['ok'] and not self.shared:
+            self._wakeup.set()
+        return result
+
+    def _decide(self, book, user_id, amount, now):
+        """校验出价并计算防狙击延时，不修改内存状态"""
+        if book is None or book.closed:
+            return {'ok': False, 'msg': None}
+
+        # 禁止连续出价
+        if book.leader_id == user_id:
+            return {'ok': False, 'msg': '您已经是当前最高出价者，不可重复出价'}
+
+        if now > book.end_time:
+            # 状态流转与结算交给后台任务统一处理
+            return {'ok': False, 'msg': '拍卖已结束', 'ended': True}
+
+        min_bid = book.min_bid()
+        if amount < min_bid:
+            return {'ok': False, 'msg': f'出价必须高于 {min_bid}'}
+
+        # 防狙击机制
+        end_time = book.end_time
+        time_left = end_time - now
+        extended = False
+        strategy1_triggered = False
+
+        # 策略1: 最后3分钟内出现第3次及以上出价，自动延长5分钟
+        if time_left < SNIPE_WINDOW:
+            window_start = end_time - SNIPE_WINDOW
+            recent_bids_count = book.summary.window_count(window_start)
+            if recent_bids_count + 1 >= SNIPE_WINDOW_BIDS:
+                end_time += SNIPE_WINDOW_EXTEND
+                extended = True
+                strategy1_triggered = True
+
+        # 策略2: 最后30秒内有人出价，自动延长3分钟 (仅当策略1未触发时)
+        if not strategy1_triggered and time_left < LAST_CALL:
+            end_time += LAST_CALL_EXTEND
+            extended = True
+
+        return {'ok': True, 'price': amount, 'end_time': end_time, 'extended': extended}
+
+    def _accept(self, book, user_id, amount, now, end_time, result):
+        book.price = amount
+        book.leader_id = user_id
+        book.end_time = end_time
+        book.summary.record(user_id, amount, now)
+        result['total_bids'] = book.summary.total_bids
+        result['unique_bidders'] = len(book.summary.bidders)
+
+    def _place_shared(self, item_id, user_id, amount, now):
+        """shared 模式：以内存状态为预期值直接条件更新数据库，调用方需持有该拍品的锁"""
+        book = self._books.get(item_id)
+        for attempt in range(SHARED_MAX_ATTEMPTS):
+            if book is None:
+                book = self._load(item_id, now)
+            result = self._decide(book, user_id, amount, now)
+            if not result['ok']:
+                # 内存状态可能已过期 (其他进程出价/延时)，拒绝前先以数据库为准再判断一次
+                if attempt == 0 and book is not None:
+                    book = None
+                    continue
+                return result
+            items = Item.__table__
+            expected = and_(items.c.id == item_id, items.c.status == 'active',
+                            items.c.current_price == book.price, items.c.end_time == book.end_time)
+            if book.leader_id is None:
+                expected = and_(expected, items.c.highest_bidder_id.is_(None))
+            # 先在内存中接受 (汇总检查点与出价同一事务写入)，失败时丢弃该内存状态
+            self._accept(book, user_id, amount, now, result['end_time'], result)
+            try:
+                updated = db.session.execute(items.update().where(expected).values(
+                    current_price=amount, highest_bidder_id=user_id, end_time=result['end_time']
+                )).rowcount
+                if updated:
+                    db.session.execute(Bid.__table__.insert().values(
+                        item_id=item_id, user_id=user_id, amount=amount, timestamp=now))
+                    save_summaries([book.summary.to_row()])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Bid engine shared write error: {e}")
+                self._books.pop(item_id, None)
+                return {'ok': False, 'msg': '出价失败，请稍后重试'}
+            if updated:
+                return result
+            book = None
+        self._books.pop(item_id, None)
+        return {'ok': False, 'msg': '出价人数较多，请刷新后重试'}
+
+    def seal(self, item_id, now=None):
+        """
+        拍卖结算前封盘：之后该拍品不再接受出价
+        :return: False 表示内存中的截止时间已被延长，暂不能结束
+        """
+        if now is None:
+            now = datetime.now()
+        with self._lock_for(item_id):
+            book = self._books.get(item_id)
+            if book is None:
+                return True
+            if book.end_time > now:
+                return False
+            book.closed = True
+            return True
+
+    def evict(self, item_id):
+        """拍品结束/下架后移出内存"""
+        with self._lock_for(item_id):
+            self._books.pop(item_id, None)
+
+    # --- 批量落库 ---
+    def _drain(self):
+        batch = self._retry
+        self._retry = []
+        while self._pending and len(batch) < self.batch_size:
+            batch.append(self._pending.popleft())
+        return batch
+
+    def flush(self):
+        """把已接受的出价写入数据库 (需在 app context 中调用)"""
+        with self._flush_lock:
+            while self._pending or self._retry:
+                batch = self._drain()
+                if not self._write(batch):
+                    break
+
+    def _write(self, batch):
+        latest = {}
+        for item_id, user_id, amount, ts, end_time in batch:
+            latest[item_id] = {
+                'id': item_id,
+                'current_price': amount,
+                'highest_bidder_id': user_id,
+                'end_time': end_time,
+            }
+        try:
+            db.session.bulk_insert_mappings(Bid, [
+                {'item_id': item_id, 'user_id': user_id, 'amount': amount, 'timestamp': ts}
+                for item_id, user_id, amount, ts, end_time in batch
+            ])
+            db.session.bulk_update_mappings(Item, list(latest.values()))
+            save_summaries(self._summary_rows(latest))
+            db.session.commit()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            # 保留本批次，下次重试
+            self._retry = batch + self._retry
+            print(f"Bid engine flush error: {e}")
+            return False
+
+    def _summary_rows(self, item_ids):
+        """在各拍品锁内生成汇总检查点 (可能已包含稍后批次中的出价，下一批会再次覆盖)"""
+        rows = []
+        for item_id in item_ids:
+            with self._lock_for(item_id):
+                book = self._books.get(item_id)
+                if book is not None:
+                    rows.append(book.summary.to_row())
+        return rows
+
+    def get_summary(self, item_id):
+        """
+        读取拍品出价汇总：本进程内存中有该拍品时直接返回快照，否则读检查点
+        (shared 模式下其他进程也会出价，总是读检查点)
+        """
+        if not self.shared:
+            with self._lock_for(item_id):
+                book = self._books.get(item_id)
+                if book is not None:
+                    s = book.summary
+                    return BidSummary(item_id, s.total_bids, s.bidders, s.recent)
+        return load_summaries([item_id])[item_id]
+
+    def get_summaries(self, item_ids):
+        """批量读取出价汇总 (get_summary 的批量版)：内存中没有的拍品一次 IN 查询读检查点"""
+        summaries = {}
+        if not self.shared:
+            for item_id in item_ids:
+                with self._lock_for(item_id):
+                    book = self._books.get(item_id)
+                    if book is not None:
+                        s = book.summary
+                        summaries[item_id] = BidSummary(item_id, s.total_bids, s.bidders, s.recent)
+        summaries.update(load_summaries([i for i in item_ids if i not in summaries]))
+        return summaries
+
+    def start(self, app):
+        """启动后台写入任务"""
+        if self._started:
+            return
+        self._started = True
+        socketio.start_background_task(self._run, app)
+
+    def _run(self, app):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # 稍作等待以攒批
+            time.sleep(self.flush_interval)
+            with app.app_context():
+                self.flush()
+                db.session.remove()
+            if self._retry:
+                time.sleep(1)
+                self._wakeup.set()
+
+
+bid_engine = BidEngine()
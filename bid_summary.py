@@ -0,0 +1,102 @@
+"""
+拍品出价汇总 (读模型)
+
+每个拍品维护：总出价次数、出价用户集合、最近 N 笔出价的环形缓冲。
+- 竞价引擎接受出价时增量更新 (随 ItemBook 常驻内存)，防狙击的窗口计数直接读环形缓冲
+- 随出价批量落库时写回 bid_summaries 表作为检查点，
+  结算时的未中标者通知、拍品详情页的出价记录都读取汇总，而不扫描 bids 表
+- 没有检查点的旧拍品读取时从 bids 表重建
+"""
+import json
+from collections import deque
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import func
+from extensions import db
+from models import Bid, ItemBidSummary
+
+# 环形缓冲保留的最近出价笔数
+RECENT_BIDS = 20
+
+
+class BidSummary:
+    __slots__ = ('item_id', 'total_bids', 'bidders', 'recent')
+
+    def __init__(self, item_id, total_bids=0, bidders=(), recent=()):
+        self.item_id = item_id
+        self.total_bids = total_bids
+        self.bidders = set(bidders)
+        # (时间, 用户id, 金额)，按时间正序
+        self.recent = deque(recent, maxlen=RECENT_BIDS)
+
+    def record(self, user_id, amount, ts):
+        self.total_bids += 1
+        self.bidders.add(user_id)
+        self.recent.append((ts, user_id, amount))
+
+    def window_count(self, since):
+        """since 之后的出价笔数 (最多 RECENT_BIDS 笔，防狙击判断只需要最近几笔)"""
+        n = 0
+        for ts, _, _ in reversed(self.recent):
+            if ts < since:
+                break
+            n += 1
+        return n
+
+    def last_bids(self, limit=RECENT_BIDS):
+        """最近的出价，新的在前"""
+        return list(reversed(self.recent))[:limit]
+
+    def to_row(self):
+        return {
+            'item_id': self.item_id,
+            'total_bids': self.total_bids,
+            'unique_bidders': len(self.bidders),
+            'bidder_ids': ','.join(map(str, sorted(self.bidders))),
+            'recent_bids': json.dumps([[ts.isoformat(), uid, str(amount)] for ts, uid, amount in self.recent]),
+            'updated_at': datetime.now(),
+        }
+
+    @classmethod
+    def from_row(cls, row):
+        bidders = [int(u) for u in row.bidder_ids.split(',') if u]
+        recent = [(datetime.fromisoformat(ts), uid, Decimal(amount)) for ts, uid, amount in json.loads(row.recent_bids or '[]')]
+        return cls(row.item_id, row.total_bids, bidders, recent)
+
+
+def _rebuild(item_id):
+    """从 bids 表重建汇总 (仅用于没有检查点的拍品)"""
+    total = db.session.query(func.count(Bid.id)).filter(Bid.item_id == item_id).scalar() or 0
+    if not total:
+        return BidSummary(item_id)
+    bidders = [uid for (uid,) in db.session.query(Bid.user_id).filter(Bid.item_id == item_id).distinct()]
+    recent = db.session.query(Bid.timestamp, Bid.user_id, Bid.amount).filter(
+        Bid.item_id == item_id
+    ).order_by(Bid.id.desc()).limit(RECENT_BIDS).all()
+    return BidSummary(item_id, total, bidders, reversed([tuple(r) for r in recent]))
+
+
+def load_summaries(item_ids):
+    """按拍品读取检查点 (一次 IN 查询)，缺失的从 bids 表重建 (下一笔出价落库时写回)"""
+    item_ids = list(item_ids)
+    if not item_ids:
+        return {}
+    summaries = {
+        row.item_id: BidSummary.from_row(row)
+        for row in ItemBidSummary.query.filter(ItemBidSummary.item_id.in_(item_ids)).all()
+    }
+    for item_id in item_ids:
+        if item_id not in summaries:
+            summaries[item_id] = _rebuild(item_id)
+    return summaries
+
+
+def save_summaries(rows):
+    """写回检查点 (不提交)：已存在的 UPDATE，新的 INSERT"""
+    if not rows:
+        return
+    existing = {item_id for (item_id,) in db.session.query(ItemBidSummary.item_id).filter(
+        ItemBidSummary.item_id.in_([r['item_id'] for r in rows])
+    )}
+    db.session.bulk_update_mappings(ItemBidSummary, [r for r in rows if r['item_id'] in existing])
+    db.session.bulk_insert_mappings(ItemBidSummary, [r for r in rows if r['item_id'] not in existing])
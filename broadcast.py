@@ -0,0 +1,114 @@
+"""
+价格广播合并
+
+热门拍品最后时刻的竞价中，每笔出价都向 item_<id> 房间广播一次 price_update，
+房间内的每个连接都要单独序列化与发送。设置 PRICE_UPDATE_COALESCE_MS (例如 50~100) 开启合并后，按拍品房间：
+- 距离该房间上次广播已超过合并窗口的出价立即广播，冷门拍品没有额外延迟
+- 窗口内的后续出价暂存，窗口结束时合并为一条广播：价格、出价人、截止时间、出价统计取最新一笔，
+  extended 为窗口内任一笔触发过防狙击延时，bids 为窗口内各笔出价 [[价格, 出价人], ...]
+  (最多保留最近 PRICE_UPDATE_MAX_BIDS 笔)，coalesced 为合并的出价笔数
+出价人自己的确认 (bid_ack) 由 events.on_bid 立即发送，不经过合并。
+PRICE_BROADCAST_METRICS 记录出价数、实际广播数与合并省下的广播数。
+未设置时 (默认 0) 每笔出价立即广播，与合并前的行为相同。
+"""
+import os
+import threading
+import time
+from extensions import socketio
+
+# 合并窗口 (毫秒)，0 表示不合并
+PRICE_UPDATE_COALESCE_MS = int(os.environ.get('PRICE_UPDATE_COALESCE_MS', '0'))
+# 合并广播中最多携带的出价笔数
+PRICE_UPDATE_MAX_BIDS = 20
+
+# updates: 出价数, broadcasts: 实际广播数, saved: 合并省下的广播数
+PRICE_BROADCAST_METRICS = {'updates': 0, 'broadcasts': 0, 'saved': 0}
+
+
+class PriceBroadcaster:
+    def __init__(self, window_ms=PRICE_UPDATE_COALESCE_MS):
+        self.window = window_ms / 1000
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._last_sent = {}   # item_id -> 上次广播时间 (monotonic)
+        self._pending = {}     # item_id -> 窗口内暂存的出价
+        self._started = False
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def publish(self, item_id, payload):
+        """广播一笔出价的 price_update (payload 格式见 events.on_bid)"""
+        now = time.monotonic()
+        send = True
+        with self._lock:
+            PRICE_BROADCAST_METRICS['updates'] += 1
+            if self.enabled:
+                pending = self._pending.get(item_id)
+                if pending is not None or now - self._last_sent.get(item_id, -self.window) < self.window:
+                    send = False
+                    if pending is None:
+                        pending = self._pending[item_id] = {
+                            'due': self._last_sent[item_id] + self.window, 'payload': None, 'bids': [], 'extended': False
+                        }
+                    pending['payload'] = payload
+                    pending['bids'].append([payload['new_price'], payload['bidder_name']])
+                    pending['extended'] = pending['extended'] or payload['extended']
+                else:
+                    self._last_sent[item_id] = now
+            if send:
+                PRICE_BROADCAST_METRICS['broadcasts'] += 1
+            start = not send and not self._started
+            self._started = self._started or start
+        if send:
+            self._emit(item_id, payload)
+            return
+        if start:
+            # 第一次出现需要合并的出价时启动合并任务 (不依赖入口脚本是否启动了后台服务)
+            socketio.start_background_task(self._run)
+        self._wakeup.set()
+
+    def _emit(self, item_id, payload):
+        socketio.emit('price_update', payload, room=f"item_{item_id}")
+
+    def _merge(self, pending):
+        bids = pending['bids']
+        return dict(pending['payload'], extended=pending['extended'],
+                    bids=bids[-PRICE_UPDATE_MAX_BIDS:], coalesced=len(bids))
+
+    def flush(self, force=False):
+        """发送已到期 (force=True 时为全部) 的合并广播，返回下一个到期时间 (没有暂存时为 None)"""
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for item_id, pending in list(self._pending.items()):
+                if force or pending['due'] <= now:
+                    due.append((item_id, self._pending.pop(item_id)))
+                    self._last_sent[item_id] = now
+                    PRICE_BROADCAST_METRICS['broadcasts'] += 1
+                    PRICE_BROADCAST_METRICS['saved'] += len(pending['bids']) - 1
+            next_due = min((p['due'] for p in self._pending.values()), default=None)
+            if next_due is None:
+                # 已超过窗口的房间下一笔出价会立即广播，无需继续记录
+                for item_id, sent in list(self._last_sent.items()):
+                    if now - sent >= self.window:
+                        del self._last_sent[item_id]
+        for item_id, pending in due:
+            self._emit(item_id, self._merge(pending))
+        return next_due
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(60)
+            self._wakeup.clear()
+            try:
+                next_due = self.flush()
+                while next_due is not None:
+                    socketio.sleep(max(next_due - time.monotonic(), 0))
+                    next_due = self.flush()
+            except Exception as e:
+                print(f"Price broadcast error: {e}")
+
+
+price_broadcaster = PriceBroadcaster()
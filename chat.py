@@ -4,8 +4,41 @@ from flask_socketio import emit, join_room, leave_room
 from models import User, Item, ChatSession, Message
 from extensions import db
 from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+from counters import counters
+from conn_state import conn_states
+from images import variant_path
 from datetime import datetime
 
+# 打开会话时加载的最近消息条数，更早的消息通过 Socket.IO 'load_older' 分页获取
+HISTORY_PAGE_SIZE = 50
+
+def serialize_message(m):
+    return {
+        'id': m.id,
+        'sender': m.sender.username,
+        'sender_id': m.sender_id,
+        'msg': m.content,
+        'timestamp': m.timestamp.isoformat(),
+        'avatar': variant_path(m.sender.avatar, m.sender.avatar_variants, 'thumb')
+    }
+
+def load_history(session_id, before_id=None, limit=HISTORY_PAGE_SIZE):
+    """
+    按 id 倒序取一页消息 (发送者一并 JOIN 加载)，返回时间正序
+    :return: (消息列表, 更早一页的游标 或 None)
+    """
+    q = Message.query.options(joinedload(Message.sender)).filter(Message.chat_session_id == session_id)
+    if before_id:
+        q = q.filter(Message.id < before_id)
+    msgs = q.order_by(Message.id.desc()).limit(limit + 1).all()
+    older_cursor = None
+    if len(msgs) > limit:
+        msgs = msgs[:limit]
+        older_cursor = msgs[-1].id
+    msgs.reverse()
+    return [serialize_message(m) for m in msgs], older_cursor
+
 def register_chat_routes(app):
     @app.route('/inbox')
     @login_required
@@ -15,7 +48,10 @@ def register_chat_routes(app):
             flash('您尚未完成实名认证。<a href="' + url_for('verify_identity') + '" class="btn btn-sm btn-primary ms-2">现在去实名</a> <button type="button" class="btn btn-sm btn-secondary ms-2" data-bs-dismiss="alert">明白了，稍后再去</button>')
             return redirect(url_for('verify_identity'))
         # 获取我参与的所有会话，按时间倒序
-        all_sessions = ChatSession.query.filter(
+        # 双方用户与拍品随会话一次 JOIN 加载，避免逐个懒加载
+        all_sessions = ChatSession.query.options(
+            joinedload(ChatSession.buyer), joinedload(ChatSession.seller), joinedload(ChatSession.item)
+        ).filter(
             or_(ChatSession.buyer_id == current_user.id, ChatSession.seller_id == current_user.id)
         ).order_by(ChatSession.updated_at.desc()).all()
         
@@ -73,23 +109,15 @@ def register_chat_routes(app):
         # 查找或创建会话
         session = ChatSession.query.filter_by(item_id=item_id, buyer_id=buyer_id, seller_id=seller_id).first()
         history_messages = []
+        older_cursor = None
         
         if not session:
             session = ChatSession(item_id=item_id, buyer_id=buyer_id, seller_id=seller_id)
             db.session.add(session)
             db.session.commit() # 需要 commit 获取 id 以便关联 message
         else:
-            # 加载历史消息
-            msgs = Message.query.filter_by(chat_session_id=session.id).order_by(Message.timestamp).all()
-            for m in msgs:
-                sender = User.query.get(m.sender_id)
-                history_messages.append({
-                    'sender': sender.username,
-                    'sender_id': m.sender_id,
-                    'msg': m.content,
-                    'timestamp': m.timestamp.isoformat(),
-                    'avatar': sender.avatar
-                })
+            # 只加载最近一页历史消息
+            history_messages, older_cursor = load_history(session.id)
 
         # 清除未读计数
         if current_user.id == buyer_id:
@@ -98,18 +126,40 @@ def register_chat_routes(app):
             session.seller_unread = 0
         
         db.session.commit()
+        counters.mark_read(current_user.id, session.id)
         
-        return render_template('chat.html', item=item, other_user=other_user, current_user=current_user, history_messages=history_messages)
+        return render_template('chat.html', item=item, other_user=other_user, current_user=current_user,
+                               history_messages=history_messages, chat_session_id=session.id, older_cursor=older_cursor)
 
 def register_chat_events(socketio):
     @socketio.on('join_chat')
     def on_join_chat(data):
-        room = data.get('room')
-        if room:
+        # 只能加入自己参与的私信房间 (见 conn_state.ConnState.can_join)
+        state = conn_states.get(request.sid)
+        room = data.get('room') if isinstance(data, dict) else None
+        if state and state.can_join(room):
             join_room(room)
             # 可以选择不广播进入消息，避免刷屏
             # emit('status', {'msg': f'{current_user.username} is connected'}, room=room)
 
+    @socketio.on('load_older')
+    def on_load_older(data):
+        """加载更早的聊天记录：{session_id, before} -> 'older_messages'"""
+        # 与其他事件一致，按连接状态识别用户，不访问 current_user
+        state = conn_states.get(request.sid)
+        if not state or not isinstance(data, dict):
+            return
+        try:
+            session_id = int(data.get('session_id'))
+            before_id = int(data.get('before'))
+        except (TypeError, ValueError):
+            return
+        members = db.session.query(ChatSession.buyer_id, ChatSession.seller_id).filter_by(id=session_id).first()
+        if not members or state.user_id not in members:
+            return
+        messages, older_cursor = load_history(session_id, before_id)
+        emit('older_messages', {'session_id': session_id, 'messages': messages, 'older_cursor': older_cursor})
+
     @socketio.on('send_message')
     def on_send_message(data):
         # 未实名认证禁止发送消息
@@ -120,6 +170,10 @@ def register_chat_events(socketio):
         item_id = data.get('item_id')
         receiver_id = data.get('receiver_id')
         timestamp = data.get('timestamp')
+        # 消息只能发往自己参与的私信房间
+        state = conn_states.get(request.sid)
+        if not state or not state.in_chat(room):
+            return
         
         if room and msg:
             # 更新会话状态（持久化 Last Message 和未读计数）
@@ -161,6 +215,7 @@ def register_chat_events(socketio):
                             db.session.add(new_msg)
                             
                             db.session.commit()
+                            counters.mark_unread(session.seller_id if current_user.id == session.buyer_id else session.buyer_id, session.id)
                             
                             # 发送通知给接收者
                             emit('new_chat_notification', {'msg': '您有一条新私信'}, room=f"user_{receiver_id}")
@@ -171,7 +226,7 @@ def register_chat_events(socketio):
             emit('new_message', {
                 'sender': current_user.username,
                 'sender_id': current_user.id,
-                'avatar': current_user.avatar,
+                'avatar': variant_path(current_user.avatar, current_user.avatar_variants, 'thumb'),
                 'msg': msg,
                 'timestamp': timestamp
             }, room=room)
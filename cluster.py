@@ -0,0 +1,137 @@
+"""
+多进程部署支持
+
+- 消息队列：各 web worker 通过 Socket.IO 的 client manager 共享房间广播。
+  SOCKETIO_MESSAGE_QUEUE 可以是 redis:// / amqp:// 等 (由 python-socketio 提供)，
+  也可以是 local:// —— 进程内的替身实现，只用于单进程调试和测试
+- leader 选举：worker_leases 表中的租约，持有租约的进程运行定时任务
+  (拍卖调度器、订单超时检查)，其他进程只处理请求；leader 失联后租约过期，由其他进程接管
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+import socketio as sio
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from extensions import db, socketio
+from models import WorkerLease
+
+# 租约有效期与续约间隔 (秒)
+LEASE_TTL = 15
+LEASE_RENEW_INTERVAL = 5
+# 多进程时 leader 从数据库同步其他进程登记的开始/结束时间的间隔 (秒)
+SCHEDULE_SYNC_INTERVAL = 10
+
+
+class LocalPubSubManager(sio.PubSubManager):
+    """
+    进程内消息队列替身：同一进程中使用相同 channel 的多个 Socket.IO 服务端互相转发广播
+    不依赖外部服务，用于单进程调试与测试；真正的多进程部署请使用 redis 等
+    """
+    name = 'local'
+    _channels = {}
+    _guard = threading.Lock()
+
+    def _publish(self, data):
+        with self._guard:
+            subscribers = list(self._channels.get(self.channel, ()))
+        for inbox in subscribers:
+            inbox.append(data)
+
+    def _listen(self):
+        inbox = deque()
+        with self._guard:
+            self._channels.setdefault(self.channel, []).append(inbox)
+        while True:
+            while inbox:
+                yield inbox.popleft()
+            # 用服务端的 sleep，兼容 eventlet / threading 等异步模式
+            self.server.sleep(0.01)
+
+
+def socketio_options(message_queue):
+    """根据消息队列地址生成 socketio.init_app 的参数"""
+    if not message_queue:
+        return {}
+    if message_queue.startswith('local://'):
+        channel = message_queue[len('local://'):] or 'socketio'
+        return {'client_manager': LocalPubSubManager(channel=channel)}
+    return {'message_queue': message_queue}
+
+
+class LeaderLease:
+    def __init__(self, name='tasks', ttl=LEASE_TTL):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until = 0.0
+
+    def is_leader(self):
+        return time.monotonic() < self._valid_until
+
+    def try_acquire(self):
+        """获取或续约 (需在 app context 中调用)，返回当前是否为 leader"""
+        started = time.monotonic()
+        now = datetime.now()
+        leases = WorkerLease.__table__
+        values = {'owner': self.owner, 'expires_at': now + self.ttl}
+        try:
+            result = db.session.execute(leases.update().where(
+                leases.c.name == self.name,
+                or_(leases.c.owner == self.owner, leases.c.expires_at < now)
+            ).values(**values))
+            if result.rowcount == 0:
+                db.session.execute(leases.insert().values(name=self.name, **values))
+            db.session.commit()
+        except IntegrityError:
+            # 租约已被其他进程持有
+            db.session.rollback()
+            self._valid_until = 0.0
+            return False
+        # 预留一个续约间隔的余量，避免与接管者同时运行
+        self._valid_until = started + self.ttl.total_seconds() - LEASE_RENEW_INTERVAL
+        return True
+
+    def release(self, app):
+        with app.app_context():
+            leases = WorkerLease.__table__
+            db.session.execute(leases.delete().where(leases.c.name == self.name, leases.c.owner == self.owner))
+            db.session.commit()
+            db.session.remove()
+        self._valid_until = 0.0
+
+
+leader_lease = LeaderLease()
+
+
+def run_leader_services(app, on_elected, on_tick=None):
+    """
+    后台任务：周期性竞选/续约，首次当选时调用 on_elected(app) 启动 leader 专属任务，
+    之后作为 leader 每隔 SCHEDULE_SYNC_INTERVAL 调用一次 on_tick(app)
+    """
+    def loop():
+        elected = False
+        last_tick = time.monotonic()
+        while True:
+            try:
+                with app.app_context():
+                    is_leader = leader_lease.try_acquire()
+                    if is_leader and not elected:
+                        elected = True
+                        app.logger.info(f"当选 leader ({leader_lease.owner})，启动定时任务")
+                        on_elected(app)
+                    elif is_leader and on_tick and time.monotonic() - last_tick >= SCHEDULE_SYNC_INTERVAL:
+                        last_tick = time.monotonic()
+                        on_tick(app)
+            except Exception as e:
+                print(f"Leader lease error: {e}")
+            finally:
+                with app.app_context():
+                    db.session.remove()
+            time.sleep(LEASE_RENEW_INTERVAL)
+
+    return socketio.start_background_task(loop)
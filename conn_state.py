@@ -0,0 +1,172 @@
+"""
+Socket.IO 连接状态缓存
+
+每个连接 (sid) 在 connect 时从数据库加载一次出价与加入房间所需的用户状态：
+  用户名、角色、是否实名、封禁截止时间、已缴纳 (frozen) 保证金的拍品 id 集合
+之后的 bid / join 等事件直接读取内存中的状态，不再经过 Flask-Login 的 user_loader 查询用户，
+也不再逐笔查询 Deposit 表。
+以下变更在事务中调用 mark_changed(user_id)，提交之后其连接的状态失效，下次使用时重新加载：
+  缴纳 / 使用 / 退还 / 没收保证金、封禁、实名认证
+多进程部署时其他进程的变更最迟在 STATE_TTL 秒后可见；保证金集合中没有某拍品时按 (用户, 拍品) 查询一次，
+未缴纳的结果缓存 DEPOSIT_MISS_TTL 秒，对未缴纳保证金的拍品反复出价不会每次都查询数据库。
+"""
+import re
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from extensions import db
+from models import User, Deposit
+
+# 兜底过期时间 (秒)
+STATE_TTL = 60
+# "未缴纳保证金" 结果的缓存时间 (秒) 与每个连接最多缓存的拍品数
+DEPOSIT_MISS_TTL = 5
+DEPOSIT_MISS_LIMIT = 256
+
+_ITEM_ROOM = re.compile(r'^item_(\d+)$')
+_CHAT_ROOM = re.compile(r'^chat_item_(\d+)_(\d+)_(\d+)$')
+
+
+class ConnState:
+    __slots__ = ('user_id', 'username', 'role', 'verified', 'banned_until', 'deposits', 'deposit_misses', 'expires')
+
+    def __init__(self, user, deposits):
+        self.user_id = user.id
+        self.username = user.username
+        self.role = user.role
+        self.verified = bool(user.is_verified)
+        self.banned_until = user.banned_until
+        self.deposits = deposits
+        self.deposit_misses = {}   # item_id -> 缓存到期时间 (monotonic)
+        self.expires = time.monotonic() + STATE_TTL
+
+    def is_banned(self, now=None):
+        return bool(self.banned_until and self.banned_until > (now or datetime.now()))
+
+    def can_join(self, room):
+        """
+        房间权限：
+        - item_<id>：拍品价格广播，与拍品详情页公开的信息相同，登录用户均可加入
+        - chat_item_<item>_<u1>_<u2>：私信房间，只有会话双方可以加入
+        - user_<id> / admin_room 只在 connect / join_check 中由服务端加入
+        """
+        if not isinstance(room, str):
+            return False
+        return bool(_ITEM_ROOM.match(room)) or self.in_chat(room)
+
+    def in_chat(self, room):
+        """是否为本用户参与的私信房间"""
+        m = _CHAT_ROOM.match(room) if isinstance(room, str) else None
+        return bool(m) and self.user_id in (int(m.group(2)), int(m.group(3)))
+
+
+class ConnectionStates:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_sid = {}    # sid -> ConnState
+        self._by_user = {}   # user_id -> {sid}
+
+    def _load(self, user_id):
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        deposits = {
+            item_id for (item_id,) in db.session.query(Deposit.item_id).filter(
+                Deposit.user_id == user_id, Deposit.status == 'frozen'
+            ).all()
+        }
+        return ConnState(user, deposits)
+
+    def open(self, sid, user_id):
+        """连接建立时加载状态 (一次用户查询 + 一次保证金查询)"""
+        state = self._load(user_id)
+        if state is None:
+            return None
+        with self._lock:
+            self._by_sid[sid] = state
+            self._by_user.setdefault(user_id, set()).add(sid)
+        return state
+
+    def close(self, sid):
+        with self._lock:
+            state = self._by_sid.pop(sid, None)
+            if state:
+                sids = self._by_user.get(state.user_id)
+                if sids:
+                    sids.discard(sid)
+                    if not sids:
+                        del self._by_user[state.user_id]
+
+    def get(self, sid):
+        """当前连接的状态 (未登录的连接返回 None)，已失效或过期时重新加载"""
+        with self._lock:
+            state = self._by_sid.get(sid)
+        if state is None or state.expires > time.monotonic():
+            return state
+        fresh = self._load(state.user_id)
+        with self._lock:
+            if sid in self._by_sid:
+                if fresh is None:
+                    self._by_sid.pop(sid)
+                else:
+                    self._by_sid[sid] = fresh
+        return fresh
+
+    def count(self):
+        """本进程中已登录的连接数"""
+        return len(self._by_sid)
+
+    def has_deposit(self, sid, item_id):
+        """
+        是否已为拍品缴纳保证金；集合中没有时查询一次该拍品 (其他进程刚缴纳的情况)，
+        未缴纳的结果缓存 DEPOSIT_MISS_TTL 秒 (本进程中缴纳后由 mark_changed 立即失效)
+        """
+        state = self.get(sid)
+        if state is None:
+            return False
+        if item_id in state.deposits:
+            return True
+        now = time.monotonic()
+        if state.deposit_misses.get(item_id, 0) > now:
+            return False
+        found = db.session.query(Deposit.id).filter(
+            Deposit.user_id == state.user_id, Deposit.item_id == item_id, Deposit.status == 'frozen'
+        ).first() is not None
+        with self._lock:
+            if found:
+                state.deposits.add(item_id)
+            else:
+                if len(state.deposit_misses) >= DEPOSIT_MISS_LIMIT:
+                    state.deposit_misses.clear()
+                state.deposit_misses[item_id] = now + DEPOSIT_MISS_TTL
+        return found
+
+    def mark_changed(self, *user_ids):
+        """在当前事务中登记状态变化的用户，提交后失效 (见下方 after_commit 监听)"""
+        db.session.info.setdefault('conn_state_users', set()).update(user_ids)
+
+    def invalidate(self, *user_ids):
+        """用户状态已变化 (已提交)，其所有连接下次使用时重新加载"""
+        with self._lock:
+            for user_id in user_ids:
+                for sid in self._by_user.get(user_id, ()):
+                    state = self._by_sid.get(sid)
+                    if state:
+                        state.expires = 0
+
+
+conn_states = ConnectionStates()
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed(session):
+    user_ids = session.info.pop('conn_state_users', None)
+    if user_ids:
+        conn_states.invalidate(*user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed(session):
+    session.info.pop('conn_state_users', None)
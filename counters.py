@@ -0,0 +1,97 @@
+"""
+导航栏角标计数缓存
+
+每次渲染模板都要显示 未读私信会话数 与 管理员待处理数 (待审核拍品 + 待处理申诉)，
+这里在内存中维护这些计数，渲染页面时不再查询数据库：
+- 未读：每个用户一个 "有未读消息的会话 id" 集合，首次访问时查询一次，
+  之后由 chat.on_send_message / 系统消息投递 (+) 与 start_chat 打开会话 (-) 增量维护
+- 待处理：待审核拍品数 / 待处理申诉数，首次访问时各 COUNT 一次，
+  之后由 发布 / 提交申诉 (+) 与 审核 / 驳回 / 恢复 (-) 增量维护
+所有增量更新都在对应事务提交之后调用。
+"""
+import threading
+import time
+from sqlalchemy import or_, and_
+from extensions import db
+from models import Item, ChatSession, Appeal
+
+# 兜底过期时间 (秒)，多进程部署时其他进程的变更最迟在此时间后可见
+COUNTER_TTL = 60
+MAX_USERS = 10000
+
+
+class Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._unread = {}    # user_id -> (过期时间, {session_id})
+        self._pending = None  # (过期时间, {'items': n, 'appeals': n})
+
+    # --- 未读私信会话 ---
+    def _load_unread(self, user_id):
+        return {
+            sid for (sid,) in db.session.query(ChatSession.id).filter(or_(
+                and_(ChatSession.buyer_id == user_id, ChatSession.buyer_unread > 0),
+                and_(ChatSession.seller_id == user_id, ChatSession.seller_unread > 0),
+            )).all()
+        }
+
+    def unread_sessions(self, user_id):
+        """有未读消息的会话数"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._unread.get(user_id)
+            if entry and entry[0] > now:
+                return len(entry[1])
+        sessions = self._load_unread(user_id)
+        with self._lock:
+            if len(self._unread) >= MAX_USERS:
+                self._unread.clear()
+            self._unread[user_id] = (now + COUNTER_TTL, sessions)
+        return len(sessions)
+
+    def mark_unread(self, user_id, session_id):
+        # 未加载的用户下次访问时会从数据库读取，无需处理
+        with self._lock:
+            entry = self._unread.get(user_id)
+            if entry:
+                entry[1].add(session_id)
+
+    def mark_read(self, user_id, session_id):
+        with self._lock:
+            entry = self._unread.get(user_id)
+            if entry:
+                entry[1].discard(session_id)
+
+    # --- 管理员待处理 ---
+    def _get_pending(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._pending and self._pending[0] > now:
+                return self._pending[1]
+        counts = {
+            'items': Item.query.filter_by(status='pending').count(),
+            'appeals': Appeal.query.filter_by(status='pending').count(),
+        }
+        with self._lock:
+            self._pending = (now + COUNTER_TTL, counts)
+        return counts
+
+    def pending_items(self):
+        return self._get_pending()['items']
+
+    def pending_appeals(self):
+        return self._get_pending()['appeals']
+
+    def pending_total(self):
+        counts = self._get_pending()
+        return counts['items'] + counts['appeals']
+
+    def add_pending(self, kind, delta):
+        """:param kind: 'items' 或 'appeals'"""
+        with self._lock:
+            if self._pending:
+                counts = self._pending[1]
+                counts[kind] = max(0, counts[kind] + delta)
+
+
+counters = Counters()
@@ -1,9 +1,13 @@
 from flask import request
 from flask_socketio import emit, join_room
 from flask_login import current_user
-from datetime import datetime, timedelta
-from extensions import db, socketio
-from models import Item, Bid, Deposit
+from extensions import socketio
+from conn_state import conn_states
+from bid_engine import bid_engine
+from scheduler import auction_scheduler
+from listing_cache import listing_cache
+from broadcast import price_broadcaster
+from watchlist import watchlist
 from decimal import Decimal
 
 def register_events(socketio):
@@ -11,111 +15,91 @@ def register_events(socketio):
 
     def handle_connect():
         if current_user.is_authenticated:
+            # 加载本连接的用户状态，之后的事件不再经过 user_loader 查询 (见 conn_state.py)
+            conn_states.open(request.sid, current_user.id)
             join_room(f"user_{current_user.id}")
             print(f"User {current_user.username} (ID: {current_user.id}) joined room user_{current_user.id}")
 
+    @socketio.on('disconnect')
+    def handle_disconnect(*args):
+        conn_states.close(request.sid)
+
     @socketio.on('join_check')
     def on_join_check(data):
         """前端连接后发送此事件，用于加入特定权限房间"""
-        if current_user.is_authenticated and current_user.role == 'admin':
+        state = conn_states.get(request.sid)
+        if state and state.role == 'admin':
             join_room('admin_room')
 
     @socketio.on('join')
     def on_join(data):
-        room = data['room']
-        join_room(room)
+        state = conn_states.get(request.sid)
+        room = data.get('room') if isinstance(data, dict) else None
+        if state and state.can_join(room):
+            join_room(room)
 
     @socketio.on('bid')
     def on_bid(data):
-        if not current_user.is_authenticated:
+        state = conn_states.get(request.sid)
+        if state is None:
             return
         # 未实名认证限制出价
-        if not getattr(current_user, 'is_verified', False):
+        if not state.verified:
             emit('error', {'msg': '请先完成实名认证后再参与出价'}, room=request.sid)
             return
         # 未缴纳保证金限制出价
-        item_id = data['item_id']
-        dep = Deposit.query.filter_by(item_id=item_id, user_id=current_user.id, status='frozen').first()
-        if dep is None:
+        try:
+            item_id = int(data['item_id'])
+        except (KeyError, TypeError, ValueError):
+            return
+        if not conn_states.has_deposit(request.sid, item_id):
             emit('error', {'msg': '参与竞价需先缴纳保证金，请前往拍品页面缴纳后再试。'}, room=request.sid)
             return
         
         # 使用 Decimal 处理金额
         try:
             amount = Decimal(str(data['amount']))
+            if not amount.is_finite():
+                raise ValueError(amount)
         except:
             emit('error', {'msg': '无效的金额格式'}, room=request.sid)
             return
         
-        item = Item.query.get(item_id)
-        
-        if not item or item.status != 'active':
-            return
-            
         # 检查封禁状态
-        if current_user.banned_until and current_user.banned_until > datetime.now():
-            emit('error', {'msg': f'由于未付款记录，您的账户已被封禁至 {current_user.banned_until.strftime("%Y-%m-%d %H:%M")}，暂无法出价。'}, room=request.sid)
-            return
-            
-        # 禁止连续出价
-        if item.highest_bidder_id == current_user.id:
-            emit('error', {'msg': '您已经是当前最高出价者，不可重复出价'}, room=request.sid)
-            return
-
-        if datetime.now() > item.end_time:
-            item.status = 'ended'
-            db.session.commit()
-            emit('error', {'msg': '拍卖已结束'}, room=f"item_{item_id}")
+        if state.is_banned():
+            emit('error', {'msg': f'由于未付款记录，您的账户已被封禁至 {state.banned_until.strftime("%Y-%m-%d %H:%M")}，暂无法出价。'}, room=request.sid)
             return
 
-        # 直接使用 Decimal 比较，无需转换 float
-        # item.current_price, item.increment, item.start_price 应该是 Decimal 类型
-
-        if item.highest_bidder is None:
-            min_bid = item.start_price
-        else:
-            min_bid = item.current_price + item.increment
-
-        if amount < min_bid:
-            emit('error', {'msg': f'出价必须高于 {min_bid}'}, room=request.sid)
+        # 价格校验、防连续出价、防狙击延时均在内存竞价引擎中按拍品串行完成
+        result = bid_engine.place_bid(item_id, state.user_id, amount)
+        if not result['ok']:
+            if result.get('ended'):
+                emit('error', {'msg': result['msg']}, room=f"item_{item_id}")
+            elif result['msg']:
+                emit('error', {'msg': result['msg']}, room=request.sid)
             return
 
-        # 防狙击机制
-        time_left = item.end_time - datetime.now()
-        extended = False
-        strategy1_triggered = False
-
-        # 策略1: 最后3分钟内出现第3次及以上出价，自动延长5分钟
-        if time_left < timedelta(minutes=3):
-            # 统计当前截止时间前3分钟内的已有出价数量
-            window_start = item.end_time - timedelta(minutes=3)
-            recent_bids_count = Bid.query.filter(
-                Bid.item_id == item_id,
-                Bid.timestamp >= window_start
-            ).count()
-            
-            # 当前出价是第 (recent_bids_count + 1) 笔，如果达到3笔则延长
-            if recent_bids_count + 1 >= 3:
-                item.end_time += timedelta(minutes=5)
-                extended = True
-                strategy1_triggered = True
+        if result['extended']:
+            # 防狙击延长了截止时间，重新登记结束调度
+            auction_scheduler.schedule('end', item_id, result['end_time'])
+        listing_cache.on_price_update(item_id, amount, result['end_time'], result['extended'])
 
-        # 策略2: 最后30秒内有人出价，自动延长3分钟 (仅当策略1未触发时)
-        if not strategy1_triggered and time_left < timedelta(seconds=30):
-            item.end_time += timedelta(minutes=3)
-            extended = True
-
-        item.current_price = amount
-        item.highest_bidder_id = current_user.id
-        
-        new_bid = Bid(item_id=item.id, user_id=current_user.id, amount=amount)
-        db.session.add(new_bid)
-        db.session.commit()
-        
         response = {
+            'item_id': item_id,
             'new_price': float(amount), # JSON响应转回float方便前端与JSON兼容
-            'bidder_name': current_user.username,
-            'new_end_time': item.end_time.isoformat(), 
-            'extended': extended
+            'bidder_name': state.username,
+            'new_end_time': result['end_time'].isoformat(), 
+            'extended': result['extended'],
+            'total_bids': result['total_bids'],
+            'unique_bidders': result['unique_bidders']
         }
-        emit('price_update', response, room=f"item_{item_id}")
+        if price_broadcaster.enabled:
+            # 出价人立即收到确认，房间广播按窗口合并 (见 broadcast.py)
+            emit('bid_ack', response, room=request.sid)
+        price_broadcaster.publish(item_id, response)
+        # 收藏了该拍品的其他用户 (见 watchlist.py)
+        watchlist.publish(item_id, 'outbid', {
+            'price': float(amount),
+            'bidder_name': state.username,
+            'msg': f'您收藏的拍品 "{{name}}" 有新出价: ¥{amount} ({state.username})',
+        }, exclude=(state.user_id,))
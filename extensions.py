@@ -1,7 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_socketio import SocketIO
 from flask_login import LoginManager
+from replica import RoutingSession
 
-db = SQLAlchemy()
+# 会话按 replica_reads() 标记把只读查询路由到副本 (见 replica.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 socketio = SocketIO(cors_allowed_origins="*") 
 login_manager = LoginManager()
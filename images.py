@@ -0,0 +1,146 @@
+"""
+上传图片处理
+
+- 上传请求中只做：读取内容 -> 校验图片头 -> 按内容 SHA-256 落盘原图 (相同内容只存一份)
+- 缩放在后台线程池中完成：每张图只解码一次，依次缩小生成 detail / card / thumb 三个 WebP 衍生图，
+  完成后把已生成的尺寸写回 item_images.variants / users.avatar_variants
+- 模板通过 variant 过滤器按显示尺寸选择衍生图，尚未生成 (或旧数据) 时回退到原图
+"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image, ImageOps
+from extensions import db, socketio
+from models import ItemImage, User
+
+# 衍生图：名称 -> 最长边像素，从大到小排列 (每一级由上一级继续缩小)
+VARIANTS = (('detail', 1280), ('card', 480), ('thumb', 160))
+VARIANT_FORMAT = 'webp'
+VARIANT_QUALITY = 80
+IMAGE_WORKERS = min(4, os.cpu_count() or 1)
+# UPLOAD_FOLDER 下按内容寻址的存放目录
+STORE_DIR = 'img'
+# 允许的原图格式 -> 扩展名
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp', 'BMP': 'bmp'}
+
+
+def variant_path(path, variants, size):
+    """衍生图相对路径；该尺寸尚未生成时返回原图路径"""
+    if path and variants and size in variants.split(','):
+        return f"{os.path.splitext(path)[0]}_{size}.{VARIANT_FORMAT}"
+    return path
+
+
+def store_upload(file, upload_folder):
+    """
+    保存上传的原图 (内容相同的文件只存一份)
+    :return: UPLOAD_FOLDER 下的相对路径，如 img/ab/ab12...ef.jpg
+    :raises ValueError: 不是支持的图片格式
+    """
+    data = file.read()
+    try:
+        # 只读取文件头，不解码像素
+        fmt = Image.open(BytesIO(data)).format
+    except Exception:
+        fmt = None
+    if fmt not in EXTENSIONS:
+        raise ValueError('仅支持 JPG / PNG / GIF / WEBP / BMP 格式的图片')
+    digest = hashlib.sha256(data).hexdigest()
+    name = f"{STORE_DIR}/{digest[:2]}/{digest}.{EXTENSIONS[fmt]}"
+    path = os.path.join(upload_folder, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, lambda f: f.write(data))
+    return name
+
+
+def _write_atomic(path, write):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _targets(path):
+    root = os.path.splitext(path)[0]
+    return [(name, size, f"{root}_{name}.{VARIANT_FORMAT}") for name, size in VARIANTS]
+
+
+def existing_variants(upload_folder, name):
+    """相同内容之前已处理过时直接返回已生成的尺寸，否则返回 None"""
+    targets = _targets(os.path.join(upload_folder, name))
+    if all(os.path.exists(out) for _, _, out in targets):
+        return ','.join(v for v, _, _ in targets)
+    return None
+
+
+def make_variants(path):
+    """解码一次原图，从大到小依次生成衍生图，返回已生成的尺寸 (逗号分隔)"""
+    targets = _targets(path)
+    if not all(os.path.exists(out) for _, _, out in targets):
+        with Image.open(path) as im:
+            # JPEG 按目标尺寸降采样解码，大图解码耗时与内存都大幅下降
+            im.draft('RGB', (VARIANTS[0][1], VARIANTS[0][1]))
+            im = ImageOps.exif_transpose(im)
+            has_alpha = im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info)
+            im = im.convert('RGBA' if has_alpha else 'RGB')
+            for _, size, out in targets:
+                im.thumbnail((size, size), Image.LANCZOS)
+                _write_atomic(out, lambda f: im.save(f, VARIANT_FORMAT, quality=VARIANT_QUALITY))
+    return ','.join(v for v, _, _ in targets)
+
+
+class ImagePipeline:
+    def __init__(self):
+        self._app = None
+        self._executor = None
+        self._resize = make_variants
+
+    def start(self, app):
+        """
+        启动缩放线程池 (Pillow 缩放与编码时释放 GIL，多线程可并行)
+        eventlet / gevent 模式下线程池中的线程已是协程，缩放再交给原生线程执行，避免阻塞事件循环
+        """
+        self._app = app
+        if socketio.async_mode == 'eventlet':
+            from eventlet import tpool
+            self._resize = lambda path: tpool.execute(make_variants, path)
+        elif socketio.async_mode == 'gevent':
+            from gevent import get_hub
+            self._resize = lambda path: get_hub().threadpool.apply(make_variants, (path,))
+        self._executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='image')
+
+    def submit(self, upload_folder, names):
+        """
+        登记待生成衍生图的原图 (在引用它们的记录提交之后调用)
+        线程池未启动时 (例如未经 app.py 直接运行) 在当前线程中同步处理
+        """
+        for name in names:
+            if self._executor is not None:
+                self._executor.submit(self._process, upload_folder, name)
+            else:
+                self._apply(upload_folder, name)
+
+    def _process(self, upload_folder, name):
+        with self._app.app_context():
+            try:
+                self._apply(upload_folder, name)
+            finally:
+                db.session.remove()
+
+    def _apply(self, upload_folder, name):
+        try:
+            variants = self._resize(os.path.join(upload_folder, name))
+            # 同一内容可能被多条记录引用，一并更新
+            ItemImage.query.filter_by(image_url=f"uploads/{name}").update(
+                {'variants': variants}, synchronize_session=False)
+            User.query.filter_by(avatar=name).update(
+                {'avatar_variants': variants}, synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Image pipeline error ({name}): {e}")
+
+
+image_pipeline = ImagePipeline()
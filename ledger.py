@@ -0,0 +1,106 @@
+"""
+资金账本
+
+所有余额变动都经过 post()：一组流水在同一个事务中记账，
+余额用条件 UPDATE 原子地增减 (wallet_balance = wallet_balance + :delta)，不在 Python 中读改写：
+- 扣款 (净减少的用户) 逐个执行 UPDATE ... WHERE wallet_balance + :delta >= 0，
+  影响行数为 0 说明余额不足，抛出 InsufficientBalance
+- 入账 (净增加的用户) 按 id 相邻的合并为 1 条 executemany UPDATE
+用户严格按 id 顺序更新，并发事务以相同顺序加行锁，避免死锁。
+UPDATE 之后读回的余额已被本事务锁定，据此计算每笔流水的 balance_after，流水用 1 次批量 INSERT 写入。
+post() 不提交事务，由调用方与订单 / 保证金状态的变更一起提交；抛出异常时调用方需回滚。
+"""
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm.attributes import set_committed_value
+from extensions import db
+from models import User, WalletTransaction
+
+CENT = Decimal('0.01')
+
+
+class InsufficientBalance(Exception):
+    def __init__(self, user_id):
+        super().__init__(f'用户 {user_id} 余额不足')
+        self.user_id = user_id
+
+
+def _entry(direction, user_id, amount, tx_type, description, item_id):
+    amount = Decimal(amount).quantize(CENT)
+    if amount < 0:
+        raise ValueError(f'流水金额不能为负: {amount}')
+    return {'user_id': user_id, 'item_id': item_id, 'type': tx_type, 'direction': direction,
+            'amount': amount, 'description': description}
+
+
+def credit(user_id, amount, tx_type, description, item_id=None):
+    """入账一笔"""
+    return _entry('credit', user_id, amount, tx_type, description, item_id)
+
+
+def debit(user_id, amount, tx_type, description, item_id=None):
+    """扣款一笔"""
+    return _entry('debit', user_id, amount, tx_type, description, item_id)
+
+
+def _delta(entry):
+    return entry['amount'] if entry['direction'] == 'credit' else -entry['amount']
+
+
+def post(entries, now=None):
+    """
+    记一组流水并更新相关用户的余额 (不提交事务)
+    :param entries: credit() / debit() 生成的流水，同一用户可以有多笔，按给出的顺序计算 balance_after
+    :return: 各用户更新后的余额 {user_id: Decimal}
+    :raises InsufficientBalance: 某个用户的净扣款超过其余额
+    """
+    entries = [e for e in entries if e['amount'] != 0]
+    if not entries:
+        return {}
+    now = now or datetime.now()
+    deltas = {}
+    for e in entries:
+        deltas[e['user_id']] = deltas.get(e['user_id'], Decimal('0.00')) + _delta(e)
+
+    users = User.__table__
+    add = users.update().where(users.c.id == bindparam('uid')) \
+        .values(wallet_balance=users.c.wallet_balance + bindparam('delta'))
+    credits = []
+    for uid, d in sorted(deltas.items()):
+        if d >= 0:
+            credits.append({'uid': uid, 'delta': d})
+            continue
+        if credits:
+            db.session.execute(add, credits)
+            credits = []
+        result = db.session.execute(
+            users.update().where(users.c.id == uid, users.c.wallet_balance + d >= 0)
+            .values(wallet_balance=users.c.wallet_balance + d)
+        )
+        if result.rowcount != 1:
+            raise InsufficientBalance(uid)
+    if credits:
+        db.session.execute(add, credits)
+
+    balances = {
+        uid: Decimal(balance or 0).quantize(CENT)
+        for uid, balance in db.session.execute(
+            select(users.c.id, users.c.wallet_balance).where(users.c.id.in_(list(deltas)))
+        ).all()
+    }
+    # 会话中已加载的 User 对象同步为最新余额，避免后续读到旧值或被 flush 覆盖
+    for uid, balance in balances.items():
+        obj = db.session.identity_map.get(db.session.identity_key(User, uid))
+        if obj is not None:
+            set_committed_value(obj, 'wallet_balance', balance)
+
+    # 从最终余额倒推每笔流水之后的余额
+    running = dict(balances)
+    rows = []
+    for e in reversed(entries):
+        rows.append(dict(e, balance_after=running[e['user_id']], created_at=now))
+        running[e['user_id']] -= _delta(e)
+    rows.reverse()
+    db.session.bulk_insert_mappings(WalletTransaction, rows)
+    return balances
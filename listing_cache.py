@@ -0,0 +1,127 @@
+"""
+首页列表缓存
+
+无搜索词时首页按 (分区, 分类, 排序, 游标) 缓存渲染所需的拍品快照 (ItemCard)，
+命中时不访问数据库。失效规则：
+- 审核通过 / 开拍 / 结束 / 下架 / 恢复：整体失效 (invalidate)
+- on_bid 价格更新：按价格排序的缓存页 (或截止时间被延长时按截止时间排序的缓存页) 一律丢弃，
+  不论其中是否已有该拍品 (新价格可能使拍品移入 / 移出该页)；其余缓存页就地更新快照中的价格与截止时间
+"""
+import threading
+import time
+import query
+from models import Item, User
+
+# 首页每页数量
+PAGE_SIZE = 24
+# 兜底过期时间 (秒)，防止多进程部署时其他进程的变更长期不可见
+CACHE_TTL = 60
+MAX_ENTRIES = 1024
+
+
+class ItemCard:
+    """首页卡片所需的拍品字段快照，与 ORM 会话无关，可跨请求复用"""
+    __slots__ = ('id', 'name', 'description', 'category', 'start_price', 'current_price',
+                 'start_time', 'end_time', 'image_url', 'image_variants')
+
+    def __init__(self, item):
+        self.id = item.id
+        self.name = item.name
+        self.description = item.description
+        self.category = item.category
+        self.start_price = item.start_price
+        self.current_price = item.current_price
+        self.start_time = item.start_time
+        self.end_time = item.end_time
+        self.image_url = item.images[0].image_url if item.images else None
+        self.image_variants = item.images[0].variants if item.images else None
+
+
+class ListingCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}   # key -> (过期时间, 数据)
+        self._cards = {}     # item_id -> ItemCard，同一拍品在各缓存页中共享同一个快照
+        self.hits = 0
+        self.misses = 0
+
+    def build_index(self, search_query='', category=None, sort_option='default',
+                    active_after=None, upcoming_after=None):
+        """查询数据库并转换为卡片快照 (不经过缓存，搜索时直接使用)"""
+        result = query.get_index_items(Item, User, search_query, category, sort_option,
+                                       active_after, upcoming_after, PAGE_SIZE)
+        active_items, active_next, active_total = result['active']
+        upcoming_items, upcoming_next, upcoming_total = result['upcoming']
+        return {
+            'active': ([ItemCard(i) for i in active_items], active_next, active_total),
+            'upcoming': ([ItemCard(i) for i in upcoming_items], upcoming_next, upcoming_total),
+            'ended': [ItemCard(i) for i in result['ended']],
+        }
+
+    def get_index(self, category='', sort_option='default', active_after=None, upcoming_after=None):
+        # 只用合法的排序与游标作为缓存键，任意参数不会产生新的缓存页
+        if sort_option not in query.INDEX_SORTS:
+            sort_option = 'default'
+        active_after = self._valid_cursor(active_after, sort_option, Item.end_time)
+        upcoming_after = self._valid_cursor(upcoming_after, sort_option, Item.start_time)
+        key = (category or '', sort_option, active_after or '', upcoming_after or '')
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        data = self.build_index('', category, sort_option, active_after, upcoming_after)
+        with self._lock:
+            # 共享卡片对象，价格更新时就地修改即可；已有的共享卡片用数据库中的最新值刷新，
+            # 其他进程写入的价格 / 截止时间最多在 CACHE_TTL 后可见
+            for section in ('active', 'upcoming'):
+                cards = [self._share(c) for c in data[section][0]]
+                data[section] = (cards,) + data[section][1:]
+            data['ended'] = [self._share(c) for c in data['ended']]
+            if len(self._entries) >= MAX_ENTRIES:
+                self._entries.clear()
+                self._cards.clear()
+            self._entries[key] = (now + CACHE_TTL, data)
+        return data
+
+    @staticmethod
+    def _valid_cursor(cursor, sort_option, default_column):
+        """无法解析的游标视为第一页"""
+        if not cursor:
+            return None
+        column = getattr(Item, query.INDEX_SORTS[sort_option][0]) if sort_option in query.INDEX_SORTS else default_column
+        return cursor if query.decode_cursor(cursor, column) else None
+
+    def _share(self, card):
+        """调用方需持有 self._lock"""
+        shared = self._cards.get(card.id)
+        if shared is None:
+            self._cards[card.id] = card
+            return card
+        for field in ItemCard.__slots__:
+            setattr(shared, field, getattr(card, field))
+        return shared
+
+    def invalidate(self):
+        """拍品上下架 / 状态变化时整体失效"""
+        with self._lock:
+            self._entries.clear()
+            self._cards.clear()
+
+    def on_price_update(self, item_id, price, end_time, extended=False):
+        """出价成功：丢弃排序依赖价格 / 截止时间的缓存页，再更新其余缓存页共享的快照价格"""
+        stale_sorts = {'price_asc', 'price_desc'}
+        if extended:
+            stale_sorts.update(('default', 'end_time_asc', 'end_time_desc'))
+        with self._lock:
+            for key in [k for k in self._entries if k[1] in stale_sorts]:
+                del self._entries[key]
+            card = self._cards.get(item_id)
+            if card is not None:
+                card.current_price = price
+                card.end_time = end_time
+
+
+listing_cache = ListingCache()
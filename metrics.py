@@ -0,0 +1,422 @@
+"""
+运行指标与请求级性能剖析
+
+AUCTION_METRICS=1 时注册以下钩子 (未开启时不注册任何钩子，请求与 SQL 没有额外开销)：
+- 每个路由 (endpoint + method) 的请求耗时直方图与按状态码的请求数
+- 每个 Socket.IO 事件的处理耗时直方图
+- 每个请求 / 事件的 SQL 条数与 SQL 耗时 (SQLAlchemy 引擎的 before/after_cursor_execute 事件)；
+  同一请求中同一条参数化语句执行 N_PLUS_ONE_THRESHOLD 次及以上记为疑似 N+1，计数并在日志中提示一次
+/admin/metrics 以 Prometheus 文本格式输出以上指标，以及始终收集的后台任务统计：
+  订单超时检查与 check_auctions 每轮耗时 (tasks.SWEEP_METRICS)、资金对账 (tasks.reconcile_wallets，reconcile.RECONCILE_METRICS)、
+  价格广播合并 (broadcast.PRICE_BROADCAST_METRICS)、收藏提醒 (watchlist.WATCH_METRICS)、首页列表缓存命中、在线连接数，
+  以及拍卖调度器各类任务 (开拍 / 结束 / 即将结束提醒) 的处理耗时、失败与重试次数 (scheduler 写入 registry)
+管理员登录后可直接访问；Prometheus 抓取时设置 METRICS_TOKEN，并携带请求头 Authorization: Bearer <token>。
+
+AUCTION_PROFILER=1 时管理员可在任意页面地址后加 ?_profile=1，对该次请求采样调用栈，
+返回按调用栈汇总的采样结果 (纯文本，可直接用于火焰图) 代替页面。
+"""
+import bisect
+import hmac
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from flask import request, abort, Response
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from extensions import socketio
+
+METRICS_ENABLED = os.environ.get('AUCTION_METRICS') == '1'
+PROFILER_ENABLED = os.environ.get('AUCTION_PROFILER') == '1'
+
+# 耗时直方图的分桶 (秒) 与每请求 SQL 条数的分桶
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+# 同一请求中同一条语句执行多少次视为疑似 N+1
+N_PLUS_ONE_THRESHOLD = 5
+# 采样间隔 (秒) 与输出的调用栈条数
+PROFILE_INTERVAL = 0.005
+PROFILE_TOP = 40
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # le 语义：值 <= 桶上界时计入该桶
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """进程内的直方图与计数器，按 (指标名, 标签) 存放"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}   # name -> {labels: Histogram}
+        self._counters = {}     # name -> {labels: value}
+        self._help = {}
+
+    def observe(self, name, labels, value, buckets=DURATION_BUCKETS, help=''):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(labels)
+            if hist is None:
+                hist = series[labels] = Histogram(buckets)
+                self._help.setdefault(name, help)
+            hist.observe(value)
+
+    def inc(self, name, labels, value=1, help=''):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+            self._help.setdefault(name, help)
+
+    def render(self, out):
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                out.append(f"# HELP {name} {self._help.get(name, '')}")
+                out.append(f"# TYPE {name} histogram")
+                for labels, hist in sorted(series.items()):
+                    cumulative = 0
+                    for bound, n in zip(hist.buckets, hist.counts):
+                        cumulative += n
+                        out.append(f"{name}_bucket{_labels(labels + (('le', _num(bound)),))} {cumulative}")
+                    out.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {hist.count}")
+                    out.append(f"{name}_sum{_labels(labels)} {_num(hist.sum)}")
+                    out.append(f"{name}_count{_labels(labels)} {hist.count}")
+            for name, series in sorted(self._counters.items()):
+                out.append(f"# HELP {name} {self._help.get(name, '')}")
+                out.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    out.append(f"{name}{_labels(labels)} {_num(value)}")
+
+
+registry = Registry()
+
+
+def _num(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels) + '}'
+
+
+def _metric(out, name, kind, help, samples):
+    """输出一个 gauge / counter，samples 为 [(labels, value)]"""
+    out.append(f"# HELP {name} {help}")
+    out.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        out.append(f"{name}{_labels(labels)} {_num(value)}")
+
+
+# 当前请求或 Socket.IO 事件的统计 (eventlet / gevent 打补丁后为协程本地变量)
+_local = threading.local()
+# 已在日志中提示过的疑似 N+1 (handler, 语句)
+_reported = set()
+
+
+class _Scope:
+    __slots__ = ('handler', 'queries', 'seconds', 'statements')
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and getattr(_local, 'scope', None) is not None:
+        context.metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    scope = getattr(_local, 'scope', None)
+    started = getattr(context, 'metrics_started', None)
+    if scope is None or started is None:
+        return
+    scope.queries += 1
+    scope.seconds += time.perf_counter() - started
+    scope.statements[statement] += 1
+
+
+def _open_scope(handler):
+    _local.scope = _Scope(handler)
+
+
+def _close_scope(app):
+    scope = getattr(_local, 'scope', None)
+    _local.scope = None
+    if scope is None:
+        return
+    labels = (('handler', scope.handler),)
+    registry.observe('auction_db_queries_per_request', labels, scope.queries, QUERY_COUNT_BUCKETS,
+                     help='SQL statements executed per request / Socket.IO event')
+    registry.observe('auction_db_seconds_per_request', labels, scope.seconds,
+                     help='Time spent in SQL per request / Socket.IO event')
+    for statement, n in scope.statements.items():
+        if n < N_PLUS_ONE_THRESHOLD:
+            continue
+        registry.inc('auction_db_n_plus_one_total', labels,
+                     help='Requests in which one statement ran N_PLUS_ONE_THRESHOLD+ times')
+        key = (scope.handler, statement)
+        if key not in _reported:
+            _reported.add(key)
+            app.logger.warning(f"疑似 N+1 查询: {scope.handler} 中同一条语句执行了 {n} 次: {' '.join(statement.split())[:300]}")
+
+
+def _instrument_requests(app):
+    @app.before_request
+    def _metrics_start():
+        request.environ['metrics.started'] = time.perf_counter()
+        _open_scope(request.url_rule.endpoint if request.url_rule else 'not_found')
+
+    @app.after_request
+    def _metrics_status(response):
+        request.environ['metrics.status'] = response.status_code
+        return response
+
+    @app.teardown_request
+    def _metrics_finish(exc):
+        started = request.environ.get('metrics.started')
+        if started is None:
+            return
+        endpoint = request.url_rule.endpoint if request.url_rule else 'not_found'
+        status = request.environ.get('metrics.status', 500)
+        registry.observe('auction_http_request_duration_seconds', (('endpoint', endpoint), ('method', request.method)),
+                         time.perf_counter() - started, help='HTTP request duration by route')
+        registry.inc('auction_http_requests_total', (('endpoint', endpoint), ('method', request.method), ('status', status)),
+                     help='HTTP requests by route and status')
+        _close_scope(app)
+
+
+def _timed_event(app, name, handler):
+    def wrapper(*args):
+        started = time.perf_counter()
+        _open_scope(f'socketio:{name}')
+        try:
+            return handler(*args)
+        finally:
+            registry.observe('auction_socketio_event_duration_seconds', (('event', name),),
+                             time.perf_counter() - started, help='Socket.IO event handler duration')
+            _close_scope(app)
+    wrapper.metrics_wrapped = True
+    return wrapper
+
+
+def _instrument_socketio(app):
+    # Flask-SocketIO 在 init_app 之后把事件处理函数直接登记到 python-socketio 服务端，在其外层计时
+    for namespace, handlers in socketio.server.handlers.items():
+        for name, handler in list(handlers.items()):
+            if not getattr(handler, 'metrics_wrapped', False):
+                handlers[name] = _timed_event(app, name, handler)
+
+
+_sql_installed = False
+
+
+def _instrument_sql():
+    global _sql_installed
+    if not _sql_installed:
+        _sql_installed = True
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class SamplingProfiler:
+    """
+    对单个请求采样调用栈：
+    - threading 模式：独立线程按间隔读取请求线程的当前栈 (墙钟时间，包括等待数据库的时间)
+    - eventlet / gevent 模式：请求都在主线程的协程中执行，用 SIGALRM 定时中断读取正在执行的栈；
+      中断时正在运行的不是本请求的协程 (等待 IO 或其他请求在执行) 时记为 (waiting / other)
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.total = 0
+        self._stop = threading.Event()
+        self._target = None
+        self._mode = None
+        self._started = None
+        self._sampler = None
+        self._greenlet = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        if socketio.async_mode in ('eventlet', 'gevent'):
+            if not hasattr(signal, 'setitimer'):
+                return False
+            import greenlet
+            self._greenlet = greenlet
+            self._target = greenlet.getcurrent()
+            self._mode = 'signal'
+            self._previous = signal.signal(signal.SIGALRM, self._on_signal)
+            signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+        else:
+            self._target = threading.get_ident()
+            self._mode = 'thread'
+            self._sampler = threading.Thread(target=self._sample_thread, name='profiler', daemon=True)
+            self._sampler.start()
+        return True
+
+    def stop(self):
+        if self._mode == 'signal':
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self._previous)
+        elif self._mode == 'thread':
+            self._stop.set()
+            self._sampler.join(1)
+        self._mode = None
+
+    def _record(self, frame):
+        self.total += 1
+        if frame is None:
+            self.samples['(waiting / other)'] += 1
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        self.samples[';'.join(reversed(stack))] += 1
+
+    def _on_signal(self, signum, frame):
+        self._record(frame if self._greenlet.getcurrent() is self._target else None)
+
+    def _sample_thread(self):
+        while not self._stop.wait(self.interval):
+            self._record(sys._current_frames().get(self._target))
+
+    def report(self, title):
+        elapsed = (time.perf_counter() - self._started) * 1000
+        lines = [f"# {title}", f"# 耗时 {elapsed:.1f}ms，采样 {self.total} 次 (间隔 {self.interval * 1000:.0f}ms)", ""]
+        inclusive = Counter()
+        leaf = Counter()
+        for stack, n in self.samples.items():
+            frames = stack.split(';')
+            leaf[frames[-1]] += n
+            for f in set(frames):
+                inclusive[f] += n
+        lines.append("## 自身采样最多的位置")
+        lines.extend(f"{n:6d}  {f}" for f, n in leaf.most_common(20))
+        lines.append("")
+        lines.append("## 包含子调用的采样数")
+        lines.extend(f"{n:6d}  {f}" for f, n in inclusive.most_common(20))
+        lines.append("")
+        lines.append("## 调用栈 (折叠格式，可用 flamegraph.pl 生成火焰图)")
+        lines.extend(f"{stack} {n}" for stack, n in self.samples.most_common(PROFILE_TOP))
+        return '\n'.join(lines) + '\n'
+
+
+def _instrument_profiler(app):
+    @app.before_request
+    def _profile_start():
+        if request.args.get('_profile') != '1':
+            return
+        if not (current_user.is_authenticated and current_user.role == 'admin'):
+            return
+        profiler = SamplingProfiler()
+        if profiler.start():
+            request.environ['metrics.profiler'] = profiler
+
+    @app.after_request
+    def _profile_report(response):
+        profiler = request.environ.pop('metrics.profiler', None)
+        if profiler is None:
+            return response
+        profiler.stop()
+        title = f"{request.method} {request.full_path} -> {response.status_code}"
+        return Response(profiler.report(title), mimetype='text/plain')
+
+    @app.teardown_request
+    def _profile_cleanup(exc):
+        # 视图抛出异常时 after_request 不会执行，确保停止采样
+        profiler = request.environ.pop('metrics.profiler', None)
+        if profiler is not None:
+            profiler.stop()
+
+
+def render_metrics():
+    """Prometheus 文本格式"""
+    from tasks import SWEEP_METRICS
+    from reconcile import RECONCILE_METRICS
+    from broadcast import PRICE_BROADCAST_METRICS
+    from watchlist import WATCH_METRICS
+    from listing_cache import listing_cache
+    from conn_state import conn_states
+
+    out = []
+    sweeps = sorted(SWEEP_METRICS.items())
+    _metric(out, 'auction_sweep_runs_total', 'counter', 'Background sweep runs',
+            [((('sweep', name),), m['runs']) for name, m in sweeps])
+    _metric(out, 'auction_sweep_rows_total', 'counter', 'Rows processed by background sweeps',
+            [((('sweep', name),), m['rows']) for name, m in sweeps])
+    _metric(out, 'auction_sweep_seconds_total', 'counter', 'Total time spent in background sweeps',
+            [((('sweep', name),), m['total_ms'] / 1000) for name, m in sweeps])
+    _metric(out, 'auction_sweep_last_seconds', 'gauge', 'Duration of the last run of each background sweep',
+            [((('sweep', name),), m['last_ms'] / 1000) for name, m in sweeps])
+
+    _metric(out, 'auction_reconcile_runs_total', 'counter', 'Wallet reconciliation runs', [((), RECONCILE_METRICS['runs'])])
+    _metric(out, 'auction_reconcile_last_rows', 'gauge', 'Ledger rows aggregated by the last reconciliation',
+            [((), RECONCILE_METRICS['rows'])])
+    _metric(out, 'auction_reconcile_last_mismatches', 'gauge', 'Mismatches found by the last reconciliation',
+            [((), RECONCILE_METRICS['mismatches'])])
+    _metric(out, 'auction_reconcile_last_seconds', 'gauge', 'Duration of the last reconciliation',
+            [((), RECONCILE_METRICS['last_ms'] / 1000)])
+
+    _metric(out, 'auction_price_updates_total', 'counter', 'Accepted bids published to item rooms',
+            [((), PRICE_BROADCAST_METRICS['updates'])])
+    _metric(out, 'auction_price_broadcasts_total', 'counter', 'price_update broadcasts sent',
+            [((), PRICE_BROADCAST_METRICS['broadcasts'])])
+    _metric(out, 'auction_price_broadcasts_saved_total', 'counter', 'Broadcasts saved by coalescing',
+            [((), PRICE_BROADCAST_METRICS['saved'])])
+
+    _metric(out, 'auction_watch_events_total', 'counter', 'Watchlist notifications published',
+            [((), WATCH_METRICS['events'])])
+    _metric(out, 'auction_watch_deliveries_total', 'counter', 'Watchlist notifications delivered to users',
+            [((), WATCH_METRICS['deliveries'])])
+    _metric(out, 'auction_watch_emits_total', 'counter', 'Batched watch_updates emits',
+            [((), WATCH_METRICS['emits'])])
+
+    _metric(out, 'auction_listing_cache_requests_total', 'counter', 'Home page listing cache lookups',
+            [((('result', 'hit'),), listing_cache.hits), ((('result', 'miss'),), listing_cache.misses)])
+    _metric(out, 'auction_socketio_connections', 'gauge', 'Authenticated Socket.IO connections in this process',
+            [((), conn_states.count())])
+    _metric(out, 'auction_instrumentation_enabled', 'gauge', 'Whether request / event / SQL instrumentation is on',
+            [((), int(METRICS_ENABLED))])
+    registry.render(out)
+    return '\n'.join(out) + '\n'
+
+
+def register_metrics(app):
+    """在 create_app 末尾调用 (需在 Socket.IO 事件注册之后)"""
+    if METRICS_ENABLED:
+        _instrument_sql()
+        _instrument_requests(app)
+        _instrument_socketio(app)
+    if PROFILER_ENABLED:
+        _instrument_profiler(app)
+
+    @app.route('/admin/metrics')
+    def admin_metrics():
+        token = os.environ.get('METRICS_TOKEN')
+        authorized = bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+        if not authorized and not (current_user.is_authenticated and current_user.role == 'admin'):
+            abort(403)
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
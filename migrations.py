@@ -0,0 +1,271 @@
+"""
+数据库迁移
+
+按版本号顺序执行 MIGRATIONS 中尚未执行的步骤，已执行的版本记录在 schema_migrations 表。
+每个步骤都先检查字段 / 索引是否已存在，因此对用 schema.sql 新建的数据库重复执行也是安全的。
+
+用法:
+  python migrations.py            执行未完成的迁移
+  python migrations.py status     查看各版本的执行情况
+  python migrations.py explain    对 query.py 中的查询执行 EXPLAIN，出现全表扫描时以非 0 退出
+                                  (MySQL 在几乎为空的表上总会选择全表扫描，请在有实际数据量的库上运行)
+"""
+import sys
+from datetime import datetime
+from sqlalchemy import event, func, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import SchemaMigration, ChatSession, Message
+
+
+def add_column(table, column, column_type):
+    if column not in {c['name'] for c in inspect(db.engine).get_columns(table)}:
+        db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+
+def create_index(table, name, columns, unique=False):
+    inspector = inspect(db.engine)
+    existing = {i['name'] for i in inspector.get_indexes(table)}
+    existing |= {c['name'] for c in inspector.get_unique_constraints(table)}
+    if name not in existing:
+        db.session.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({columns})"))
+
+
+def _baseline():
+    # 创建所有缺失的表 (create_all 只会创建不存在的表)
+    db.create_all()
+
+
+def _image_variants():
+    add_column('item_images', 'variants', 'VARCHAR(64)')
+    add_column('users', 'avatar_variants', 'VARCHAR(64)')
+
+
+def _order_deadlines():
+    add_column('items', 'pay_deadline', 'DATETIME')
+    add_column('items', 'ship_deadline', 'DATETIME')
+    add_column('items', 'auto_confirm_deadline', 'DATETIME')
+    create_index('items', 'idx_pay_deadline', 'payment_status, pay_deadline')
+    create_index('items', 'idx_ship_deadline', 'shipping_status, ship_deadline')
+    create_index('items', 'idx_auto_confirm_deadline', 'shipping_status, auto_confirm_deadline')
+
+
+def _merge_duplicate_chat_sessions():
+    """
+    合并 (item_id, buyer_id, seller_id) 重复的会话 (旧版并发创建会话时可能产生)：
+    保留 id 最小的一条，消息移到保留的会话，未读数相加，最后消息取最近更新的一条，删除其余会话
+    """
+    cs = ChatSession.__table__
+    groups = db.session.execute(
+        select(cs.c.item_id, cs.c.buyer_id, cs.c.seller_id)
+        .group_by(cs.c.item_id, cs.c.buyer_id, cs.c.seller_id).having(func.count() > 1)
+    ).all()
+    for item_id, buyer_id, seller_id in groups:
+        sessions = db.session.execute(select(cs).where(
+            cs.c.item_id == item_id, cs.c.buyer_id == buyer_id, cs.c.seller_id == seller_id
+        ).order_by(cs.c.id)).all()
+        keep, extra = sessions[0], [r.id for r in sessions[1:]]
+        latest = max(sessions, key=lambda r: (r.updated_at or datetime.min, r.id))
+        db.session.execute(Message.__table__.update().where(
+            Message.__table__.c.chat_session_id.in_(extra)).values(chat_session_id=keep.id))
+        db.session.execute(cs.update().where(cs.c.id == keep.id).values(
+            buyer_unread=sum(r.buyer_unread or 0 for r in sessions),
+            seller_unread=sum(r.seller_unread or 0 for r in sessions),
+            last_message=latest.last_message,
+            updated_at=latest.updated_at,
+        ))
+        db.session.execute(cs.delete().where(cs.c.id.in_(extra)))
+    return len(groups)
+
+
+def _hot_query_indexes():
+    # 拍品：首页分区列表、卖家 / 买家的拍品与订单
+    create_index('items', 'idx_status_start_time', 'status, start_time')
+    create_index('items', 'idx_status_end_time', 'status, end_time')
+    create_index('items', 'idx_seller_created', 'seller_id, created_at')
+    create_index('items', 'idx_bidder_status', 'highest_bidder_id, status')
+    # 私信：按拍品与双方查找会话 (同一组合只应有一个会话，建唯一索引前先合并已有的重复会话)、未读会话计数、历史消息
+    _merge_duplicate_chat_sessions()
+    create_index('chat_sessions', 'unique_item_buyer_seller', 'item_id, buyer_id, seller_id', unique=True)
+    create_index('chat_sessions', 'idx_buyer_unread', 'buyer_id, buyer_unread')
+    create_index('chat_sessions', 'idx_seller_unread', 'seller_id, seller_unread')
+    create_index('messages', 'idx_session_time', 'chat_session_id, timestamp')
+    # 拍品图片、出价、保证金、申诉、动态
+    create_index('item_images', 'idx_image_item', 'item_id')
+    create_index('bids', 'idx_item_time', 'item_id, timestamp')
+    create_index('deposits', 'idx_item_status', 'item_id, status')
+    create_index('appeals', 'idx_status_created', 'status, created_at')
+    create_index('appeals', 'idx_appeal_created', 'created_at')
+    create_index('posts', 'idx_post_user_created', 'user_id, created_at')
+
+
+def _ledger_keyset_index():
+    # 资金流水按 (created_at, id) 倒序 keyset 分页 / 导出 (InnoDB 二级索引隐含主键 id)
+    create_index('wallet_transactions', 'idx_tx_created', 'created_at')
+
+
+def _balance_snapshots():
+    # 新表由 create_all 创建 (已存在时跳过)
+    db.create_all()
+    create_index('balance_snapshots', 'idx_last_tx', 'last_tx_id')
+
+
+def _dashboard_indexes():
+    # 卖家按状态页签、买家订单按成交时间的 keyset 分页，各状态计数只读索引
+    create_index('items', 'idx_seller_status_created', 'seller_id, status, created_at')
+    create_index('items', 'idx_bidder_status_end', 'highest_bidder_id, status, end_time')
+
+
+def _favorite_indexes():
+    # 收藏列表按 (created_at, id) keyset 分页，收藏提醒按拍品加载收藏者
+    create_index('favorites', 'idx_favorite_user_created', 'user_id, created_at')
+    create_index('favorites', 'idx_favorite_item', 'item_id')
+
+
+# (版本号, 名称, 执行函数)，只能追加，不要修改已发布的步骤
+MIGRATIONS = [
+    (1, 'baseline', _baseline),
+    (2, 'image_variants', _image_variants),
+    (3, 'order_deadlines', _order_deadlines),
+    (4, 'hot_query_indexes', _hot_query_indexes),
+    (5, 'ledger_keyset_index', _ledger_keyset_index),
+    (6, 'balance_snapshots', _balance_snapshots),
+    (7, 'dashboard_indexes', _dashboard_indexes),
+    (8, 'favorite_indexes', _favorite_indexes),
+]
+
+
+def applied_versions():
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    return {v for (v,) in db.session.query(SchemaMigration.version).all()}
+
+
+def migrate(log=print):
+    """执行所有未完成的迁移 (需在 app context 中调用)，返回本次执行的版本号"""
+    done = applied_versions()
+    ran = []
+    for version, name, step in MIGRATIONS:
+        if version in done:
+            continue
+        try:
+            step()
+        except Exception:
+            # 步骤本身失败 (包括建唯一索引时的重复数据) 时中止，后续版本依赖前面的步骤
+            db.session.rollback()
+            raise
+        try:
+            db.session.add(SchemaMigration(version=version, name=name, applied_at=datetime.now()))
+            db.session.commit()
+        except IntegrityError:
+            # 多个进程同时启动时，其他进程已执行并记录了该版本
+            db.session.rollback()
+            continue
+        log(f"已执行数据库迁移 {version}: {name}")
+        ran.append(version)
+    return ran
+
+
+# --- EXPLAIN 检查 ---
+
+def _explain_cases():
+    import query
+    from models import Item, User, Post, Appeal, WalletTransaction, Favorite
+    ledger = lambda **filters: query.wallet_transaction_query(WalletTransaction, User, **filters)
+    return [
+        ('get_index_items', lambda: query.get_index_items(Item, User)),
+        ('get_index_items(search)', lambda: query.get_index_items(Item, User, search_query='a', category='其他')),
+        ('get_admin_dashboard_items', lambda: query.get_admin_dashboard_items(Item)),
+        ('get_seller_items', lambda: query.get_seller_items(Item, User, 1)),
+        ('get_seller_items(search)', lambda: query.get_seller_items(Item, User, 1, '1')),
+        ('get_seller_items(status)', lambda: query.get_seller_items(Item, User, 1, status='ended', after='2024-01-01T00:00:00~1')),
+        ('get_seller_status_counts', lambda: query.get_seller_status_counts(Item, 1)),
+        ('get_buyer_won_items', lambda: query.get_buyer_won_items(Item, User, 1)),
+        ('get_buyer_won_items(search)', lambda: query.get_buyer_won_items(Item, User, 1, '1')),
+        ('get_buyer_won_items(tab)', lambda: query.get_buyer_won_items(Item, User, 1, tab='shipped')),
+        ('get_buyer_order_counts', lambda: query.get_buyer_order_counts(Item, 1)),
+        ('get_user_favorites', lambda: query.get_user_favorites(Favorite, Item, 1)),
+        ('get_search_users', lambda: query.get_search_users(User, 'a')),
+        ('get_user_posts', lambda: query.get_user_posts(Post, 1)),
+        ('get_user_public_items', lambda: query.get_user_public_items(Item, 1)),
+        ('get_appeal_list', lambda: query.get_appeal_list(Appeal)),
+        ('get_wallet_transactions', lambda: query.get_wallet_transactions(ledger(), WalletTransaction)),
+        ('get_wallet_transactions(user)', lambda: query.get_wallet_transactions(ledger(user='1'), WalletTransaction)),
+        ('get_wallet_transactions(type)', lambda: query.get_wallet_transactions(ledger(tx_type='payment'), WalletTransaction)),
+    ]
+
+
+def _full_scans(conn, statement, parameters, tables):
+    """返回该语句执行计划中做全表扫描的表"""
+    if conn.dialect.name == 'sqlite':
+        plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        # "SCAN items" 为全表扫描；"SCAN items USING INDEX ..." / "SEARCH ..." 走索引
+        scans = [row[-1].split()[1] for row in plan if row[-1].startswith('SCAN ') and ' USING ' not in row[-1]]
+    else:
+        result = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+        columns = list(result.keys())
+        scans = [row[columns.index('table')] for row in result.fetchall() if row[columns.index('type')] == 'ALL']
+    # 子查询 / 派生表的扫描不算
+    return [t for t in scans if t in tables]
+
+
+def explain_check():
+    """
+    依次调用 query.py 中的查询函数，捕获其执行的 SELECT 并逐条 EXPLAIN
+    :return: [(函数, 表, SQL)]，出现全表扫描的语句
+    """
+    from search import search_index
+    # 检索索引首次加载需要读取全部拍品，先加载，避免计入
+    search_index.ensure_loaded()
+    tables = set(db.metadata.tables)
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    failures = []
+    for name, call in _explain_cases():
+        captured.clear()
+        # 配置了只读副本时 query.py 的查询走副本，一并捕获 (执行计划在主库上检查)
+        engines = set(db.engines.values())
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', capture)
+        try:
+            call()
+        finally:
+            for engine in engines:
+                event.remove(engine, 'before_cursor_execute', capture)
+        conn = db.session.connection()
+        for statement, parameters in list(captured):
+            for table in _full_scans(conn, statement, parameters, tables):
+                failures.append((name, table, ' '.join(statement.split())))
+    db.session.rollback()
+    return failures
+
+
+def main(argv):
+    from app import create_app
+    app = create_app()
+    command = argv[1] if len(argv) > 1 else 'upgrade'
+    with app.app_context():
+        if command == 'upgrade':
+            ran = migrate()
+            print(f"完成，本次执行 {len(ran)} 个迁移")
+        elif command == 'status':
+            done = applied_versions()
+            for version, name, _ in MIGRATIONS:
+                print(f"{version:>4}  {'已执行' if version in done else '未执行'}  {name}")
+        elif command == 'explain':
+            failures = explain_check()
+            for name, table, statement in failures:
+                print(f"[全表扫描] {name}: {table}\n    {statement}")
+            print(f"检查 {len(_explain_cases())} 个查询函数，{len(failures)} 条语句存在全表扫描")
+            return 1 if failures else 0
+        else:
+            print(__doc__)
+            return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
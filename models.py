@@ -12,6 +12,7 @@ class User(UserMixin, db.Model):
     role = db.Column(db.String(20), nullable=False)
     email = db.Column(db.String(120), nullable=True) # 新增：电子邮箱
     avatar = db.Column(db.String(200), nullable=True) # 新增：用户头像文件名
+    avatar_variants = db.Column(db.String(64), nullable=True) # 头像已生成的衍生图尺寸 (见 images.py)
     banned_until = db.Column(db.DateTime, nullable=True) # 新增：封禁截止时间
     # 实名认证
     real_name = db.Column(db.String(80), nullable=True)
@@ -23,6 +24,12 @@ class User(UserMixin, db.Model):
     wallet_frozen = db.Column(db.Numeric(10, 2), default=Decimal('0.00'))
     created_at = db.Column(db.DateTime, default=datetime.now)
 
+# 订单期限
+PAY_TIMEOUT = timedelta(hours=24)            # 成交后未付款 -> 取消订单并处罚买家
+SHIP_TIMEOUT = timedelta(hours=72)           # 付款后未发货 -> 处罚卖家
+AUTO_CONFIRM_TIMEOUT = timedelta(hours=240)  # 发货后自动确认收货
+RECEIPT_EXTENSION = timedelta(hours=72)      # 买家每次延长收货
+
 class Item(db.Model):
     __tablename__ = 'items'
     id = db.Column(db.Integer, primary_key=True)
@@ -49,6 +56,10 @@ class Item(db.Model):
     shipping_status = db.Column(db.String(20), default='unshipped') # unshipped, shipped, received
     shipped_at = db.Column(db.DateTime, nullable=True) # 发货时间
     shipping_extended_count = db.Column(db.Integer, default=0) # 延长收货次数
+    # 订单期限 (状态流转时写入，超时检查按期限列走索引扫描)
+    pay_deadline = db.Column(db.DateTime, nullable=True) # 付款截止：成交后 24 小时
+    ship_deadline = db.Column(db.DateTime, nullable=True) # 发货截止：付款后 72 小时
+    auto_confirm_deadline = db.Column(db.DateTime, nullable=True) # 自动确认收货：发货后 240 小时，每次延长 +72 小时
     shipping_name = db.Column(db.String(80), nullable=True)
     shipping_phone = db.Column(db.String(20), nullable=True)
     shipping_address = db.Column(db.String(255), nullable=True)
@@ -59,14 +70,6 @@ class Item(db.Model):
     highest_bidder = db.relationship('User', foreign_keys=[highest_bidder_id])
     images = db.relationship('ItemImage', backref='item', lazy=True)
 
-    @property
-    def auto_confirm_deadline(self):
-        if not self.shipped_at:
-            return None
-        # 基础 240 小时 + 每次延长 72 小时
-        hours = 240 + (self.shipping_extended_count * 72)
-        return self.shipped_at + timedelta(hours=hours)
-
 class Bid(db.Model):
     __tablename__ = 'bids'
     id = db.Column(db.Integer, primary_key=True)
@@ -83,6 +86,7 @@ class ItemImage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     item_id = db.Column(db.Integer, db.ForeignKey('items.id'), nullable=False)
     image_url = db.Column(db.String(255), nullable=False)
+    variants = db.Column(db.String(64), nullable=True) # 已生成的衍生图尺寸，如 detail,card,thumb
     is_primary = db.Column(db.Boolean, default=False)
 
 class Post(db.Model):
@@ -174,3 +178,45 @@ class Favorite(db.Model):
 
     user = db.relationship('User', backref=db.backref('favorites', lazy='dynamic'))
     item = db.relationship('Item', backref=db.backref('favorited_by', lazy='dynamic'))
+
+class NotificationOutbox(db.Model):
+    """系统消息发件箱：业务事务内只追加记录，由 outbox 后台线程批量投递"""
+    __tablename__ = 'notification_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id'), nullable=False)
+    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    skip_notification = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+class WorkerLease(db.Model):
+    """多进程部署时的租约：持有未过期租约的进程是 leader，负责运行定时任务"""
+    __tablename__ = 'worker_leases'
+    name = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class ItemBidSummary(db.Model):
+    """拍品出价汇总的检查点 (内存中的 bid_summary.BidSummary 定期写回)"""
+    __tablename__ = 'bid_summaries'
+    item_id = db.Column(db.Integer, db.ForeignKey('items.id'), primary_key=True)
+    total_bids = db.Column(db.Integer, nullable=False, default=0)
+    unique_bidders = db.Column(db.Integer, nullable=False, default=0)
+    bidder_ids = db.Column(db.Text, nullable=False, default='') # 逗号分隔的出价用户 id
+    recent_bids = db.Column(db.Text, nullable=False, default='[]') # 最近 N 笔出价 JSON: [[时间, 用户id, 金额], ...]
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+class BalanceSnapshot(db.Model):
+    """用户余额快照：截至流水 last_tx_id (含) 的余额，对账时只需汇总之后的流水 (见 reconcile.py)"""
+    __tablename__ = 'balance_snapshots'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    balance = db.Column(db.Numeric(12, 2), nullable=False, default=Decimal('0.00'))
+    last_tx_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+class SchemaMigration(db.Model):
+    """已执行的数据库迁移版本 (见 migrations.py)"""
+    __tablename__ = 'schema_migrations'
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.now)
@@ -0,0 +1,191 @@
+"""
+系统消息发件箱投递线程
+
+业务代码通过 services.send_system_message 在自己的事务中追加 notification_outbox 记录，
+本线程在事务提交后被唤醒，按批次投递：
+- 管理员账户只查询一次并缓存
+- 拍品、会话每批各查询一次，缺失的会话批量创建
+- messages 批量插入，chat_sessions 的未读数 / 最后消息每批一条 UPDATE
+- Socket.IO 全局提示按用户房间合并，每批每个用户只推送一次
+"""
+import threading
+from datetime import datetime
+from sqlalchemy import case, event, func, tuple_
+from sqlalchemy.orm import Session
+from extensions import db, socketio
+from models import User, Item, ChatSession, Message, NotificationOutbox
+from counters import counters
+
+
+class OutboxWorker:
+    def __init__(self, batch_size=500, poll_interval=30):
+        self.batch_size = batch_size
+        # 兜底轮询间隔 (秒)，用于投递其他进程写入的记录
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._admin = None
+        self._started = False
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _get_admin(self):
+        if self._admin is None:
+            admin = User.query.filter_by(role='admin').first()
+            if admin:
+                self._admin = (admin.id, admin.avatar)
+        return self._admin
+
+    def drain(self):
+        """投递发件箱中的全部记录 (需在 app context 中调用)，返回投递条数"""
+        total = 0
+        while True:
+            n = self._deliver_batch()
+            total += n
+            if n < self.batch_size:
+                return total
+
+    def _deliver_batch(self):
+        rows = NotificationOutbox.query.order_by(NotificationOutbox.id).limit(self.batch_size).with_for_update(skip_locked=True).all()
+        if not rows:
+            db.session.commit()
+            return 0
+        admin = self._get_admin()
+        if admin is None:
+            # 尝试查找任意管理员，或者如果不存则需要手动创建（这里假设至少有一个）
+            db.session.rollback()
+            print("System Message Error: No admin user found.")
+            return 0
+        admin_id, admin_avatar = admin
+
+        sellers = dict(db.session.query(Item.id, Item.seller_id).filter(
+            Item.id.in_({r.item_id for r in rows})
+        ).all())
+
+        # 确定会话双方
+        # 逻辑：为了让接收者在收件箱看到"Admin"，我们需要创建一个会话
+        # 其中一方是 receiver_id, 另一方是 admin.id
+        # 如果 receiver 是该商品的 seller => session.seller_id=receiver, session.buyer_id=admin
+        # 否则 (receiver是买家) => session.buyer_id=receiver, session.seller_id=admin
+        pending = []
+        for r in rows:
+            # 如果接收者自己就是管理员，不需要发送系统消息给自己
+            if r.receiver_id == admin_id or r.item_id not in sellers:
+                continue
+            if r.receiver_id == sellers[r.item_id]:
+                key = (r.item_id, admin_id, r.receiver_id)
+            else:
+                key = (r.item_id, r.receiver_id, admin_id)
+            pending.append((key, r))
+
+        emits = []
+        notify_users = set()
+        unread = set()  # (receiver_id, session_id)
+        if pending:
+            keys = {key for key, _ in pending}
+            sessions = {
+                (s.item_id, s.buyer_id, s.seller_id): s.id
+                for s in db.session.query(ChatSession.id, ChatSession.item_id, ChatSession.buyer_id, ChatSession.seller_id).filter(
+                    tuple_(ChatSession.item_id, ChatSession.buyer_id, ChatSession.seller_id).in_(list(keys))
+                ).all()
+            }
+            missing = [ChatSession(item_id=k[0], buyer_id=k[1], seller_id=k[2], buyer_unread=0, seller_unread=0)
+                       for k in keys if k not in sessions]
+            if missing:
+                db.session.add_all(missing)
+                db.session.flush() # 获取新会话的 id
+                for s in missing:
+                    sessions[(s.item_id, s.buyer_id, s.seller_id)] = s.id
+
+            now = datetime.now()
+            messages = []
+            buyer_inc = {}
+            seller_inc = {}
+            last_message = {}
+            for key, r in pending:
+                session_id = sessions[key]
+                messages.append({
+                    'chat_session_id': session_id,
+                    'sender_id': admin_id,
+                    'content': r.content,
+                    'timestamp': now,
+                })
+                # 增加接收方未读计数
+                if r.receiver_id == key[1]:
+                    buyer_inc[session_id] = buyer_inc.get(session_id, 0) + 1
+                else:
+                    seller_inc[session_id] = seller_inc.get(session_id, 0) + 1
+                last_message[session_id] = f"[系统通知] {r.content}"[:255]
+                unread.add((r.receiver_id, session_id))
+
+                if not r.skip_notification:
+                    notify_users.add(r.receiver_id)
+                # 如果用户恰好打开了这个对话窗口 (room id规则见 chat.html)
+                # room = 'chat_item_{item_id}_{min_uid}_{max_uid}'
+                item_id, b_id, s_id = key
+                emits.append((f'chat_item_{item_id}_{min(b_id, s_id)}_{max(b_id, s_id)}', {
+                    'sender': '管理员',
+                    'sender_id': admin_id,
+                    'msg': r.content,
+                    'timestamp': now.isoformat(),
+                    'item_id': item_id,
+                    'avatar': admin_avatar
+                }))
+
+            db.session.bulk_insert_mappings(Message, messages)
+            cs = ChatSession.__table__
+            db.session.execute(cs.update().where(cs.c.id.in_(list(last_message))).values(
+                buyer_unread=func.coalesce(cs.c.buyer_unread, 0) + (case(buyer_inc, value=cs.c.id, else_=0) if buyer_inc else 0),
+                seller_unread=func.coalesce(cs.c.seller_unread, 0) + (case(seller_inc, value=cs.c.id, else_=0) if seller_inc else 0),
+                last_message=case(last_message, value=cs.c.id, else_=cs.c.last_message),
+                updated_at=now
+            ))
+
+        NotificationOutbox.query.filter(NotificationOutbox.id.in_([r.id for r in rows])).delete(synchronize_session=False)
+        db.session.commit()
+        for receiver_id, session_id in unread:
+            counters.mark_unread(receiver_id, session_id)
+
+        # 实时推送通知 (如果在线)
+        # 注意：socketio event 需要和前端 chat.js 监听的一致
+        # 前端 chat.js 有监听 'new_message' 用于当前聊天窗口，和 'new_chat_notification' 用于全局提示
+        for receiver_id in notify_users:
+            socketio.emit('new_chat_notification', {'msg': '您有一条新系统消息'}, room=f"user_{receiver_id}")
+        for room_id, payload in emits:
+            socketio.emit('new_message', payload, room=room_id)
+        return len(rows)
+
+    def start(self, app):
+        if self._started:
+            return
+        self._started = True
+        socketio.start_background_task(self._run, app)
+
+    def _run(self, app):
+        # 启动时先投递上次遗留的记录
+        self._wakeup.set()
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            with app.app_context():
+                try:
+                    self.drain()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Outbox delivery error: {e}")
+                finally:
+                    db.session.remove()
+
+
+outbox_worker = OutboxWorker()
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_outbox(session):
+    if session.info.pop('outbox_pending', False):
+        outbox_worker.notify()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_outbox_flag(session):
+    session.info.pop('outbox_pending', None)
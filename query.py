@@ -1,6 +1,85 @@
-from sqlalchemy import or_
+import re
+import time
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import or_, and_, func, select, DateTime
+from sqlalchemy.orm import selectinload, contains_eager
+from replica import replica_reads
+from search import search_index, F_NAME, F_DESC, F_CATEGORY, F_SELLER, F_BUYER, F_ORDER
 
-def get_index_items(Item, User, search_query='', category=None, sort_option='default'):
+# 本模块中的列表查询均为只读，配置了只读副本时走副本 (见 replica.py)
+
+# 搜索时每个分区最多取相关度最高的若干条，再按排序选项分页
+SEARCH_LIMIT = 1000
+# 订单号 (ORD + 年月日时分秒 + 拍品ID) 在倒排索引中是一个词条，只能前缀匹配；
+# 查询词形如订单号片段时，另在本人的订单范围内按子串匹配 (日期、拍品ID 等中间 / 结尾部分)
+ORDER_FRAGMENT = re.compile(r'[A-Za-z0-9]+')
+# 管理后台历史列表 (已结束拍品 / 已处理申诉) 显示的最近条数
+HISTORY_LIMIT = 100
+
+# 资金流水：每页条数的可选值、总数最多数到的条数 (超出显示为 "N+") 与总数缓存时间 (秒)
+LEDGER_PAGE_SIZES = (20, 50, 100)
+LEDGER_COUNT_LIMIT = 10000
+LEDGER_COUNT_TTL = 60
+# 导出时每批从服务端游标读取的行数
+LEDGER_EXPORT_BATCH = 1000
+
+# 首页排序选项 -> (排序字段, 是否降序)
+INDEX_SORTS = {
+    'start_time_desc': ('start_time', True),   # 上架时间 (最新)
+    'end_time_asc': ('end_time', False),       # 截止时间 (最近)
+    'end_time_desc': ('end_time', True),       # 截止时间 (最远)
+    'price_asc': ('current_price', False),     # 价格 (低到高) - 对active/ended是current_price, upcoming是start_price
+    'price_desc': ('current_price', True),     # 价格 (高到低)
+    'start_price_asc': ('start_price', False), # 起拍价 (低到高)
+    'start_price_desc': ('start_price', True), # 起拍价 (高到低)
+}
+
+def encode_cursor(value, item_id):
+    """keyset 游标：排序字段值 + id"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return f"{value}~{item_id}"
+
+def decode_cursor(cursor, column):
+    try:
+        raw, item_id = cursor.rsplit('~', 1)
+        if isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(raw)
+        else:
+            value = Decimal(raw)
+        return value, int(item_id)
+    except (AttributeError, ValueError, ArithmeticError):
+        return None
+
+def keyset_page(query_obj, column, descending, id_column, after=None, page_size=24):
+    """
+    按 (column, id) 做 keyset 分页，避免 OFFSET 深翻页
+    :return: (本页数据, 下一页游标 或 None)
+    """
+    if after:
+        decoded = decode_cursor(after, column)
+        if decoded:
+            value, last_id = decoded
+            if descending:
+                query_obj = query_obj.filter(or_(column < value, and_(column == value, id_column < last_id)))
+            else:
+                query_obj = query_obj.filter(or_(column > value, and_(column == value, id_column > last_id)))
+    if descending:
+        query_obj = query_obj.order_by(column.desc(), id_column.desc())
+    else:
+        query_obj = query_obj.order_by(column.asc(), id_column.asc())
+    rows = query_obj.limit(page_size + 1).all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, column.key), last.id)
+    return rows, next_cursor
+
+@replica_reads()
+def get_index_items(Item, User, search_query='', category=None, sort_option='default',
+                    active_after=None, upcoming_after=None, page_size=24):
     """
     获首页所需的各类商品列表
     :param Item: Item 模型类
@@ -8,111 +87,193 @@ def get_index_items(Item, User, search_query='', category=None, sort_option='def
     :param search_query: 搜索关键词
     :param category: 分类筛选
     :param sort_option: 排序选项
-    :return: (active_items, upcoming_items, ended_items)
+    :param active_after: 进行中列表的 keyset 游标
+    :param upcoming_after: 即将开始列表的 keyset 游标
+    :return: dict，active / upcoming 为 (items, next_cursor, total)，ended 为最近结束的 12 个
     """
     
+    # 倒排索引匹配：商品名 / 描述 / 分类 / 卖家用户名 (各分区的状态由 SQL 过滤，索引中的状态可能滞后于其他进程)
+    ids = None
+    if search_query:
+        ids = search_index.search(search_query, F_NAME | F_DESC | F_CATEGORY | F_SELLER,
+                                  category=category or None, limit=SEARCH_LIMIT)
+
     # 基础查询构造器
     def get_base_query(status_list):
         q_obj = Item.query.filter(Item.status.in_(status_list))
         if category:
             q_obj = q_obj.filter(Item.category == category)
-        if search_query:
-            # 联表查询：匹配商品名 或 卖家用户名
-            q_obj = q_obj.join(User, Item.seller_id == User.id).filter(
-                or_(Item.name.like(f'%{search_query}%'), User.username.like(f'%{search_query}%'))
-            )
+        if ids is not None:
+            q_obj = q_obj.filter(Item.id.in_(ids))
         return q_obj
 
-    # 排序逻辑应用器
-    def apply_sort(query_obj, default_sort):
-        if sort_option == 'start_time_desc': # 上架时间 (最新)
-            return query_obj.order_by(Item.start_time.desc())
-        elif sort_option == 'end_time_asc': # 截止时间 (最近)
-            return query_obj.order_by(Item.end_time.asc())
-        elif sort_option == 'end_time_desc': # 截止时间 (最远)
-            return query_obj.order_by(Item.end_time.desc())
-        elif sort_option == 'price_asc': # 价格 (低到高) - 对active/ended是current_price, upcoming是start_price
-            return query_obj.order_by(Item.current_price.asc())
-        elif sort_option == 'price_desc': # 价格 (高到低)
-            return query_obj.order_by(Item.current_price.desc())
-        elif sort_option == 'start_price_asc': # 起拍价 (低到高)
-            return query_obj.order_by(Item.start_price.asc())
-        elif sort_option == 'start_price_desc': # 起拍价 (高到低)
-            return query_obj.order_by(Item.start_price.desc())
-        return default_sort(query_obj)
-
-    # 默认排序定义
+    # 排序字段：未指定时使用各分区的默认排序
+    def sort_key(default_column, default_desc):
+        if sort_option in INDEX_SORTS:
+            name, desc = INDEX_SORTS[sort_option]
+            return getattr(Item, name), desc
+        return default_column, default_desc
+
+    # 首图随列表一次性加载，避免模板中逐个懒加载
+    load_images = selectinload(Item.images)
+
     # Active: 默认按结束时间升序 (快结束的在前)
     active_query = get_base_query(['active'])
-    active_items = apply_sort(active_query, lambda q: q.order_by(Item.end_time)).all()
+    column, desc = sort_key(Item.end_time, False)
+    active_items, active_next = keyset_page(active_query.options(load_images), column, desc, Item.id, active_after, page_size)
 
     # Upcoming: 默认按开始时间升序 (快开始的在前)
     # 起拍价排序对 Upcoming 也有效
     upcoming_query = get_base_query(['approved'])
-    upcoming_items = apply_sort(upcoming_query, lambda q: q.order_by(Item.start_time)).all()
+    column, desc = sort_key(Item.start_time, False)
+    upcoming_items, upcoming_next = keyset_page(upcoming_query.options(load_images), column, desc, Item.id, upcoming_after, page_size)
     
     # Ended: 默认按结束时间降序 (刚结束的在前)
     ended_query = get_base_query(['ended'])
-    ended_items = apply_sort(ended_query, lambda q: q.order_by(Item.end_time.desc())).limit(12).all()
+    column, desc = sort_key(Item.end_time, True)
+    ended_items, _ = keyset_page(ended_query.options(load_images), column, desc, Item.id, None, 12)
     
-    return active_items, upcoming_items, ended_items
+    return {
+        'active': (active_items, active_next, active_query.count()),
+        'upcoming': (upcoming_items, upcoming_next, upcoming_query.count()),
+        'ended': ended_items,
+    }
 
+@replica_reads()
 def get_admin_dashboard_items(Item):
     """
     获取管理员后台所需的商品列表
     """
     pending_items = Item.query.filter_by(status='pending').all()
     active_items = Item.query.filter(Item.status.in_(['active', 'approved'])).order_by(Item.start_time).all()
-    # 历史记录包含已结束和被强制终止的拍品
-    ended_items = Item.query.filter(Item.status.in_(['ended', 'stopped'])).order_by(Item.end_time.desc()).all()
+    # 历史记录包含已结束和被强制终止的拍品 (只取最近的，按 (status, end_time) 索引)
+    ended_items = Item.query.filter(Item.status.in_(['ended', 'stopped'])).order_by(Item.end_time.desc()).limit(HISTORY_LIMIT).all()
     
     return pending_items, active_items, ended_items
 
-def get_seller_items(Item, User, seller_id, search_query=''):
+# 卖家 "我的拍品" 的状态页签 (None 为全部)
+SELLER_TABS = ('pending', 'approved', 'active', 'ended', 'rejected')
+# 买家 "我的订单" 的页签 -> (payment_status, shipping_status)，shipping_status 为 None 时不限
+BUYER_TABS = {
+    'unpaid': ('unpaid', None),
+    'unshipped': ('paid', 'unshipped'),
+    'shipped': ('paid', 'shipped'),
+    'received': ('paid', 'received'),
+    'cancelled': ('timeout_cancelled', None),
+}
+# 卖家 / 买家订单列表每页条数
+DASHBOARD_PAGE_SIZE = 20
+
+@replica_reads()
+def get_seller_items(Item, User, seller_id, search_query='', status=None, after=None, page_size=DASHBOARD_PAGE_SIZE):
     """
-    获取卖家发布的商品，支持搜索
+    获取卖家发布的商品 (按提交时间倒序 keyset 分页)，支持状态页签与搜索
     :param search_query: 订单号/商品名/买家ID/买家用户名
+    :param status: SELLER_TABS 中的状态，None 为全部
+    :return: (本页数据, 下一页游标 或 None)
     """
-    q = Item.query.filter_by(seller_id=seller_id)
+    q = Item.query.filter(Item.seller_id == seller_id)
+    if status in SELLER_TABS:
+        q = q.filter(Item.status == status)
     
     if search_query:
-        # 尝试匹配: 订单号 OR 商品名 OR (买家ID 或 买家用户名)
-        # 需 Join User 表来匹配买家用户名
-        q = q.outerjoin(User, Item.highest_bidder_id == User.id).filter(
-            or_(
-                Item.order_hash.like(f'%{search_query}%'),
-                Item.name.like(f'%{search_query}%'),
-                User.username.like(f'%{search_query}%'),
-                User.id == search_query if search_query.isdigit() else False
-            )
-        )
-        
-    return q.order_by(Item.created_at.desc()).all()
-
-def get_buyer_won_items(Item, User, buyer_id, search_query=''):
-    """
-    获取买家赢得的商品，支持搜索
+        # 尝试匹配: 订单号 OR 商品名 OR 买家用户名 (倒排索引)，买家ID 单独按 (highest_bidder_id, ...) 索引查出
+        ids = search_index.search(search_query, F_ORDER | F_NAME | F_BUYER, seller_id=seller_id, limit=SEARCH_LIMIT)
+        if search_query.isdigit():
+            ids = set(ids) | {i for (i,) in Item.query.with_entities(Item.id).filter(
+                Item.highest_bidder_id == int(search_query), Item.seller_id == seller_id).limit(SEARCH_LIMIT)}
+        if ORDER_FRAGMENT.fullmatch(search_query):
+            ids = set(ids) | {i for (i,) in Item.query.with_entities(Item.id).filter(
+                Item.seller_id == seller_id, Item.order_hash.contains(search_query)).limit(SEARCH_LIMIT)}
+        q = q.filter(Item.id.in_(ids))
+    
+    # 首图与买家随本页一次性加载
+    q = q.options(selectinload(Item.images), selectinload(Item.highest_bidder))
+    return keyset_page(q, Item.created_at, True, Item.id, after, page_size)
+
+@replica_reads()
+def get_seller_status_counts(Item, seller_id):
+    """卖家各状态的拍品数 (一条 GROUP BY)，'all' 为合计"""
+    rows = Item.query.with_entities(Item.status, func.count(Item.id)) \
+        .filter(Item.seller_id == seller_id).group_by(Item.status).all()
+    counts = {status: 0 for status in SELLER_TABS}
+    counts.update(rows)
+    counts['all'] = sum(n for _, n in rows)
+    return counts
+
+@replica_reads()
+def get_buyer_won_items(Item, User, buyer_id, search_query='', tab=None, after=None, page_size=DASHBOARD_PAGE_SIZE):
+    """
+    获取买家赢得的商品 (按成交时间倒序 keyset 分页)，支持订单状态页签与搜索
     :param search_query: 订单号/商品名/卖家ID/卖家用户名
+    :param tab: BUYER_TABS 中的页签，None 为全部
+    :return: (本页数据, 下一页游标 或 None)
     """
-    q = Item.query.filter_by(status='ended', highest_bidder_id=buyer_id)
+    q = Item.query.filter(Item.highest_bidder_id == buyer_id, Item.status == 'ended')
+    if tab in BUYER_TABS:
+        payment_status, shipping_status = BUYER_TABS[tab]
+        q = q.filter(Item.payment_status == payment_status)
+        if shipping_status:
+            q = q.filter(Item.shipping_status == shipping_status)
     
     if search_query:
-        # Join User 表来匹配卖家用户名
-        q = q.join(User, Item.seller_id == User.id).filter(
-            or_(
-                Item.order_hash.like(f'%{search_query}%'),
-                Item.name.like(f'%{search_query}%'),
-                User.username.like(f'%{search_query}%'),
-                User.id == search_query if search_query.isdigit() else False
-            )
-        )
-        
-    return q.order_by(Item.end_time.desc()).all()
+        # 尝试匹配: 订单号 OR 商品名 OR 卖家用户名 (倒排索引，限定在买家自己的订单范围内)，卖家ID 直接作为过滤条件
+        won = {i for (i,) in Item.query.with_entities(Item.id).filter(
+            Item.highest_bidder_id == buyer_id, Item.status == 'ended')}
+        ids = search_index.search(search_query, F_ORDER | F_NAME | F_SELLER, ids=won, limit=SEARCH_LIMIT)
+        if search_query.isdigit():
+            ids = set(ids) | {i for (i,) in Item.query.with_entities(Item.id).filter(
+                Item.highest_bidder_id == buyer_id, Item.status == 'ended',
+                Item.seller_id == int(search_query)).limit(SEARCH_LIMIT)}
+        if ORDER_FRAGMENT.fullmatch(search_query):
+            ids = set(ids) | {i for (i,) in Item.query.with_entities(Item.id).filter(
+                Item.highest_bidder_id == buyer_id, Item.status == 'ended',
+                Item.order_hash.contains(search_query)).limit(SEARCH_LIMIT)}
+        q = q.filter(Item.id.in_(ids))
+    
+    # 首图与卖家随本页一次性加载
+    q = q.options(selectinload(Item.images), selectinload(Item.seller))
+    return keyset_page(q, Item.end_time, True, Item.id, after, page_size)
+
+@replica_reads()
+def get_buyer_order_counts(Item, buyer_id):
+    """买家各订单页签的数量 (一条 GROUP BY)，'all' 为合计"""
+    rows = Item.query.with_entities(Item.payment_status, Item.shipping_status, func.count(Item.id)) \
+        .filter(Item.highest_bidder_id == buyer_id, Item.status == 'ended') \
+        .group_by(Item.payment_status, Item.shipping_status).all()
+    counts = {tab: 0 for tab in BUYER_TABS}
+    for payment_status, shipping_status, n in rows:
+        for tab, (tab_payment, tab_shipping) in BUYER_TABS.items():
+            if payment_status == tab_payment and tab_shipping in (None, shipping_status):
+                counts[tab] += n
+    counts['all'] = sum(n for _, _, n in rows)
+    return counts
+
+@replica_reads()
+def get_user_favorites(Favorite, Item, user_id, after=None, page_size=DASHBOARD_PAGE_SIZE):
+    """
+    用户收藏的拍品 (按收藏时间倒序 keyset 分页)，收藏与拍品一次 JOIN 查出，首图随本页一次性加载
+    :return: (本页拍品, 下一页游标 或 None)
+    """
+    q = Favorite.query.join(Favorite.item).filter(Favorite.user_id == user_id) \
+        .options(contains_eager(Favorite.item).selectinload(Item.images))
+    favorites, next_cursor = keyset_page(q, Favorite.created_at, True, Favorite.id, after, page_size)
+    return [f.item for f in favorites], next_cursor
+
+@replica_reads()
+def get_search_users(User, search_query, limit=10):
+    """首页搜索时匹配的卖家 (用户名)"""
+    ids = search_index.search_users(search_query)
+    if not ids:
+        return []
+    return User.query.filter(User.id.in_(ids), User.role == 'seller').order_by(User.id).limit(limit).all()
 
+@replica_reads()
 def get_user_posts(Post, user_id):
     """获取用户的动态列表"""
     return Post.query.filter_by(user_id=user_id).order_by(Post.created_at.desc()).all()
 
+@replica_reads()
 def get_user_public_items(Item, user_id):
     """获取用户(卖家)公开展示的拍品 (Active/Upcoming/Ended)"""
     return Item.query.filter(
@@ -120,11 +281,100 @@ def get_user_public_items(Item, user_id):
         Item.status.in_(['active', 'approved', 'ended'])
     ).order_by(Item.created_at.desc()).all()
 
+@replica_reads()
 def get_appeal_list(Appeal):
     """
     获取申诉列表 (替代原 get_appeal_items)
     """
-    all_appeals = Appeal.query.order_by(Appeal.created_at.desc()).all()
-    pending_appeals = [a for a in all_appeals if a.status == 'pending']
-    history_appeals = [a for a in all_appeals if a.status != 'pending']
+    # 待处理的全部取出 (按 (status, created_at) 索引)，已处理的沿 created_at 索引倒序只取最近的
+    pending_appeals = Appeal.query.filter(Appeal.status == 'pending').order_by(Appeal.created_at.desc()).all()
+    history_appeals = Appeal.query.filter(Appeal.status != 'pending').order_by(Appeal.created_at.desc()).limit(HISTORY_LIMIT).all()
     return pending_appeals, history_appeals
+
+# --- 资金流水 ---
+
+_ledger_counts = {}  # 筛选条件 -> (过期时间, 条数)
+
+
+def wallet_transaction_query(WalletTransaction, User, user='', tx_type='', start=None, end=None):
+    """
+    按筛选条件构造资金流水查询 (未排序)
+    :param user: 用户 ID，或用户名片段 (模糊匹配，在数据库中以子查询完成)
+    :param start: 起始时间 (含)
+    :param end: 截止时间 (含)
+    """
+    q = WalletTransaction.query
+    if user:
+        if user.isdigit():
+            q = q.filter(WalletTransaction.user_id == int(user))
+        else:
+            q = q.filter(WalletTransaction.user_id.in_(
+                select(User.id).where(User.username.like(f"%{user}%"))
+            ))
+    if tx_type:
+        q = q.filter(WalletTransaction.type == tx_type)
+    if start:
+        q = q.filter(WalletTransaction.created_at >= start)
+    if end:
+        q = q.filter(WalletTransaction.created_at <= end)
+    return q
+
+
+@replica_reads()
+def count_wallet_transactions(query_obj, WalletTransaction, key):
+    """
+    满足条件的流水条数，最多数到 LEDGER_COUNT_LIMIT 条 (返回 LEDGER_COUNT_LIMIT + 1 表示超出)
+    同一筛选条件 (key) 的结果缓存 LEDGER_COUNT_TTL 秒，翻页时不再重复计数
+    """
+    now = time.monotonic()
+    entry = _ledger_counts.get(key)
+    if entry and entry[0] > now:
+        return entry[1]
+    limited = query_obj.with_entities(WalletTransaction.id).limit(LEDGER_COUNT_LIMIT + 1).subquery()
+    total = query_obj.session.query(func.count()).select_from(limited).scalar()
+    if len(_ledger_counts) >= 1000:
+        _ledger_counts.clear()
+    _ledger_counts[key] = (now + LEDGER_COUNT_TTL, total)
+    return total
+
+
+@replica_reads()
+def get_wallet_transactions(query_obj, WalletTransaction, after=None, before=None, page_size=50):
+    """
+    按 (created_at, id) 倒序做 keyset 分页
+    :param after: 下一页游标 (本页从该条之后开始)
+    :param before: 上一页游标 (本页到该条之前结束)
+    :return: (本页流水, 上一页游标 或 None, 下一页游标 或 None)
+    """
+    column, id_column = WalletTransaction.created_at, WalletTransaction.id
+    query_obj = query_obj.options(selectinload(WalletTransaction.user), selectinload(WalletTransaction.item))
+    if before:
+        # 反向取 before 之前的一页，再翻转回倒序
+        rows, more = keyset_page(query_obj, column, False, id_column, before, page_size)
+        rows.reverse()
+        has_prev, has_next = more is not None, True
+    else:
+        rows, more = keyset_page(query_obj, column, True, id_column, after, page_size)
+        has_prev, has_next = bool(after), more is not None
+    if not rows:
+        return rows, None, None
+    prev_cursor = encode_cursor(rows[0].created_at, rows[0].id) if has_prev else None
+    next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id) if has_next else None
+    return rows, prev_cursor, next_cursor
+
+
+def iter_wallet_transactions(query_obj, WalletTransaction, User, Item):
+    """
+    按 (created_at, id) 倒序逐行返回导出所需的字段
+    使用服务端游标每次读取 LEDGER_EXPORT_BATCH 行，内存占用与导出的总行数无关
+    """
+    rows = query_obj.with_entities(
+        WalletTransaction.id, WalletTransaction.created_at, WalletTransaction.user_id, User.username,
+        WalletTransaction.type, WalletTransaction.direction, WalletTransaction.amount,
+        WalletTransaction.balance_after, WalletTransaction.item_id, Item.name, WalletTransaction.description,
+    ).join(User, User.id == WalletTransaction.user_id) \
+        .outerjoin(Item, Item.id == WalletTransaction.item_id) \
+        .order_by(WalletTransaction.created_at.desc(), WalletTransaction.id.desc()) \
+        .yield_per(LEDGER_EXPORT_BATCH)
+    for row in rows:
+        yield row
@@ -0,0 +1,155 @@
+"""
+资金对账
+
+核对 users.wallet_balance 是否等于该用户全部资金流水的 入账 - 扣款。
+每个用户在 balance_snapshots 中保存 "截至流水 last_tx_id 的余额"，每次对账只处理上次之后新增的流水：
+  1. 按主键区间把新流水分块 (每块 RECONCILE_CHUNK 条)，每块 1 条 GROUP BY user_id 的聚合查询
+     (在数据库中按用户汇总净额与最后一笔流水 id)，把净额累加到快照，逐块提交 (中断后可继续)
+  2. 核对本次有新流水的用户 (full=True 时核对全部用户)：
+     - 快照余额 == 最后一笔流水的 balance_after
+     - 快照余额 + 快照之后的流水 == users.wallet_balance (同一事务中读取，读到的是一致的数据)
+只处理 RECONCILE_LAG 之前写入的流水，避免自增 id 较小但提交较晚的流水被跳过。
+快照按用户记录 last_tx_id，同一条流水不会被重复累加，重复执行 / 多个进程同时执行都不会算错。
+
+用法:
+  python reconcile.py             增量对账
+  python reconcile.py --full      增量对账后核对全部用户的余额
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import case, func, or_
+from extensions import db
+from models import User, WalletTransaction, BalanceSnapshot
+
+# 每块聚合的流水条数 (按主键区间)
+RECONCILE_CHUNK = 100000
+# 只对账该时间之前写入的流水
+RECONCILE_LAG = timedelta(minutes=5)
+# 后台任务中的对账间隔 (秒)
+RECONCILE_INTERVAL = 3600
+CENT = Decimal('0.01')
+
+# 最近一次对账的统计：runs, rows, chunks, checked, mismatches, last_ms, last_run
+RECONCILE_METRICS = {'runs': 0, 'rows': 0, 'chunks': 0, 'checked': 0, 'mismatches': 0, 'last_ms': 0.0, 'last_run': None}
+
+_signed = case((WalletTransaction.direction == 'credit', WalletTransaction.amount), else_=-WalletTransaction.amount)
+
+
+def _money(value):
+    return Decimal(value or 0).quantize(CENT)
+
+
+def _watermark():
+    """已对账到的流水 id：各快照 last_tx_id 的最大值 (最后一笔被处理的流水必定是某个用户的 last_tx_id)"""
+    return db.session.query(func.max(BalanceSnapshot.last_tx_id)).scalar() or 0
+
+
+def _apply_chunk(lo, hi):
+    """把 (lo, hi] 区间的流水按用户汇总到快照，返回 (流水条数, {user_id: 快照})"""
+    # 每个用户只计入其快照之后的流水，区间重复处理时不会重复累加
+    rows = db.session.query(
+        WalletTransaction.user_id, func.sum(_signed), func.max(WalletTransaction.id), func.count(WalletTransaction.id)
+    ).outerjoin(BalanceSnapshot, BalanceSnapshot.user_id == WalletTransaction.user_id).filter(
+        WalletTransaction.id > lo,
+        WalletTransaction.id <= hi,
+        or_(BalanceSnapshot.last_tx_id.is_(None), WalletTransaction.id > BalanceSnapshot.last_tx_id)
+    ).group_by(WalletTransaction.user_id).all()
+    if not rows:
+        return 0, {}
+    snapshots = {s.user_id: s for s in BalanceSnapshot.query.filter(BalanceSnapshot.user_id.in_([r[0] for r in rows])).all()}
+    n = 0
+    for user_id, delta, last_id, count in rows:
+        snap = snapshots.get(user_id)
+        if snap is None:
+            snap = snapshots[user_id] = BalanceSnapshot(user_id=user_id, balance=Decimal('0.00'), last_tx_id=0)
+            db.session.add(snap)
+        snap.balance = _money(snap.balance) + _money(delta)
+        snap.last_tx_id = last_id
+        n += count
+    return n, snapshots
+
+
+def _check(user_ids, hi):
+    """核对快照与最后一笔流水、与用户当前余额，返回不一致的记录"""
+    mismatches = []
+    snaps = BalanceSnapshot.query
+    users = db.session.query(User.id, User.wallet_balance)
+    tail = db.session.query(WalletTransaction.user_id, func.sum(_signed)).filter(WalletTransaction.id > hi)
+    if user_ids is not None:
+        ids = list(user_ids)
+        snaps = snaps.filter(BalanceSnapshot.user_id.in_(ids))
+        users = users.filter(User.id.in_(ids))
+        tail = tail.filter(WalletTransaction.user_id.in_(ids))
+    snapshots = {s.user_id: s for s in snaps.all()}
+    after = dict(tail.group_by(WalletTransaction.user_id).all())
+
+    last_ids = [s.last_tx_id for s in snapshots.values() if s.last_tx_id]
+    last_after = {}
+    for start in range(0, len(last_ids), 1000):
+        last_after.update(db.session.query(WalletTransaction.user_id, WalletTransaction.balance_after).filter(
+            WalletTransaction.id.in_(last_ids[start:start + 1000])).all())
+
+    checked = 0
+    for user_id, wallet_balance in users.all():
+        checked += 1
+        snap = snapshots.get(user_id)
+        snap_balance = _money(snap.balance) if snap else Decimal('0.00')
+        if snap and user_id in last_after and _money(last_after[user_id]) != snap_balance:
+            mismatches.append({'user_id': user_id, 'kind': 'balance_after', 'expected': snap_balance,
+                               'actual': _money(last_after[user_id]), 'last_tx_id': snap.last_tx_id})
+        expected = snap_balance + _money(after.get(user_id))
+        if _money(wallet_balance) != expected:
+            mismatches.append({'user_id': user_id, 'kind': 'wallet_balance', 'expected': expected,
+                               'actual': _money(wallet_balance), 'last_tx_id': snap.last_tx_id if snap else 0})
+    return checked, mismatches
+
+
+def reconcile(full=False, chunk=RECONCILE_CHUNK, now=None, log=print):
+    """
+    增量对账 (需在 app context 中调用)
+    :param full: 是否核对全部用户 (否则只核对本次有新流水的用户)
+    :return: {'rows', 'chunks', 'checked', 'mismatches': [...]}
+    """
+    t0 = time.perf_counter()
+    now = now or datetime.now()
+    lo = _watermark()
+    hi = db.session.query(func.max(WalletTransaction.id)).filter(WalletTransaction.created_at <= now - RECONCILE_LAG).scalar() or 0
+    touched = set()
+    rows = chunks = 0
+    while lo < hi:
+        upper = min(lo + chunk, hi)
+        n, snapshots = _apply_chunk(lo, upper)
+        db.session.commit()
+        touched.update(snapshots)
+        rows += n
+        chunks += 1
+        lo = upper
+    db.session.commit()
+
+    checked, mismatches = _check(None if full else touched, max(hi, _watermark()))
+    db.session.rollback()
+    for m in mismatches:
+        log(f"[对账不一致] 用户 {m['user_id']} {m['kind']}: 流水合计 {m['expected']}，实际 {m['actual']} (快照至流水 {m['last_tx_id']})")
+
+    elapsed = (time.perf_counter() - t0) * 1000
+    RECONCILE_METRICS['runs'] += 1
+    RECONCILE_METRICS.update(rows=rows, chunks=chunks, checked=checked, mismatches=len(mismatches),
+                             last_ms=elapsed, last_run=now)
+    return {'rows': rows, 'chunks': chunks, 'checked': checked, 'mismatches': mismatches}
+
+
+def main(argv):
+    from app import create_app
+    app = create_app()
+    full = '--full' in argv
+    with app.app_context():
+        report = reconcile(full=full)
+    print(f"新增流水 {report['rows']} 条 ({report['chunks']} 块)，核对 {report['checked']} 个用户，"
+          f"{len(report['mismatches'])} 处不一致，耗时 {RECONCILE_METRICS['last_ms']:.0f}ms")
+    return 1 if report['mismatches'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,86 @@
+"""
+读写分离
+
+配置了 DATABASE_REPLICA_URL 时 (见 app.py)，在 replica_reads() 范围内执行的只读查询路由到只读副本 (bind 'replica')：
+  @replica_reads()                 # 装饰只读的查询函数 / 报表视图
+  with replica_reads(): ...
+以下情况仍然走主库：
+- 写入 (flush / UPDATE / INSERT / DELETE / text())，以及 SELECT ... FOR UPDATE
+- 当前事务中已经写入过数据 (读己之写)
+- 不在 replica_reads() 范围内的一切查询 (出价、支付、结算等)
+未配置副本时 replica_reads() 不起作用，单库部署无需任何改动。
+"""
+import os
+import threading
+from contextlib import ContextDecorator
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND = 'replica'
+
+_state = threading.local()
+
+
+class replica_reads(ContextDecorator):
+    """标记当前线程 (协程) 中的只读查询可以走副本，可嵌套"""
+
+    def __enter__(self):
+        _state.depth = getattr(_state, 'depth', 0) + 1
+        return self
+
+    def __exit__(self, *exc):
+        _state.depth -= 1
+        return False
+
+
+def reading_from_replica():
+    return getattr(_state, 'depth', 0) > 0
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and reading_from_replica() and not self._flushing
+                and not self.info.get('wrote')
+                and isinstance(clause, Select) and clause._for_update_arg is None):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_wrote(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_orm_write(orm_execute_state):
+    # session.execute(update(...)) 等不经过 flush 的写入
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+@event.listens_for(RoutingSession, 'after_rollback')
+def _clear_wrote(session):
+    session.info.pop('wrote', None)
+
+
+def engine_options(uri):
+    """
+    连接池配置 (可通过环境变量调整)：
+    DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT / DB_POOL_RECYCLE，并启用 pre-ping 检测断开的连接
+    """
+    options = {
+        'pool_pre_ping': True,
+        # MySQL 默认 8 小时断开空闲连接，提前回收
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', '1800')),
+    }
+    if not uri.startswith('sqlite'):
+        options.update(
+            pool_size=int(os.environ.get('DB_POOL_SIZE', '10')),
+            max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', '20')),
+            pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', '30')),
+        )
+    return options
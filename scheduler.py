@@ -0,0 +1,185 @@
+"""
+拍卖定时调度器
+
+基于最小堆，按每个拍品的 start_time / end_time 精确唤醒：
+- 启动时从数据库加载所有 approved / active 拍品
+- 防狙击延时、审核通过、恢复上架等改变时间点的操作调用 schedule() 重新登记
+- 提前量任务 (register 的 before 参数) 随基准任务一起登记 / 重新登记 / 取消，例如结束前的提醒
+- 没有到期任务时线程一直阻塞等待，不做任何数据库查询
+- 每类任务处理函数的耗时、执行次数 (成功 / 失败) 与重试的拍品数按 kind 记入 metrics.registry，由 /admin/metrics 输出
+"""
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+from extensions import db, socketio
+from models import Item
+from metrics import registry
+
+# 处理失败时的重试间隔
+RETRY_DELAY = timedelta(seconds=5)
+
+
+class AuctionScheduler:
+    def __init__(self):
+        self._heap = []              # (when, seq, kind, item_id)
+        self._keys = {}              # (kind, item_id) -> 当前有效的触发时间
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._handlers = {}
+        self._leads = {}             # 基准任务类型 -> [(提前量任务类型, 提前量, 对齐粒度)]
+        self._started = False
+        # 多进程部署时只有 leader 执行到期任务，gate() 返回 False 时推迟执行
+        self._gate = None
+
+    def register(self, kind, handler, before=None, align=None):
+        """
+        登记某类任务的处理函数 handler(app, item_ids, now)
+        :param before: (基准任务类型, timedelta)：基准任务登记时，本类任务登记在其触发时间之前 timedelta
+                       (已过去的时间点不登记)，基准任务取消时一并取消
+        :param align: 提前量任务的触发时间向前取整到该粒度 (timedelta)，相近时间点的任务合并为同一批处理
+        """
+        self._handlers[kind] = handler
+        if before is not None:
+            base, lead = before
+            self._leads.setdefault(base, []).append((kind, lead, align))
+
+    def schedule(self, kind, item_id, when):
+        """登记或重新登记 (re-key) 一个拍品的触发时间"""
+        if not self._started:
+            # 未启动 (非 leader 进程) 时不登记，启动时会从数据库完整加载
+            return
+        with self._cond:
+            if self._keys.get((kind, item_id)) == when:
+                return
+            self._push(kind, item_id, when)
+            earliest = when
+            now = datetime.now()
+            for lead_kind, lead, align in self._leads.get(kind, ()):
+                due = when - lead
+                if align:
+                    due -= timedelta(seconds=due.timestamp() % align.total_seconds())
+                if due > now:
+                    self._push(lead_kind, item_id, due)
+                    earliest = min(earliest, due)
+                else:
+                    self._keys.pop((lead_kind, item_id), None)
+            # 只有新任务成为最早的任务时才需要唤醒调度线程
+            if self._heap[0][0] == earliest:
+                self._cond.notify()
+
+    def _push(self, kind, item_id, when):
+        if self._keys.get((kind, item_id)) != when:
+            self._keys[(kind, item_id)] = when
+            heapq.heappush(self._heap, (when, next(self._seq), kind, item_id))
+
+    def cancel(self, kind, item_id):
+        # 惰性删除：堆中的旧条目在弹出时因与 _keys 不一致而被丢弃
+        with self._cond:
+            self._keys.pop((kind, item_id), None)
+            for lead_kind, _, _ in self._leads.get(kind, ()):
+                self._keys.pop((lead_kind, item_id), None)
+
+    def next_due(self):
+        with self._cond:
+            self._discard_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _discard_stale(self):
+        heap = self._heap
+        while heap and self._keys.get((heap[0][2], heap[0][3])) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def _pop_due(self, now):
+        """弹出所有已到期的任务，按类型分组"""
+        due = {}
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            when, _, kind, item_id = heapq.heappop(heap)
+            if self._keys.get((kind, item_id)) != when:
+                continue
+            del self._keys[(kind, item_id)]
+            due.setdefault(kind, []).append(item_id)
+        return due
+
+    def load(self):
+        """从数据库加载待开拍 / 进行中的拍品 (需在 app context 中调用)"""
+        rows = db.session.query(Item.id, Item.status, Item.start_time, Item.end_time).filter(
+            Item.status.in_(['approved', 'active'])
+        ).all()
+        for item_id, status, start_time, end_time in rows:
+            if status == 'approved':
+                self.schedule('start', item_id, start_time)
+            else:
+                self.schedule('end', item_id, end_time)
+        return len(rows)
+
+    def start(self, app, gate=None):
+        if self._started:
+            return
+        self._started = True
+        self._gate = gate
+        with app.app_context():
+            count = self.load()
+            db.session.remove()
+        app.logger.info(f"拍卖调度器已加载 {count} 个拍品")
+        socketio.start_background_task(self._run, app)
+
+    def _run(self, app):
+        while True:
+            with self._cond:
+                while True:
+                    self._discard_stale()
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    now = datetime.now()
+                    delay = (self._heap[0][0] - now).total_seconds()
+                    if delay > 0:
+                        self._cond.wait(delay)
+                        continue
+                    due = self._pop_due(now)
+                    break
+
+            if self._gate is not None and not self._gate():
+                # 已失去 leader 租约：推迟到重试时间，重新当选后继续执行
+                for kind, item_ids in due.items():
+                    _record_retries(kind, 'gate', len(item_ids))
+                    for item_id in item_ids:
+                        self.schedule(kind, item_id, now + RETRY_DELAY)
+                continue
+
+            # 先开拍再结束，保证同一时刻到期的 start/end 顺序正确
+            for kind in sorted(due, key=lambda k: k != 'start'):
+                handler = self._handlers.get(kind)
+                if handler is None:
+                    continue
+                labels = (('kind', kind),)
+                started = time.perf_counter()
+                try:
+                    with app.app_context():
+                        handler(app, due[kind], now)
+                        db.session.remove()
+                    result = 'ok'
+                except Exception as e:
+                    result = 'error'
+                    print(f"Scheduler {kind} error: {e}")
+                    # 处理函数按状态过滤，重试是幂等的
+                    _record_retries(kind, 'error', len(due[kind]))
+                    for item_id in due[kind]:
+                        self.schedule(kind, item_id, now + RETRY_DELAY)
+                registry.observe('auction_scheduler_handler_duration_seconds', labels, time.perf_counter() - started,
+                                 help='Scheduler handler duration by task kind')
+                registry.inc('auction_scheduler_runs_total', labels + (('result', result),),
+                             help='Scheduler handler runs by task kind and result')
+                registry.inc('auction_scheduler_items_total', labels, len(due[kind]),
+                             help='Items handled by scheduler handlers by task kind')
+
+
+def _record_retries(kind, reason, count):
+    registry.inc('auction_scheduler_retries_total', (('kind', kind), ('reason', reason)), count,
+                 help='Scheduler items rescheduled after RETRY_DELAY (handler error / lost leader lease)')
+
+
+auction_scheduler = AuctionScheduler()
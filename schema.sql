@@ -8,6 +8,7 @@ CREATE TABLE users (
     role VARCHAR(20) NOT NULL, -- 'buyer', 'seller', 'admin'
     email VARCHAR(120),
     avatar VARCHAR(200),
+    avatar_variants VARCHAR(64),
     banned_until DATETIME,
     real_name VARCHAR(80),
     id_card VARCHAR(20),
@@ -42,6 +43,9 @@ CREATE TABLE items (
     shipping_status VARCHAR(20) DEFAULT 'unshipped', -- 'unshipped', 'shipped', 'received'
     shipped_at DATETIME,
     shipping_extended_count INT DEFAULT 0,
+    pay_deadline DATETIME,
+    ship_deadline DATETIME,
+    auto_confirm_deadline DATETIME,
     shipping_name VARCHAR(80),
     shipping_phone VARCHAR(20),
     shipping_address VARCHAR(255),
@@ -50,7 +54,16 @@ CREATE TABLE items (
     FOREIGN KEY (seller_id) REFERENCES users(id),
     FOREIGN KEY (highest_bidder_id) REFERENCES users(id),
     INDEX idx_status (status),
-    INDEX idx_end_time (end_time)
+    INDEX idx_end_time (end_time),
+    INDEX idx_pay_deadline (payment_status, pay_deadline),
+    INDEX idx_ship_deadline (shipping_status, ship_deadline),
+    INDEX idx_auto_confirm_deadline (shipping_status, auto_confirm_deadline),
+    INDEX idx_status_start_time (status, start_time),
+    INDEX idx_status_end_time (status, end_time),
+    INDEX idx_seller_created (seller_id, created_at),
+    INDEX idx_bidder_status (highest_bidder_id, status),
+    INDEX idx_seller_status_created (seller_id, status, created_at),
+    INDEX idx_bidder_status_end (highest_bidder_id, status, end_time)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Bids Table
@@ -63,7 +76,8 @@ CREATE TABLE bids (
     
     FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE,
     FOREIGN KEY (user_id) REFERENCES users(id),
-    INDEX idx_item_id (item_id)
+    INDEX idx_item_id (item_id),
+    INDEX idx_item_time (item_id, timestamp)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Item Images Table
@@ -71,9 +85,11 @@ CREATE TABLE item_images (
     id INT AUTO_INCREMENT PRIMARY KEY,
     item_id INT NOT NULL,
     image_url VARCHAR(255) NOT NULL,
+    variants VARCHAR(64),
     is_primary BOOLEAN DEFAULT FALSE,
     
-    FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE
+    FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE,
+    INDEX idx_image_item (item_id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Posts Table (Forum)
@@ -82,7 +98,8 @@ CREATE TABLE posts (
     user_id INT NOT NULL,
     content TEXT NOT NULL,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    INDEX idx_post_user_created (user_id, created_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Chat Sessions Table
@@ -98,7 +115,10 @@ CREATE TABLE chat_sessions (
     
     FOREIGN KEY (item_id) REFERENCES items(id),
     FOREIGN KEY (buyer_id) REFERENCES users(id),
-    FOREIGN KEY (seller_id) REFERENCES users(id)
+    FOREIGN KEY (seller_id) REFERENCES users(id),
+    UNIQUE KEY unique_item_buyer_seller (item_id, buyer_id, seller_id),
+    INDEX idx_buyer_unread (buyer_id, buyer_unread),
+    INDEX idx_seller_unread (seller_id, seller_unread)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Messages Table
@@ -110,7 +130,8 @@ CREATE TABLE messages (
     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
     
     FOREIGN KEY (chat_session_id) REFERENCES chat_sessions(id) ON DELETE CASCADE,
-    FOREIGN KEY (sender_id) REFERENCES users(id)
+    FOREIGN KEY (sender_id) REFERENCES users(id),
+    INDEX idx_session_time (chat_session_id, timestamp)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Appeals Table
@@ -126,7 +147,9 @@ CREATE TABLE appeals (
     handled_at DATETIME,
 
     FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE,
-    FOREIGN KEY (user_id) REFERENCES users(id)
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    INDEX idx_status_created (status, created_at),
+    INDEX idx_appeal_created (created_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Deposits Table
@@ -141,7 +164,8 @@ CREATE TABLE deposits (
 
     FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-    INDEX idx_item_user (item_id, user_id)
+    INDEX idx_item_user (item_id, user_id),
+    INDEX idx_item_status (item_id, status)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Wallet Transactions Table
@@ -159,7 +183,8 @@ CREATE TABLE wallet_transactions (
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE SET NULL,
     INDEX idx_user_created (user_id, created_at),
-    INDEX idx_type_created (type, created_at)
+    INDEX idx_type_created (type, created_at),
+    INDEX idx_tx_created (created_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
 -- Favorites Table
@@ -170,5 +195,49 @@ CREATE TABLE favorites (
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE,
-    UNIQUE KEY unique_user_item (user_id, item_id)
+    UNIQUE KEY unique_user_item (user_id, item_id),
+    INDEX idx_favorite_user_created (user_id, created_at),
+    INDEX idx_favorite_item (item_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+-- Notification Outbox Table (系统消息发件箱，投递后删除)
+CREATE TABLE notification_outbox (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    item_id INT NOT NULL,
+    receiver_id INT NOT NULL,
+    content TEXT NOT NULL,
+    skip_notification BOOLEAN DEFAULT FALSE,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE,
+    FOREIGN KEY (receiver_id) REFERENCES users(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+-- Worker Leases Table (多进程部署的 leader 选举租约)
+CREATE TABLE worker_leases (
+    name VARCHAR(50) PRIMARY KEY,
+    owner VARCHAR(100) NOT NULL,
+    expires_at DATETIME NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+-- Bid Summaries Table (每个拍品的出价汇总检查点，避免扫描 bids 表)
+CREATE TABLE bid_summaries (
+    item_id INT PRIMARY KEY,
+    total_bids INT NOT NULL DEFAULT 0,
+    unique_bidders INT NOT NULL DEFAULT 0,
+    bidder_ids TEXT NOT NULL,
+    recent_bids TEXT NOT NULL,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+-- Balance Snapshots Table (每个用户截至某条流水的余额快照，增量对账用，见 reconcile.py)
+CREATE TABLE balance_snapshots (
+    user_id INT PRIMARY KEY,
+    balance DECIMAL(12, 2) NOT NULL DEFAULT 0.00,
+    last_tx_id INT NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    INDEX idx_last_tx (last_tx_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+-- Schema Migrations Table (已执行的迁移版本，见 migrations.py)
+CREATE TABLE schema_migrations (
+    version INT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
\ No newline at end of file
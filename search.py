@@ -0,0 +1,306 @@
+"""
+进程内全文检索
+
+对拍品的 名称 / 描述 / 分类 / 订单号 / 卖家用户名 / 买家用户名 以及用户名建立倒排索引：
+- 中文按单字 + 双字 (bigram) 切分，英文数字按单词切分并支持前缀匹配
+- 倒排表 token -> {item_id: 字段位掩码}，查询时按字段权重打分排序
+- 首次查询时从数据库加载，之后由拍品生命周期事件 (发布/审核/开拍/结束/下架/恢复) 增量维护，
+  并定期按自增 id 拉取其他进程新发布的拍品、重新索引最近结束 (截止时间在 RESYNC_WINDOW 内) 且状态或买家
+  与索引不一致的拍品，使其他进程 (leader) 结束的拍品的订单号与买家用户名可被检索
+- 状态与成交买家会在其他进程中变化 (审核、开拍、结束)，索引不按二者过滤，由调用方的 SQL 条件过滤；
+  只按不会变化的分类 / 卖家过滤，或由调用方用 ids 限定候选范围 (如买家自己的订单)
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from extensions import db
+from models import Item, User
+
+# 字段位掩码
+F_NAME = 1
+F_DESC = 2
+F_CATEGORY = 4
+F_SELLER = 8
+F_BUYER = 16
+F_ORDER = 32
+F_ALL = F_NAME | F_DESC | F_CATEGORY | F_SELLER | F_BUYER | F_ORDER
+
+FIELD_WEIGHTS = ((F_NAME, 5.0), (F_ORDER, 5.0), (F_SELLER, 3.0), (F_BUYER, 3.0), (F_CATEGORY, 2.0), (F_DESC, 1.0))
+# 前缀匹配 (非完整单词) 的得分折扣
+PREFIX_FACTOR = 0.5
+# 单个前缀最多展开的词条数
+MAX_PREFIX_EXPANSION = 200
+# 描述只索引前若干字符，控制内存占用
+DESC_INDEX_CHARS = 500
+# 增量拉取新拍品的最小间隔 (秒)
+REFRESH_INTERVAL = 5
+# 每次增量拉取时重新核对截止时间在该时间窗口内的拍品 (覆盖结束任务的延迟与重试)
+RESYNC_WINDOW = timedelta(minutes=10)
+
+_CJK = re.compile(r'[㐀-鿿豈-﫿]+')
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """切分为 (中文单字/双字, 英文数字单词) 词条集合"""
+    if not text:
+        return set()
+    text = text.lower()
+    tokens = set(_WORD.findall(text))
+    for run in _CJK.findall(text):
+        tokens.update(run)
+        tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def query_terms(text):
+    """
+    查询词切分：中文连续片段用双字 (单字片段用单字)，英文数字单词作前缀匹配
+    :return: [(词条, 是否前缀匹配), ...]
+    """
+    text = (text or '').lower()
+    terms = [(w, True) for w in _WORD.findall(text)]
+    for run in _CJK.findall(text):
+        if len(run) == 1:
+            terms.append((run, False))
+        else:
+            terms.extend((run[i:i + 2], False) for i in range(len(run) - 1))
+    return terms
+
+
+# 字段掩码 -> 得分，预先计算避免查询时逐位累加
+_SCORES = [sum(w for bit, w in FIELD_WEIGHTS if mask & bit) for mask in range(F_ALL + 1)]
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}     # token -> {item_id: 字段掩码}
+        self._doc_tokens = {}   # item_id -> {token: 字段掩码}，用于更新时撤销旧倒排
+        self._docs = {}         # item_id -> [status, category, seller_id, buyer_id]
+        self._user_postings = {}  # 用户名 token -> {user_id}
+        self._vocab = []        # 排好序的英文数字词条 (拍品与用户名共用)，用于前缀匹配
+        self._vocab_dirty = False
+        self._max_item_id = 0
+        self._max_user_id = 0
+        self._loaded = False
+        self._last_refresh = 0.0
+        self._synced_at = None  # 上次增量拉取的数据库时间
+
+    # --- 加载与增量维护 ---
+    def ensure_loaded(self):
+        if self._loaded:
+            if time.monotonic() - self._last_refresh > REFRESH_INTERVAL:
+                self.refresh()
+            return
+        with self._lock:
+            if not self._loaded:
+                self.refresh()
+                self._loaded = True
+
+    def refresh(self):
+        """拉取 id 大于已索引最大 id 的用户与拍品，并重新索引最近结束后发生变化的拍品"""
+        with self._lock:
+            self._last_refresh = time.monotonic()
+            now = datetime.now()
+            for user_id, username in db.session.query(User.id, User.username).filter(
+                User.id > self._max_user_id
+            ).order_by(User.id).yield_per(5000):
+                self._add_user(user_id, username)
+            if self._synced_at is not None:
+                self._resync(self._synced_at - RESYNC_WINDOW, now)
+            for row in self._item_rows(Item.id > self._max_item_id):
+                self._index(*row)
+            self._synced_at = now
+
+    def _item_rows(self, condition):
+        seller = db.aliased(User)
+        buyer = db.aliased(User)
+        return db.session.query(
+            Item.id, Item.name, Item.description, Item.category, Item.order_hash,
+            Item.status, Item.seller_id, Item.highest_bidder_id, seller.username, buyer.username
+        ).join(seller, Item.seller_id == seller.id).outerjoin(
+            buyer, Item.highest_bidder_id == buyer.id
+        ).filter(condition).order_by(Item.id).yield_per(5000)
+
+    def _resync(self, since, until):
+        """截止时间在 (since, until] 内、状态或买家与索引不一致的拍品重新索引 (按 end_time 索引只查少量行)"""
+        changed = []
+        for item_id, status, buyer_id in db.session.query(Item.id, Item.status, Item.highest_bidder_id).filter(
+            Item.end_time > since, Item.end_time <= until, Item.id <= self._max_item_id
+        ):
+            doc = self._docs.get(item_id)
+            if doc is None or doc[0] != status or doc[3] != buyer_id:
+                changed.append(item_id)
+        if changed:
+            for row in self._item_rows(Item.id.in_(changed)):
+                self._index(*row)
+
+    def _add_user(self, user_id, username):
+        for token in tokenize(username):
+            self._user_postings.setdefault(token, set()).add(user_id)
+            if token.isascii():
+                self._vocab_dirty = True
+        self._max_user_id = max(self._max_user_id, user_id)
+
+    def _index(self, item_id, name, description, category, order_hash, status,
+               seller_id, buyer_id, seller_name, buyer_name):
+        self._remove(item_id)
+        fields = {}
+        for bit, text in ((F_NAME, name), (F_DESC, (description or '')[:DESC_INDEX_CHARS]),
+                          (F_CATEGORY, category), (F_ORDER, order_hash),
+                          (F_SELLER, seller_name), (F_BUYER, buyer_name if status == 'ended' else None)):
+            for token in tokenize(text):
+                fields[token] = fields.get(token, 0) | bit
+        for token, mask in fields.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = {}
+                if token.isascii():
+                    self._vocab_dirty = True
+            posting[item_id] = mask
+        self._doc_tokens[item_id] = fields
+        self._docs[item_id] = [status, category, seller_id, buyer_id]
+        self._max_item_id = max(self._max_item_id, item_id)
+
+    def _remove(self, item_id):
+        for token in self._doc_tokens.pop(item_id, ()):
+            posting = self._postings.get(token)
+            if posting is not None:
+                posting.pop(item_id, None)
+                if not posting:
+                    del self._postings[token]
+        self._docs.pop(item_id, None)
+
+    def index_item(self, item):
+        """拍品新增或名称/订单号/成交买家变化时重建该拍品的索引"""
+        if not self._loaded:
+            return
+        with self._lock:
+            seller = item.seller.username if item.seller else None
+            buyer = item.highest_bidder.username if item.highest_bidder else None
+            self._index(item.id, item.name, item.description, item.category, item.order_hash,
+                        item.status, item.seller_id, item.highest_bidder_id, seller, buyer)
+
+    def set_status(self, item_id, status):
+        """只有状态变化时 (审核/开拍/下架/恢复) 无需重新切词"""
+        with self._lock:
+            doc = self._docs.get(item_id)
+            if doc is not None:
+                doc[0] = status
+
+    def index_user(self, user_id, username):
+        if not self._loaded:
+            return
+        with self._lock:
+            self._add_user(user_id, username)
+
+    # --- 查询 ---
+    def _ensure_vocab(self):
+        if self._vocab_dirty:
+            vocab = {t for t in self._postings if t.isascii()}
+            vocab.update(t for t in self._user_postings if t.isascii())
+            self._vocab = sorted(vocab)
+            self._vocab_dirty = False
+
+    def _expand(self, term, prefix):
+        """返回 [(倒排表, 得分系数)]"""
+        if not prefix:
+            posting = self._postings.get(term)
+            return [(posting, 1.0)] if posting else []
+        self._ensure_vocab()
+        out = []
+        posting = self._postings.get(term)
+        if posting:
+            out.append((posting, 1.0))
+        i = bisect.bisect_right(self._vocab, term)
+        while i < len(self._vocab) and self._vocab[i].startswith(term) and len(out) < MAX_PREFIX_EXPANSION:
+            posting = self._postings.get(self._vocab[i])
+            if posting:
+                out.append((posting, PREFIX_FACTOR))
+            i += 1
+        return out
+
+    def search(self, text, fields=F_ALL, category=None, seller_id=None, ids=None, limit=None):
+        """
+        查询拍品，所有查询词都必须命中 (AND)，按字段权重打分
+        :param ids: 只在这些拍品中查询 (如买家自己的订单)
+        :return: 按得分降序的 item_id 列表
+        """
+        terms = query_terms(text)
+        if not terms:
+            return []
+        self.ensure_loaded()
+        with self._lock:
+            groups = []
+            for term, prefix in terms:
+                expanded = self._expand(term, prefix)
+                if not expanded:
+                    return []
+                groups.append(expanded)
+            # 从候选最少的查询词开始求交集，文档过滤条件在第一轮就应用，缩小后续候选
+            groups.sort(key=lambda g: sum(len(p) for p, _ in g))
+            docs = self._docs
+
+            allowed = set(ids) if ids is not None else None
+
+            def accept(item_id):
+                _, cat, sid, _ = docs[item_id]
+                return (not category or cat == category) and (seller_id is None or sid == seller_id)
+
+            filtered = category or seller_id is not None
+            scores = None
+            for group in groups:
+                current = {}
+                for posting, factor in group:
+                    if scores is None:
+                        candidates = posting.keys() & allowed if allowed is not None else posting
+                        if filtered:
+                            candidates = [i for i in candidates if accept(i)]
+                    else:
+                        candidates = (i for i in posting if i in scores)
+                    for item_id in candidates:
+                        mask = posting[item_id] & fields
+                        if mask:
+                            s = _SCORES[mask] * factor
+                            if s > current.get(item_id, 0.0):
+                                current[item_id] = s
+                if scores is None:
+                    scores = current
+                else:
+                    scores = {i: scores[i] + s for i, s in current.items()}
+                if not scores:
+                    return []
+            if limit:
+                ranked = heapq.nlargest(limit, scores.items(), key=lambda kv: (kv[1], kv[0]))
+            else:
+                ranked = sorted(scores.items(), key=lambda kv: (kv[1], kv[0]), reverse=True)
+        return [item_id for item_id, _ in ranked]
+
+    def search_users(self, text, limit=None):
+        """按用户名查询用户 (所有查询词都必须命中，英文数字支持前缀)"""
+        terms = query_terms(text)
+        if not terms:
+            return []
+        self.ensure_loaded()
+        with self._lock:
+            self._ensure_vocab()
+            matched = None
+            for term, prefix in terms:
+                ids = set(self._user_postings.get(term, ()))
+                if prefix:
+                    i = bisect.bisect_right(self._vocab, term)
+                    while i < len(self._vocab) and self._vocab[i].startswith(term):
+                        ids.update(self._user_postings.get(self._vocab[i], ()))
+                        i += 1
+                matched = ids if matched is None else matched & ids
+                if not matched:
+                    return []
+        ids = sorted(matched)
+        return ids[:limit] if limit else ids
+
+
+search_index = SearchIndex()
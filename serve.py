@@ -0,0 +1,81 @@
+"""
+生产环境入口：在 eventlet / gevent 协程服务器上运行 (开发调试仍可使用 python app.py)
+
+用法:
+  python serve.py                                  默认 eventlet
+  AUCTION_ASYNC_MODE=gevent python serve.py        需先 pip install gevent gevent-websocket
+  AUCTION_WORKERS=4 SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0 python serve.py
+
+- monkey patch 必须在导入 socket / threading / pymysql / sqlalchemy 等模块之前完成，
+  因此本文件先打补丁，再导入 app
+- pymysql 是纯 Python 驱动，打补丁后查询等待网络时会让出事件循环，慢查询不会阻塞其他连接；
+  C 扩展驱动 (mysqlclient) 在协程中会阻塞整个进程，app.py 已用 pymysql.install_as_MySQLdb() 代替
+- 后台任务 (竞价落库、发件箱、调度器、订单检查、leader 租约) 均通过 socketio.start_background_task 以协程运行，
+  图片缩放交给原生线程执行 (见 images.py)
+- 每个 websocket 连接只占用一个协程，单进程的并发连接上限为 WSGI_MAX_CONNECTIONS
+"""
+import os
+
+ASYNC_MODE = os.environ.setdefault('AUCTION_ASYNC_MODE', 'eventlet')
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+# 每个连接都打印 Socket.IO 日志的开销在大量连接时不可忽略，生产环境默认关闭
+os.environ.setdefault('SOCKETIO_LOG', '0')
+
+import sys
+from app import create_app, prepare_database, start_background_services, spawn_workers
+from extensions import socketio
+
+# 单进程最多同时服务的连接数 (eventlet 的协程池大小)
+MAX_CONNECTIONS = int(os.environ.get('WSGI_MAX_CONNECTIONS', '10000'))
+
+
+def raise_fd_limit():
+    """每个连接占用一个文件描述符，把软限制提高到硬限制"""
+    try:
+        import resource
+    except ImportError:
+        # Windows 没有 resource 模块
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+    if soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+def main():
+    workers = int(os.environ.get('AUCTION_WORKERS', '1'))
+    port = int(os.environ.get('PORT', '5000'))
+    if workers > 1:
+        spawn_workers(workers, port, script=os.path.abspath(__file__))
+        return 0
+
+    fd_limit = raise_fd_limit()
+    app = create_app()
+    prepare_database(app)
+    start_background_services(app)
+
+    options = {}
+    if ASYNC_MODE == 'eventlet':
+        options['max_size'] = MAX_CONNECTIONS
+    elif ASYNC_MODE == 'threading':
+        # 仅用于对比测试：Werkzeug 每个连接一个线程
+        options['allow_unsafe_werkzeug'] = True
+    app.logger.info(f"serve.py: async_mode={socketio.async_mode} port={port} "
+                    f"max_connections={MAX_CONNECTIONS} fd_limit={fd_limit}")
+    socketio.run(app, host=os.environ.get('HOST', '0.0.0.0'), port=port, log_output=False, **options)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""
+拍卖结算：批量退还保证金
+
+同一时刻结束的一批拍品作为一个批次处理，
+所有未中标者 (流拍时为全部缴纳者) 的退款用少量集合化语句完成：
+  1 条 SELECT 取出待退保证金，1 条 UPDATE 标记保证金状态，
+  再由 ledger.post() 整批记账 (executemany UPDATE 增加余额 + 1 次批量 INSERT 资金流水)。
+系统消息不在这里逐条发送，而是返回给调用方统一批量投递。
+"""
+from decimal import Decimal
+from extensions import db
+from models import Deposit
+import ledger
+from conn_state import conn_states
+
+
+def refund_deposits(items, now):
+    """
+    退还一批已结束拍品的保证金 (不提交事务，由调用方统一提交)
+    :param items: 已结束的 Item 列表，有 highest_bidder_id 的拍品保留中标者的保证金
+    :return: 待发送的系统消息 [(item_id, receiver_id, content, skip_notification), ...]
+    """
+    if not items:
+        return []
+    by_id = {item.id: item for item in items}
+    rows = db.session.query(Deposit.id, Deposit.item_id, Deposit.user_id, Deposit.amount).filter(
+        Deposit.item_id.in_(list(by_id)),
+        Deposit.status == 'frozen'
+    ).order_by(Deposit.id).all()
+    # 中标者的保证金在支付时抵扣，不退还
+    refunds = [r for r in rows if r.user_id != by_id[r.item_id].highest_bidder_id]
+    if not refunds:
+        return []
+
+    entries = []
+    notices = []
+    for dep_id, item_id, user_id, amount in refunds:
+        item = by_id[item_id]
+        amt = Decimal(amount)
+        if item.highest_bidder_id:
+            description = f'未中标退还保证金：{item.name}'
+            content = f'拍品 "{item.name}" 竞拍失败，保证金 ¥{amt} 已退回您的钱包余额。'
+        else:
+            description = f'流拍退还保证金：{item.name}'
+            content = f'拍品 "{item.name}" 流拍，保证金 ¥{amt} 已退回您的钱包余额。'
+        entries.append(ledger.credit(user_id, amt, 'refund', description, item_id))
+        notices.append((item_id, user_id, content, False))
+
+    Deposit.query.filter(Deposit.id.in_([r.id for r in refunds])).update(
+        {'status': 'refunded', 'updated_at': now}, synchronize_session=False
+    )
+    ledger.post(entries, now)
+    conn_states.mark_changed(*{r.user_id for r in refunds})
+    return notices
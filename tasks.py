@@ -2,288 +2,339 @@ from datetime import datetime, timedelta
 import threading
 import time
 import hashlib
+from sqlalchemy.orm import selectinload
 from extensions import db, socketio
-from models import Item, Bid, Deposit
-from services import send_system_message
+from models import Item, Bid, Deposit, PAY_TIMEOUT, SHIP_TIMEOUT, AUTO_CONFIRM_TIMEOUT, RECEIPT_EXTENSION
+from services import send_system_messages
+from settlement import refund_deposits
+import ledger
+from reconcile import reconcile, RECONCILE_INTERVAL
+from conn_state import conn_states
+from bid_engine import bid_engine
+from bid_summary import load_summaries
+from scheduler import auction_scheduler
+from listing_cache import listing_cache
+from search import search_index
+from watchlist import watchlist
 
-def check_unpaid_orders(app, now):
-    """策略1：买家24小时未付款 -> 封禁15天"""
-    timeout_threshold = now - timedelta(hours=24)
-    expired_unpaid = Item.query.filter(
-        Item.status == 'ended',
-        Item.payment_status == 'unpaid',
-        Item.highest_bidder_id.isnot(None),
-        Item.end_time <= timeout_threshold
+# 订单超时检查的轮询间隔 (秒)，订单期限以小时计，无需频繁扫描
+ORDER_SWEEP_INTERVAL = 60
+
+# 每批处理的订单数，每批单独提交
+SWEEP_BATCH_SIZE = 200
+# 订单违约的封禁时长
+ORDER_BAN_PERIOD = timedelta(days=15)
+
+# 各超时检查的运行统计：name -> {runs, rows, batches, last_rows, last_ms, total_ms}
+SWEEP_METRICS = {}
+
+def _sweep(name, batch_query, process, now):
+    """
+    分批处理已越过期限的订单：按 (状态, 期限) 组合索引取出一批 (行锁)，处理后状态改变、离开该索引区间，
+    每批提交一次；不足一批说明已处理完。处理失败时回滚本批，下一轮重试
+    """
+    started = time.perf_counter()
+    rows = batches = 0
+    try:
+        while True:
+            items = batch_query(now).limit(SWEEP_BATCH_SIZE).with_for_update().all()
+            if not items:
+                break
+            process(items, now)
+            db.session.commit()
+            rows += len(items)
+            batches += 1
+            if len(items) < SWEEP_BATCH_SIZE:
+                break
+    except Exception as e:
+        db.session.rollback()
+        print(f"Order sweep {name} error: {e}")
+    _record_sweep(name, rows, batches, (time.perf_counter() - started) * 1000)
+    return rows
+
+def _record_sweep(name, rows, batches, elapsed_ms):
+    metrics = SWEEP_METRICS.setdefault(name, {'runs': 0, 'rows': 0, 'batches': 0, 'last_rows': 0, 'last_ms': 0.0, 'total_ms': 0.0})
+    metrics['runs'] += 1
+    metrics['rows'] += rows
+    metrics['batches'] += batches
+    metrics['last_rows'] = rows
+    metrics['last_ms'] = elapsed_ms
+    metrics['total_ms'] += elapsed_ms
+
+def _ban(user, until):
+    """封禁到 until (已有更长的封禁则不缩短)，返回是否更新"""
+    if user and (not user.banned_until or user.banned_until < until):
+        user.banned_until = until
+        return True
+    return False
+
+def _cancel_unpaid(items, now):
+    ban_until = now + ORDER_BAN_PERIOD
+    # 违约：没收中标者保证金 (整批一次查询)
+    deposits = Deposit.query.filter(
+        Deposit.item_id.in_([item.id for item in items]),
+        Deposit.status.in_(['frozen', 'applied'])
     ).all()
-    
-    for item in expired_unpaid:
-        # 避免重复处理：虽然状态还是unpaid，但我们可以检查payment_status是否变为timeout_cancelled
-        # 或者增加一个标志。这里我们将payment_status改为timeout_cancelled
+    winners = {item.id: item.highest_bidder_id for item in items}
+    for dep in deposits:
+        if winners.get(dep.item_id) == dep.user_id:
+            dep.status = 'forfeited'
+    # 保证金与封禁状态变化，提交后刷新其 Socket.IO 连接状态
+    conn_states.mark_changed(*winners.values())
+
+    notices = []
+    for item in items:
         item.payment_status = 'timeout_cancelled'
-        buyer = item.highest_bidder
-        if buyer:
-            new_ban_time = now + timedelta(days=15)
-            # 如果已经被封禁且时间更长，则不缩短；否则更新
-            if not buyer.banned_until or buyer.banned_until < new_ban_time:
-                buyer.banned_until = new_ban_time
-                send_system_message(item.id, buyer.id, f'因未在24小时内支付订单 {item.order_hash}，您已被封禁15天。')
-        db.session.commit()
+        if _ban(item.highest_bidder, ban_until):
+            notices.append((item.id, item.highest_bidder_id, f'因未在24小时内支付订单 {item.order_hash}，您已被封禁15天。', False))
+        notices.append((item.id, item.seller_id, f'很抱歉，拍品 "{item.name}" 的买家未在24小时内付款，交易已自动取消。您可以重新发布该商品。', False))
+    send_system_messages(notices)
+
+def check_unpaid_orders(app, now):
+    """策略1：买家24小时未付款 -> 取消订单、没收保证金、封禁15天"""
+    return _sweep('unpaid', lambda now: Item.query.options(selectinload(Item.highest_bidder)).filter(
+        Item.payment_status == 'unpaid',
+        Item.pay_deadline <= now,
+        Item.status == 'ended',
+        Item.highest_bidder_id.isnot(None)
+    ).order_by(Item.pay_deadline), _cancel_unpaid, now)
+
+def _punish_unshipped(items, now):
+    ban_until = now + ORDER_BAN_PERIOD
+    notices = []
+    for item in items:
+        # 终结状态，避免重复处罚
+        item.shipping_status = 'unshipped_timeout'
+        if _ban(item.seller, ban_until):
+            conn_states.mark_changed(item.seller_id)
+            notices.append((item.id, item.seller_id, f'因买家付款后72小时内未发货 (订单 {item.order_hash})，您已被封禁15天。', False))
+    send_system_messages(notices)
 
 def check_unshipped_orders(app, now):
     """策略2：卖家72小时未发货 -> 封禁15天"""
-    timeout_threshold = now - timedelta(hours=72)
-    # 必须有支付时间才能判断
-    expired_unshipped = Item.query.filter(
-        Item.payment_status == 'paid',
+    return _sweep('unshipped', lambda now: Item.query.options(selectinload(Item.seller)).filter(
         Item.shipping_status == 'unshipped',
-        Item.paid_at <= timeout_threshold
-    ).all()
+        Item.ship_deadline <= now,
+        Item.payment_status == 'paid'
+    ).order_by(Item.ship_deadline), _punish_unshipped, now)
 
-    for item in expired_unshipped:
-        # 为了避免重复惩罚，我们需要知道是否已经惩罚过。
-        # 简单策略：如果卖家已经被封禁到足以覆盖这次的惩罚，可能就不操作了?
-        # 但我们每一轮都会查出来。
-        # 我们可以再改一个状态，比如 'shipping_status' -> 'timeout_unshipped' 或类似。
-        # 或者我们只处理那些卖家还没有被封禁15天的。
-        # 这里为了稳健，最好给 shipping_status 一个终结状态，或者增加一个 processed 标记。
-        # 让我们把 shipping_status 设为 'unshipped' 保持不变? 不行，会死循环。
-        # 暂时修改 shipping_status 为 'shipped' (系统强制接管?) 还是加个 status?
-        # 为了简单，我们只封禁卖家，但如果不标记 item，下次还会查到。
-        # 我们可以用 banned_until 来判断"是否刚刚处理过"，但这不可靠。
-        # 增加一个 Item 字段 'seller_punished' ? 
-        # 或者，直接将 Item.status 设为 'stopped' 或 'rejected' ? 
-        # 既然是违规，我们把 status 设为 'stopped' (强制下架状态，虽然已经卖了) 
-        # 或者 shipping_status = 'unshipped_timeout' (需要在 models 允许长度)
-        # shipping_status 是 String(20)。 'unshipped_timeout' 是 17 chars. OK.
-        
-        item.shipping_status = 'unshipped_timeout'
-        seller = item.seller
-        if seller:
-             new_ban_time = now + timedelta(days=15)
-             if not seller.banned_until or seller.banned_until < new_ban_time:
-                 seller.banned_until = new_ban_time
-                 send_system_message(item.id, seller.id, f'因买家付款后72小时内未发货 (订单 {item.order_hash})，您已被封禁15天。')
-        db.session.commit()
+def _auto_confirm(items, now):
+    notices = []
+    entries = []
+    for item in items:
+        item.shipping_status = 'received'
+        # 卖家入账 (整批一次记账，同一卖家的多个订单依次累加)
+        entries.append(ledger.credit(item.seller_id, item.current_price, 'payout',
+                                     f'订单自动确认收货入账：{item.name}', item.id))
+        notices.append((item.id, item.seller_id, f'订单 {item.order_hash} 已过自动确认收货期限，资金已入账。', False))
+        notices.append((item.id, item.highest_bidder_id, f'订单 {item.order_hash} 已自动确认收货。', False))
+    ledger.post(entries, now)
+    send_system_messages(notices)
 
 def check_auto_confirm(app, now):
     """策略3：发货240 (+N*72) 小时自动收货"""
-    from decimal import Decimal
-    from models import WalletTransaction
-    
-    # 查找所有已发货的订单
-    shipped_items = Item.query.filter(
+    return _sweep('auto_confirm', lambda now: Item.query.filter(
         Item.shipping_status == 'shipped',
-        Item.shipped_at.isnot(None)
-    ).all()
-    
-    for item in shipped_items:
-        base_hours = 240
-        extra_hours = item.shipping_extended_count * 72
-        threshold_hours = base_hours + extra_hours
+        Item.auto_confirm_deadline <= now
+    ).order_by(Item.auto_confirm_deadline), _auto_confirm, now)
+
+def backfill_order_deadlines():
+    """为期限列上线前已存在的进行中订单补写期限 (只处理期限为空的行，可重复执行)"""
+    filled = 0
+    for column, criteria, deadline in (
+        (Item.pay_deadline,
+         (Item.status == 'ended', Item.payment_status == 'unpaid', Item.highest_bidder_id.isnot(None)),
+         lambda item: item.end_time + PAY_TIMEOUT),
+        (Item.ship_deadline,
+         (Item.payment_status == 'paid', Item.shipping_status == 'unshipped', Item.paid_at.isnot(None)),
+         lambda item: item.paid_at + SHIP_TIMEOUT),
+        (Item.auto_confirm_deadline,
+         (Item.shipping_status == 'shipped', Item.shipped_at.isnot(None)),
+         lambda item: item.shipped_at + AUTO_CONFIRM_TIMEOUT + (item.shipping_extended_count or 0) * RECEIPT_EXTENSION),
+    ):
+        while True:
+            items = Item.query.filter(column.is_(None), *criteria).limit(SWEEP_BATCH_SIZE).all()
+            if not items:
+                break
+            for item in items:
+                setattr(item, column.key, deadline(item))
+            db.session.commit()
+            filled += len(items)
+    return filled
+
+def end_auctions(app, item_ids, now):
+    """调度任务：到达 end_time 的 'active' 拍卖 -> 'ended'"""
+    # 先在竞价引擎中封盘并落库内存中的出价，确保读到最终价格与截止时间
+    # 封盘失败说明防狙击刚刚延长了截止时间，on_bid 已重新登记调度
+    sealed_ids = [i for i in item_ids if bid_engine.seal(i, now)]
+    if not sealed_ids:
+        return
+    bid_engine.flush()
+    # 行锁：多进程部署时其他进程直接写库的出价 (见 bid_engine 的 shared 模式) 等待本批次提交，
+    # 提交后这些出价因状态已不是 active 而失败
+    expired_items = Item.query.filter(Item.id.in_(sealed_ids), Item.status == 'active').with_for_update().all()
+    for item in expired_items:
+        if item.end_time > now:
+            # 数据库中的截止时间更晚 (例如审核时重置了时间，或其他进程中的出价触发了延时)，
+            # 丢弃已封盘的内存状态并按新时间重新登记
+            bid_engine.evict(item.id)
+            auction_scheduler.schedule('end', item.id, item.end_time)
+    expired_items = [item for item in expired_items if item.end_time <= now]
+    if not expired_items:
+        return
+
+    # 同一时刻结束的拍品作为一个批次：状态变更、保证金退款、系统消息在同一事务中完成
+    notices = []
+    for item in expired_items:
+        item.status = 'ended'
         
-        elapsed = (now - item.shipped_at).total_seconds() / 3600
-        if elapsed >= threshold_hours:
-            # 执行自动收货逻辑
-            item.shipping_status = 'received'
-            
-            # 卖家入账
-            seller = item.seller
-            sale_total = Decimal(item.current_price)
-            new_balance = (Decimal(seller.wallet_balance) + sale_total)
-            seller.wallet_balance = new_balance
+        # 如果有获胜者，生成订单哈希
+        if item.highest_bidder_id:
+            # 生成易读的订单编号：ORD + 年月日时分秒 + 4位商品ID (例: ORD202401011200000005)
+            # 这种格式方便后续检索和客服查询
+            timestamp_str = datetime.now().strftime('%Y%m%d%H%M%S')
+            item.order_hash = f"ORD{timestamp_str}{item.id:04d}"
+            item.pay_deadline = item.end_time + PAY_TIMEOUT
             
-            db.session.add(WalletTransaction(
-                user_id=seller.id,
-                item_id=item.id,
-                type='payout',
-                direction='credit',
-                amount=sale_total,
-                balance_after=new_balance,
-                description=f'订单自动确认收货入账：{item.name}'
-            ))
+            # 通知买家 (获胜)
+            notices.append((item.id, item.highest_bidder_id, f'恭喜！您赢得了拍品 "{item.name}"，成交价 ¥{item.current_price}。订单号: {item.order_hash}', False))
+            # 通知卖家 (出售结果)
+            winner_name = item.highest_bidder.username if item.highest_bidder else '无人出价'
+            notices.append((item.id, item.seller_id, f'您的拍品 "{item.name}" 已成功售出！成交价 ¥{item.current_price}，买家: {winner_name}。订单号: {item.order_hash}', False))
+        else:
+            notices.append((item.id, item.seller_id, f'您的拍品 "{item.name}" 拍卖结束，遗憾的是无人出价。', False))
+
+    # 保证金处理：未中标者 (流拍时为全部缴纳者) 自动退款
+    notices.extend(refund_deposits(expired_items, now))
+    # 系统消息追加到发件箱，随本批次一起提交
+    send_system_messages(notices)
+    db.session.commit()
+    listing_cache.invalidate()
+    # 订单号与成交买家已确定，重建这批拍品的索引
+    for item in expired_items:
+        search_index.index_item(item)
+
+    # 出过价但未获胜的用户：读出价汇总 (出价已在封盘后 flush 时写回检查点)，整批一次查询
+    summaries = load_summaries([item.id for item in expired_items if item.highest_bidder_id])
+
+    for item in expired_items:
+        bid_engine.evict(item.id)
+        winner_name = item.highest_bidder.username if item.highest_bidder else '无人出价'
+        socketio.emit('auction_ended', {
+            'item_id': item.id, 
+            'winner': winner_name,
+            'order_hash': item.order_hash if item.highest_bidder_id else None
+        }, room=f"item_{item.id}")
+        
+        if item.highest_bidder_id:
+            # Toast: Seller (Blue)
+            socketio.emit('auction_result_toast', {
+                'type': 'info',
+                'msg': f'拍卖结束: "{item.name}" 已被 {winner_name} 以 ¥{item.current_price} 中标。'
+            }, room=f"user_{item.seller_id}")
             
-            send_system_message(item.id, seller.id, f'订单 {item.order_hash} 已过自动确认收货期限，资金已入账。')
-            send_system_message(item.id, item.highest_bidder_id, f'订单 {item.order_hash} 已自动确认收货。')
-            db.session.commit()
+            # Toast: Winner (Green)
+            socketio.emit('auction_result_toast', {
+                'type': 'success',
+                'msg': f'【恭喜中标】您已成功拍下 "{item.name}"，成交价 ¥{item.current_price}！'
+            }, room=f"user_{item.highest_bidder_id}")
+
+            # Toast: Losers (Yellow)
+            for loser_id in summaries[item.id].bidders:
+                # 排除获胜者，以及如果是卖家自己出价（虽然逻辑禁止，但防万一）
+                if loser_id != item.highest_bidder_id and loser_id != item.seller_id:
+                    socketio.emit('auction_result_toast', {
+                        'type': 'warning',
+                        'msg': f'【遗憾离场】拍品 "{item.name}" 拍卖已结束，您未中标。成交价: ¥{item.current_price}。'
+                    }, room=f"user_{loser_id}")
+        else:
+            # Toast: Seller (Unsold - Blue/Info)
+            socketio.emit('auction_result_toast', {
+                'type': 'info',
+                'msg': f'拍卖结束: "{item.name}" 无人出价，已流拍。'
+            }, room=f"user_{item.seller_id}")
+
+        # 收藏者：已收到上面结果通知的卖家与出价人除外
+        notified = {item.seller_id}
+        if item.highest_bidder_id:
+            notified.add(item.highest_bidder_id)
+            notified.update(summaries[item.id].bidders)
+        watchlist.publish(item.id, 'ended', {
+            'price': float(item.current_price),
+            'winner': winner_name if item.highest_bidder_id else None,
+            'msg': f'您收藏的拍品 "{{name}}" 已结束，成交价 ¥{item.current_price}。' if item.highest_bidder_id
+                   else '您收藏的拍品 "{name}" 已结束，无人出价流拍。',
+        }, exclude=notified)
+
+
+def start_auctions(app, item_ids, now):
+    """调度任务：到达 start_time 的 'approved' 拍卖 -> 'active'"""
+    starting_items = Item.query.filter(Item.id.in_(item_ids), Item.status == 'approved').all()
+    for item in starting_items:
+        if item.start_time > now:
+            auction_scheduler.schedule('start', item.id, item.start_time)
+            continue
+        item.status = 'active'
+        db.session.commit()
+        listing_cache.invalidate()
+        search_index.set_status(item.id, item.status)
+        auction_scheduler.schedule('end', item.id, item.end_time)
+        # 可选择通知首页刷新，或在该 Item 的房间里广播
+        print(f"Auction {item.id} started automatically at {now}")
+
 
-def check_auctions(app):
-    """后台任务：检查拍卖状态"""
+auction_scheduler.register('end', end_auctions)
+auction_scheduler.register('start', start_auctions)
+
+
+def check_auctions(app, gate=None):
+    """
+    后台任务：订单超时检查 (拍卖的开始与结束由 auction_scheduler 按时间点触发，资金对账见 reconcile_wallets)
+    :param gate: 多进程部署时传入 leader 判断函数，非 leader 时跳过本轮
+    """
+    backfilled = False
     while True:
+        if gate is not None and not gate():
+            time.sleep(ORDER_SWEEP_INTERVAL)
+            continue
+        started = time.perf_counter()
         try:
             with app.app_context():
+                if not backfilled:
+                    filled = backfill_order_deadlines()
+                    if filled:
+                        print(f"Backfilled deadlines for {filled} orders")
+                    backfilled = True
                 now = datetime.now()
                 
-                # 执行新的检查策略
+                # 各期限列的超时检查 (按索引只取已越过期限的订单)
                 check_unpaid_orders(app, now)
                 check_unshipped_orders(app, now)
                 check_auto_confirm(app, now)
-                
-                # 1. 检查已到期的 'active' 拍卖 -> 'ended'
-                expired_items = Item.query.filter(Item.status == 'active', Item.end_time <= now).all()
-                for item in expired_items:
-                    item.status = 'ended'
-                    
-                    # 如果有获胜者，生成订单哈希
-                    if item.highest_bidder_id:
-                        # 生成易读的订单编号：ORD + 年月日时分秒 + 4位商品ID (例: ORD202401011200000005)
-                        # 这种格式方便后续检索和客服查询
-                        timestamp_str = datetime.now().strftime('%Y%m%d%H%M%S')
-                        item.order_hash = f"ORD{timestamp_str}{item.id:04d}"
-                        
-                        # 通知买家 (获胜)
-                        send_system_message(item.id, item.highest_bidder_id, f'恭喜！您赢得了拍品 "{item.name}"，成交价 ¥{item.current_price}。订单号: {item.order_hash}')
-
-                    db.session.commit()
-                    winner_name = item.highest_bidder.username if item.highest_bidder else '无人出价'
-                    socketio.emit('auction_ended', {
-                        'item_id': item.id, 
-                        'winner': winner_name,
-                        'order_hash': item.order_hash if item.highest_bidder_id else None
-                    }, room=f"item_{item.id}")
-                    
-                    # 通知卖家 (出售结果)
-                    if item.highest_bidder_id:
-                        send_system_message(item.id, item.seller_id, f'您的拍品 "{item.name}" 已成功售出！成交价 ¥{item.current_price}，买家: {winner_name}。订单号: {item.order_hash}')
-                        
-                        # Toast: Seller (Blue)
-                        socketio.emit('auction_result_toast', {
-                            'type': 'info',
-                            'msg': f'拍卖结束: "{item.name}" 已被 {winner_name} 以 ¥{item.current_price} 中标。'
-                        }, room=f"user_{item.seller_id}")
-                        
-                        # Toast: Winner (Green)
-                        socketio.emit('auction_result_toast', {
-                            'type': 'success',
-                            'msg': f'【恭喜中标】您已成功拍下 "{item.name}"，成交价 ¥{item.current_price}！'
-                        }, room=f"user_{item.highest_bidder_id}")
-                        
-                        # 保证金处理：未中标者自动退款
-                        loser_deposits = Deposit.query.filter(
-                            Deposit.item_id == item.id,
-                            Deposit.user_id != item.highest_bidder_id,
-                            Deposit.status == 'frozen'
-                        ).all()
-                        from models import WalletTransaction
-                        for ld in loser_deposits:
-                            ld.status = 'refunded'
-                            # 退款到余额
-                            user = ld.user
-                            try:
-                                from decimal import Decimal
-                                amt = Decimal(ld.amount)
-                                new_balance = (Decimal(user.wallet_balance) + amt)
-                                user.wallet_balance = new_balance
-                                db.session.add(WalletTransaction(
-                                    user_id=user.id,
-                                    item_id=item.id,
-                                    type='refund',
-                                    direction='credit',
-                                    amount=amt,
-                                    balance_after=new_balance,
-                                    description=f'未中标退还保证金：{item.name}'
-                                ))
-                                # 发送系统消息提醒退款
-                                send_system_message(item.id, user.id, f'拍品 "{item.name}" 竞拍失败，保证金 ¥{amt} 已退回您的钱包余额。')
-                            except Exception:
-                                pass
-                        db.session.commit()
-
-                        # Toast: Losers (Yellow)
-                        # 查找所有出过价但未获胜的用户
-                        loser_bids = Bid.query.filter(
-                            Bid.item_id == item.id, 
-                            Bid.user_id != item.highest_bidder_id
-                        ).with_entities(Bid.user_id).distinct().all()
-                        
-                        for lb in loser_bids:
-                            loser_id = lb.user_id
-                            # 排除如果是卖家自己出价（虽然逻辑禁止，但防万一）
-                            if loser_id != item.seller_id:
-                                socketio.emit('auction_result_toast', {
-                                    'type': 'warning',
-                                    'msg': f'【遗憾离场】拍品 "{item.name}" 拍卖已结束，您未中标。成交价: ¥{item.current_price}。'
-                                }, room=f"user_{loser_id}")
-
-                    else:
-                        send_system_message(item.id, item.seller_id, f'您的拍品 "{item.name}" 拍卖结束，遗憾的是无人出价。')
-                        # Toast: Seller (Unsold - Blue/Info)
-                        socketio.emit('auction_result_toast', {
-                            'type': 'info',
-                            'msg': f'拍卖结束: "{item.name}" 无人出价，已流拍。'
-                        }, room=f"user_{item.seller_id}")
-                        # 无人中标情况下，退还所有已缴保证金
-                        unsold_deps = Deposit.query.filter(
-                            Deposit.item_id == item.id,
-                            Deposit.status == 'frozen'
-                        ).all()
-                        from models import WalletTransaction
-                        for ld in unsold_deps:
-                            ld.status = 'refunded'
-                            user = ld.user
-                            try:
-                                from decimal import Decimal
-                                amt = Decimal(ld.amount)
-                                new_balance = (Decimal(user.wallet_balance) + amt)
-                                user.wallet_balance = new_balance
-                                db.session.add(WalletTransaction(
-                                    user_id=user.id,
-                                    item_id=item.id,
-                                    type='refund',
-                                    direction='credit',
-                                    amount=amt,
-                                    balance_after=new_balance,
-                                    description=f'流拍退还保证金：{item.name}'
-                                ))
-                                send_system_message(item.id, user.id, f'拍品 "{item.name}" 流拍，保证金 ¥{amt} 已退回您的钱包余额。')
-                            except Exception:
-                                pass
-                        db.session.commit()
-                    
-                # 2. 检查已到期的 'approved' 拍卖 (定时上架) -> 'active'
-
-                # 2. 检查已到开拍时间的 'approved' 拍卖 -> 'active'
-                starting_items = Item.query.filter(Item.status == 'approved', Item.start_time <= now).all()
-                for item in starting_items:
-                    item.status = 'active'
-                    db.session.commit()
-                    # 可选择通知首页刷新，或在该 Item 的房间里广播
-                    print(f"Auction {item.id} started automatically at {now}")
-
-                # 3. 检查已结束后24小时仍未付款的订单 -> 流拍 + 封禁买家
-                # 条件: status='ended', payment_status='unpaid', end_time < now - 24h
-                deadline = now - timedelta(hours=24)
-                unpaid_items = Item.query.filter(
-                    Item.status == 'ended',
-                    Item.payment_status == 'unpaid',
-                    Item.highest_bidder_id.isnot(None),
-                    Item.end_time <= deadline
-                ).all()
-
-                for item in unpaid_items:
-                    # 更新订单状态为“流拍/超时未付”
-                    item.payment_status = 'timeout_cancelled'
-                    # 可选择将 status 也改为 'unsold_timeout' 以便区分，但保持 ended 也没问题，主要靠 payment_status 区分
-                    
-                    # 封禁买家 30 天
-                    bidder = item.highest_bidder
-                    if bidder:
-                        ban_until = now + timedelta(days=30)
-                        bidder.banned_until = ban_until
-                        # 违约：没收中标者保证金
-                        winner_dep = Deposit.query.filter_by(item_id=item.id, user_id=bidder.id).filter(Deposit.status.in_(['frozen','applied'])).first()
-                        if winner_dep:
-                                winner_dep.status = 'forfeited'
-                                # 保证金不返还，余额不变（已在缴纳时扣除）
-                        
-                        # 通知买家
-                        send_system_message(item.id, bidder.id, f'【违规处罚】由于您在拍品 "{item.name}" 结束后24小时内未完成付款，系统判定为违约。您的账户已被禁止参与拍卖活动30天，解封时间：{ban_until.strftime("%Y-%m-%d %H:%M")}。')
-                        
-                        # 通知卖家
-                        send_system_message(item.id, item.seller_id, f'很抱歉，拍品 "{item.name}" 的买家未在24小时内付款，交易已自动取消。您可以重新发布该商品。')
-                        
-                    db.session.commit()
-                    print(f"Auction {item.id} cancelled due to non-payment. Buyer {item.highest_bidder_id} banned.")
 
         except Exception as e:
             print(f"Check auction error: {e}")
-        time.sleep(10) 
+        # 整轮耗时 (各超时检查)
+        _record_sweep('check_auctions', 0, 0, (time.perf_counter() - started) * 1000)
+        time.sleep(ORDER_SWEEP_INTERVAL) 
+
+
+def reconcile_wallets(app, gate=None):
+    """
+    后台任务：每 RECONCILE_INTERVAL 秒做一次资金增量对账 (只汇总上次之后的新流水)
+    与 check_auctions 分开运行，积压较多流水时不会推迟订单超时检查
+    :param gate: 多进程部署时传入 leader 判断函数，非 leader 时跳过本轮
+    """
+    while True:
+        if gate is not None and not gate():
+            time.sleep(ORDER_SWEEP_INTERVAL)
+            continue
+        with app.app_context():
+            try:
+                reconcile()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Reconcile error: {e}")
+            finally:
+                db.session.remove()
+        time.sleep(RECONCILE_INTERVAL)
@@ -0,0 +1,30 @@
+"""
+执行计划回归测试：query.py 中的每个查询函数都不能出现全表扫描 (见 migrations.explain_check)
+
+在临时 SQLite 库上执行全部迁移后逐条 EXPLAIN；新增查询或修改索引导致全表扫描时测试失败。
+用法: python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'auction.db'}")
+    monkeypatch.setenv('AUCTION_ASYNC_MODE', 'threading')
+    monkeypatch.delenv('DATABASE_REPLICA_URL', raising=False)
+    monkeypatch.delenv('SOCKETIO_MESSAGE_QUEUE', raising=False)
+    from app import create_app
+    return create_app()
+
+
+def test_query_functions_use_indexes(app):
+    from migrations import migrate, explain_check
+    with app.app_context():
+        migrate(log=lambda msg: None)
+        failures = explain_check()
+    assert failures == [], '\n'.join(f"{name}: {table}\n    {statement}" for name, table, statement in failures)
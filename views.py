@@ -1,20 +1,36 @@
-from flask import render_template, request, redirect, url_for, flash, current_app
+from flask import render_template, request, redirect, url_for, flash, current_app, Response, stream_with_context
 from flask_login import login_user, login_required, logout_user, current_user
 from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 from decimal import Decimal, ROUND_HALF_UP
 import os
+import io
+import csv
+import json
 import time
 from sqlalchemy import text
 from extensions import db, socketio
-from models import User, Item, ItemImage, Post, Bid
+from models import User, Item, ItemImage, Post, Bid, SHIP_TIMEOUT, AUTO_CONFIRM_TIMEOUT, RECEIPT_EXTENSION
 import query
 from services import send_system_message
+from bid_engine import bid_engine
+from scheduler import auction_scheduler
+from listing_cache import listing_cache
+from search import search_index
+from watchlist import watchlist
+from counters import counters
+from conn_state import conn_states
+from replica import replica_reads
+from images import store_upload, existing_variants, image_pipeline
+import ledger
 
 import qrcode
 from io import BytesIO
 import base64
 
+# 拍品详情页显示的最近出价笔数
+RECENT_BIDS_SHOWN = 10
+
 def register_views(app):
     # 保证金计算：分层额度
     def compute_deposit_amount(item: Item) -> Decimal:
@@ -34,27 +50,16 @@ def register_views(app):
     def inject_global_vars():
         context = {}
         if current_user.is_authenticated:
-            # 管理员审核计数
+            # 管理员审核计数 (内存计数，见 counters.py)
             if current_user.role == 'admin':
                 try:
-                    from models import Appeal
-                    item_count = Item.query.filter_by(status='pending').count()
-                    appeal_count = Appeal.query.filter_by(status='pending').count()
-                    context['pending_count'] = item_count + appeal_count
+                    context['pending_count'] = counters.pending_total()
                 except:
                     context['pending_count'] = 0
             
-            # 未读私信计数
+            # 未读私信计数：我作为 buyer 的未读会话 + 我作为 seller 的未读会话
             try:
-                # 需在函数内部导入避免循环依赖，或者假设 models 已加载
-                from models import ChatSession
-                from sqlalchemy import or_
-                
-                # 计算我作为 buyer 的未读 + 我作为 seller 的未读
-                unread = 0
-                buyer_sessions = ChatSession.query.filter_by(buyer_id=current_user.id).filter(ChatSession.buyer_unread > 0).count()
-                seller_sessions = ChatSession.query.filter_by(seller_id=current_user.id).filter(ChatSession.seller_unread > 0).count()
-                context['unread_chats_count'] = buyer_sessions + seller_sessions
+                context['unread_chats_count'] = counters.unread_sessions(current_user.id)
             except:
                 context['unread_chats_count'] = 0
                 
@@ -98,8 +103,17 @@ def register_views(app):
             category = request.args.get('category', '')
             sort = request.args.get('sort', 'default')
             
-            # 使用 query 模块获取数据，传入 Model 类以避免循环导入
-            active_items, upcoming_items, ended_items = query.get_index_items(Item, User, search_q, category, sort)
+            active_after = request.args.get('active_after') or None
+            upcoming_after = request.args.get('upcoming_after') or None
+            
+            # 无搜索词时直接使用内存中的列表缓存，搜索时实时查询
+            if search_q:
+                listing = listing_cache.build_index(search_q, category, sort, active_after, upcoming_after)
+            else:
+                listing = listing_cache.get_index(category, sort, active_after, upcoming_after)
+            active_items, active_next, active_total = listing['active']
+            upcoming_items, upcoming_next, upcoming_total = listing['upcoming']
+            ended_items = listing['ended']
             
             # 搜索卖家
             matched_sellers = query.get_search_users(User, search_q) if search_q else []
@@ -127,6 +141,12 @@ def register_views(app):
                                 active_items=active_items, 
                                 upcoming_items=upcoming_items, 
                                 ended_items=ended_items,
+                                active_total=active_total,
+                                upcoming_total=upcoming_total,
+                                active_next=active_next,
+                                upcoming_next=upcoming_next,
+                                active_after=active_after,
+                                upcoming_after=upcoming_after,
                                 matched_sellers=matched_sellers,
                                 search_query=search_q,
                                 current_category=category,
@@ -175,6 +195,7 @@ def register_views(app):
                 new_user = User(username=username, password_hash=password, role=role, email=email)
                 db.session.add(new_user)
                 db.session.commit()
+                search_index.index_user(new_user.id, new_user.username)
                 login_user(new_user)
                 return redirect(url_for('index'))
         return render_template('register.html')
@@ -209,6 +230,7 @@ def register_views(app):
             user.id_card = id_card
             user.is_verified = True
             user.verified_at = datetime.now()
+            conn_states.mark_changed(user.id)
             db.session.commit()
             flash('实名认证成功')
             return redirect(url_for('index'))
@@ -283,6 +305,13 @@ def register_views(app):
                 flash('请至少上传一张商品图片')
                 return redirect(request.url)
 
+            # 保存原图 (按内容去重)，缩略图在提交后由后台线程池生成
+            try:
+                image_names = [store_upload(f, app.config['UPLOAD_FOLDER']) for f in files if f and f.filename]
+            except ValueError as e:
+                flash(str(e))
+                return redirect(request.url)
+
             new_item = Item(
                 seller_id=current_user.id,
                 name=name,
@@ -298,27 +327,18 @@ def register_views(app):
             db.session.add(new_item)
             db.session.flush() # 获取 new_item.id
 
-            # 处理图片上传
-            files = request.files.getlist('images')
-            for file in files:
-                if file and file.filename:
-                    filename = secure_filename(file.filename)
-                    # 防止重名
-                    unique_filename = f"{int(time.time())}_{filename}"
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                    
-                    # 确保目录存在
-                    if not os.path.exists(app.config['UPLOAD_FOLDER']):
-                        os.makedirs(app.config['UPLOAD_FOLDER'])
-                        
-                    file.save(file_path)
-                    
-                    # 存相对路径到数据库 (注意 path separator)
-                    db_image_path = f"uploads/{unique_filename}"
-                    new_image = ItemImage(item_id=new_item.id, image_url=db_image_path)
-                    db.session.add(new_image)
+            # 存相对路径到数据库，相同内容之前处理过的直接记录已有的衍生图
+            pending_images = []
+            for name in image_names:
+                variants = existing_variants(app.config['UPLOAD_FOLDER'], name)
+                if variants is None:
+                    pending_images.append(name)
+                db.session.add(ItemImage(item_id=new_item.id, image_url=f"uploads/{name}", variants=variants))
 
             db.session.commit()
+            image_pipeline.submit(app.config['UPLOAD_FOLDER'], pending_images)
+            search_index.index_item(new_item)
+            counters.add_pending('items', 1)
             
             # 通知管理员有新审核
             socketio.emit('new_pending_item', {
@@ -342,9 +362,13 @@ def register_views(app):
             return redirect(url_for('verify_identity'))
         
         search_q = request.args.get('q', '')
+        status = request.args.get('status') or None
+        after = request.args.get('after') or None
         # 移至 query.py
-        my_items = query.get_seller_items(Item, User, current_user.id, search_q)
-        return render_template('my_auctions.html', items=my_items, search_query=search_q)
+        my_items, next_cursor = query.get_seller_items(Item, User, current_user.id, search_q, status, after)
+        counts = query.get_seller_status_counts(Item, current_user.id)
+        return render_template('my_auctions.html', items=my_items, search_query=search_q, status=status,
+                               counts=counts, tabs=query.SELLER_TABS, after=after, next_cursor=next_cursor)
 
     @app.route('/my_orders')
     @login_required
@@ -353,9 +377,13 @@ def register_views(app):
             flash('您尚未完成实名认证。<a href="' + url_for('verify_identity') + '" class="btn btn-sm btn-primary ms-2">现在去实名</a> <button type="button" class="btn btn-sm btn-secondary ms-2" data-bs-dismiss="alert">明白了，稍后再去</button>')
             return redirect(url_for('verify_identity'))
         search_q = request.args.get('q', '')
+        tab = request.args.get('tab') or None
+        after = request.args.get('after') or None
         # 移至 query.py
-        orders = query.get_buyer_won_items(Item, User, current_user.id, search_q)
-        return render_template('my_orders.html', items=orders, search_query=search_q)
+        orders, next_cursor = query.get_buyer_won_items(Item, User, current_user.id, search_q, tab, after)
+        counts = query.get_buyer_order_counts(Item, current_user.id)
+        return render_template('my_orders.html', items=orders, search_query=search_q, tab=tab,
+                               counts=counts, after=after, next_cursor=next_cursor)
 
     @app.route('/wallet', methods=['GET', 'POST'])
     @login_required
@@ -401,20 +429,11 @@ def register_views(app):
         except Exception:
              flash('支付异常')
              return redirect(url_for('wallet'))
-        
-        user = User.query.get(current_user.id)
-        from models import WalletTransaction
-        new_balance = (Decimal(user.wallet_balance) + amount).quantize(Decimal('0.01'))
-        user.wallet_balance = new_balance
-        tx = WalletTransaction(
-            user_id=user.id,
-            type='recharge',
-            direction='credit',
-            amount=amount,
-            balance_after=new_balance,
-            description='用户充值'
-        )
-        db.session.add(tx)
+        if amount <= Decimal('0.00'):
+            flash('充值金额必须大于 0')
+            return redirect(url_for('wallet'))
+
+        ledger.post([ledger.credit(current_user.id, amount, 'recharge', '用户充值')])
         db.session.commit()
         flash(f'充值成功！已到账 ¥{amount}')
         return redirect(url_for('wallet'))
@@ -446,7 +465,16 @@ def register_views(app):
             from models import Favorite
             is_favorited = Favorite.query.filter_by(user_id=current_user.id, item_id=item.id).first() is not None
 
-        return render_template('item_detail.html', item=item, deposit_amount=deposit_amount, has_deposit=has_deposit, is_banned=is_banned, is_favorited=is_favorited)
+        # 出价记录：读出价汇总 (总次数 / 参与人数 / 最近出价)，出价者用户名一次 IN 查询
+        bid_summary = bid_engine.get_summary(item.id)
+        last_bids = bid_summary.last_bids(RECENT_BIDS_SHOWN)
+        bidder_names = dict(db.session.query(User.id, User.username).filter(
+            User.id.in_({uid for _, uid, _ in last_bids})
+        ).all()) if last_bids else {}
+        recent_bids = [(ts, bidder_names.get(uid, ''), amount) for ts, uid, amount in last_bids]
+
+        return render_template('item_detail.html', item=item, deposit_amount=deposit_amount, has_deposit=has_deposit, is_banned=is_banned, is_favorited=is_favorited,
+                               bid_summary=bid_summary, recent_bids=recent_bids)
 
     @app.route('/item/<int:item_id>/favorite', methods=['POST'])
     @login_required
@@ -456,11 +484,13 @@ def register_views(app):
         if fav:
             db.session.delete(fav)
             db.session.commit()
+            watchlist.remove(current_user.id, item_id)
             flash('已取消收藏')
         else:
             new_fav = Favorite(user_id=current_user.id, item_id=item_id)
             db.session.add(new_fav)
             db.session.commit()
+            watchlist.add(current_user.id, item_id)
             flash('已添加到收藏')
         return redirect(url_for('item_detail', item_id=item_id))
 
@@ -468,11 +498,10 @@ def register_views(app):
     @login_required
     def my_favorites():
         from models import Favorite
-        # Join to get items
-        favorites = Favorite.query.filter_by(user_id=current_user.id).order_by(Favorite.created_at.desc()).all()
-        # Extract items
-        items = [f.item for f in favorites]
-        return render_template('my_favorites.html', items=items)
+        after = request.args.get('after') or None
+        # 收藏与拍品一次 JOIN 查出 (见 query.py)
+        items, next_cursor = query.get_user_favorites(Favorite, Item, current_user.id, after)
+        return render_template('my_favorites.html', items=items, after=after, next_cursor=next_cursor)
 
     @app.route('/item/<int:item_id>/deposit', methods=['GET', 'POST'])
     @login_required
@@ -501,20 +530,15 @@ def register_views(app):
                 flash('钱包余额不足，无法冻结保证金。请先充值。')
                 return redirect(url_for('wallet'))
             # 扣款（不再使用冻结）
-            from models import WalletTransaction
-            new_balance = (balance - deposit_amount).quantize(Decimal('0.01'))
-            user.wallet_balance = new_balance
+            try:
+                ledger.post([ledger.debit(user.id, deposit_amount, 'deposit', f'缴纳拍品保证金: {item.name}', item.id)])
+            except ledger.InsufficientBalance:
+                db.session.rollback()
+                flash('钱包余额不足，无法冻结保证金。请先充值。')
+                return redirect(url_for('wallet'))
             dep = Deposit(item_id=item.id, user_id=current_user.id, amount=deposit_amount, status='frozen')
             db.session.add(dep)
-            db.session.add(WalletTransaction(
-                user_id=user.id,
-                item_id=item.id,
-                type='deposit',
-                direction='debit',
-                amount=deposit_amount,
-                balance_after=new_balance,
-                description=f'缴纳拍品保证金: {item.name}'
-            ))
+            conn_states.mark_changed(user.id)
             db.session.commit()
             flash('若您已缴纳保证金，则最终付款时将无需支付此部分。若竞拍失败，保证金将会降退还给您。')
             return redirect(url_for('item_detail', item_id=item_id))
@@ -554,7 +578,7 @@ def register_views(app):
         # Context Processor 已经有了 global pending_count (sum)
         # 这里特别传 audit_count 和 appeal_pending_count 给 nav_tabs
         audit_count = len(pending_items)
-        appeal_pending_count = Appeal.query.filter_by(status='pending').count()
+        appeal_pending_count = counters.pending_appeals()
 
         return render_template('admin/audit.html', 
                                items=pending_items,
@@ -573,8 +597,8 @@ def register_views(app):
         active_items = Item.query.filter(Item.status.in_(['active', 'approved'])).order_by(Item.start_time).all()
         
         # Counts for tabs
-        audit_count = Item.query.filter_by(status='pending').count()
-        appeal_pending_count = Appeal.query.filter_by(status='pending').count()
+        audit_count = counters.pending_items()
+        appeal_pending_count = counters.pending_appeals()
 
         return render_template('admin/active_items.html', 
                                active_items=active_items,
@@ -582,65 +606,53 @@ def register_views(app):
                                audit_count=audit_count,
                                appeal_pending_count=appeal_pending_count)
 
+    def wallet_transaction_filters():
+        """从请求参数解析资金流水筛选条件，返回 (筛选条件 dict, 查询)"""
+        from models import WalletTransaction, User
+        filters = {
+            'user': request.args.get('user', '').strip(),
+            'type': request.args.get('type', '').strip(),
+            'start': request.args.get('start', '').strip(),
+            'end': request.args.get('end', '').strip(),
+        }
+        start_dt = end_dt = None
+        if filters['start']:
+            try:
+                start_dt = datetime.strptime(filters['start'], '%Y-%m-%d')
+            except ValueError:
+                pass
+        if filters['end']:
+            try:
+                end_dt = datetime.strptime(filters['end'], '%Y-%m-%d') + timedelta(days=1) - timedelta(seconds=1)
+            except ValueError:
+                pass
+        query_tx = query.wallet_transaction_query(WalletTransaction, User, filters['user'], filters['type'], start_dt, end_dt)
+        return filters, query_tx
+
     @app.route('/admin/wallet_transactions')
     @login_required
+    @replica_reads()
     def admin_wallet_transactions():
         if current_user.role != 'admin':
             return redirect(url_for('index'))
-        from models import WalletTransaction, User, Appeal
-        # Filters
-        q_user = request.args.get('user', '').strip()
-        q_type = request.args.get('type', '').strip()
-        q_start = request.args.get('start', '').strip()
-        q_end = request.args.get('end', '').strip()
-        page = request.args.get('page', '1')
+        from models import WalletTransaction
+        filters, query_tx = wallet_transaction_filters()
         per_page = request.args.get('per_page', '50')
-        try:
-            page = int(page) if str(page).isdigit() else 1
-        except:
-            page = 1
-        try:
-            per_page = int(per_page) if str(per_page).isdigit() else 50
-        except:
+        per_page = int(per_page) if per_page.isdigit() else 50
+        if per_page not in query.LEDGER_PAGE_SIZES:
             per_page = 50
+        # keyset 游标 (见 query.get_wallet_transactions)，不再使用 OFFSET 翻页
+        after = request.args.get('after') or None
+        before = request.args.get('before') or None
 
-        query_tx = WalletTransaction.query
-        if q_user:
-            if q_user.isdigit():
-                query_tx = query_tx.filter(WalletTransaction.user_id == int(q_user))
-            else:
-                # 模糊匹配用户名
-                users = User.query.filter(User.username.like(f"%{q_user}%")).all()
-                user_ids = [u.id for u in users]
-                if user_ids:
-                    query_tx = query_tx.filter(WalletTransaction.user_id.in_(user_ids))
-                else:
-                    query_tx = query_tx.filter(WalletTransaction.user_id == -1)  # 返回空
-        if q_type:
-            query_tx = query_tx.filter(WalletTransaction.type == q_type)
-        if q_start:
-            try:
-                start_dt = datetime.strptime(q_start, '%Y-%m-%d')
-                query_tx = query_tx.filter(WalletTransaction.created_at >= start_dt)
-            except:
-                pass
-        if q_end:
-            try:
-                end_dt = datetime.strptime(q_end, '%Y-%m-%d') + timedelta(days=1) - timedelta(seconds=1)
-                query_tx = query_tx.filter(WalletTransaction.created_at <= end_dt)
-            except:
-                pass
-
-        total = query_tx.count()
-        query_tx = query_tx.order_by(WalletTransaction.created_at.desc())
-        transactions = query_tx.offset((page - 1) * per_page).limit(per_page).all()
-        pages = (total + per_page - 1) // per_page if per_page > 0 else 1
-        has_prev = page > 1
-        has_next = page < pages
+        transactions, prev_cursor, next_cursor = query.get_wallet_transactions(
+            query_tx, WalletTransaction, after=after, before=before, page_size=per_page)
+        total = query.count_wallet_transactions(query_tx, WalletTransaction, tuple(filters.values()))
+        total_label = f"{query.LEDGER_COUNT_LIMIT}+" if total > query.LEDGER_COUNT_LIMIT else str(total)
 
         # 复用 admin nav 模板结构
-        audit_count = Item.query.filter_by(status='pending').count()
-        appeal_pending_count = Appeal.query.filter_by(status='pending').count()
+        audit_count = counters.pending_items()
+        appeal_pending_count = counters.pending_appeals()
         return render_template(
             'admin/wallet_transactions.html',
             transactions=transactions,
@@ -648,19 +660,56 @@ def register_views(app):
             audit_count=audit_count,
             appeal_pending_count=appeal_pending_count,
             # filters
-            f_user=q_user,
-            f_type=q_type,
-            f_start=q_start,
-            f_end=q_end,
+            f_user=filters['user'],
+            f_type=filters['type'],
+            f_start=filters['start'],
+            f_end=filters['end'],
             per_page=per_page,
             # pagination
-            page=page,
-            pages=pages,
-            total=total,
-            has_prev=has_prev,
-            has_next=has_next
+            total=total_label,
+            prev_cursor=prev_cursor,
+            next_cursor=next_cursor,
         )
 
+    @app.route('/admin/wallet_transactions/export')
+    @login_required
+    def admin_wallet_transactions_export():
+        """按当前筛选条件流式导出资金流水 (CSV / NDJSON)，边查询边输出"""
+        if current_user.role != 'admin':
+            return redirect(url_for('index'))
+        from models import WalletTransaction, User
+        fmt = 'ndjson' if request.args.get('format') == 'ndjson' else 'csv'
+        filters, query_tx = wallet_transaction_filters()
+        fields = ['id', 'created_at', 'user_id', 'username', 'type', 'direction',
+                  'amount', 'balance_after', 'item_id', 'item_name', 'description']
+
+        def generate():
+            # 视图返回后才开始迭代，需在生成器内部标记走副本
+            with replica_reads():
+                if fmt == 'csv':
+                    buf = io.StringIO()
+                    writer = csv.writer(buf)
+                    # BOM 便于 Excel 识别 UTF-8
+                    yield '\ufeff'
+                    writer.writerow(fields)
+                for row in query.iter_wallet_transactions(query_tx, WalletTransaction, User, Item):
+                    values = [
+                        row[0], row[1].strftime('%Y-%m-%d %H:%M:%S') if row[1] else '', row[2], row[3],
+                        row[4], row[5], str(row[6]), str(row[7]), row[8], row[9], row[10],
+                    ]
+                    if fmt == 'csv':
+                        writer.writerow(values)
+                        yield buf.getvalue()
+                        buf.seek(0)
+                        buf.truncate()
+                    else:
+                        yield json.dumps(dict(zip(fields, values)), ensure_ascii=False) + '\n'
+
+        filename = f"wallet_transactions_{datetime.now().strftime('%Y%m%d%H%M%S')}.{fmt}"
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        return Response(stream_with_context(generate()), mimetype=f'{mimetype}; charset=utf-8',
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+
     @app.route('/admin/appeals')
     @login_required
     def admin_appeals():
@@ -671,7 +720,7 @@ def register_views(app):
         pending_appeals, history_appeals = query.get_appeal_list(Appeal)
         
         # Counts for tabs
-        audit_count = Item.query.filter_by(status='pending').count()
+        audit_count = counters.pending_items()
         appeal_pending_count = len(pending_appeals)
 
         return render_template('admin/appeals.html', 
@@ -683,6 +732,7 @@ def register_views(app):
 
     @app.route('/admin/history')
     @login_required
+    @replica_reads()
     def admin_history():
         if current_user.role != 'admin':
             return redirect(url_for('index'))
@@ -692,8 +742,8 @@ def register_views(app):
         ended_items = Item.query.filter(Item.status.in_(['ended', 'stopped', 'rejected'])).order_by(Item.end_time.desc()).limit(50).all()
         
         # Counts for tabs
-        audit_count = Item.query.filter_by(status='pending').count()
-        appeal_pending_count = Appeal.query.filter_by(status='pending').count()
+        audit_count = counters.pending_items()
+        appeal_pending_count = counters.pending_appeals()
 
         return render_template('admin/history.html', 
                                ended_items=ended_items,
@@ -708,6 +758,7 @@ def register_views(app):
         if current_user.role != 'admin':
             return redirect(url_for('index'))
         item = Item.query.get_or_404(item_id)
+        was_pending = item.status == 'pending'
         
         # Check if this is a future scheduled item
         if item.start_time > datetime.now():
@@ -725,18 +776,25 @@ def register_views(app):
             item.end_time = item.start_time + original_duration
             flash('已批准并立即开拍')
         
+        # 发送系统私信 (跳过默认通知，因为已经发送了 auction_approved)
+        msg_content = f'您的拍品 "{item.name}" 已通过审核并上架！'
+        send_system_message(item.id, item.seller_id, msg_content, skip_notification=True)
         db.session.commit()
+        listing_cache.invalidate()
+        search_index.set_status(item.id, item.status)
+        if was_pending:
+            counters.add_pending('items', -1)
+        if item.status == 'approved':
+            auction_scheduler.schedule('start', item.id, item.start_time)
+        else:
+            auction_scheduler.schedule('end', item.id, item.end_time)
         
         # Notify seller via SocketIO
-        msg_content = f'您的拍品 "{item.name}" 已通过审核并上架！'
         socketio.emit('auction_approved', {
             'item_name': item.name,
             'msg': msg_content
         }, room=f"user_{item.seller_id}")
         
-        # 发送系统私信 (跳过默认通知，因为已经发送了 auction_approved)
-        send_system_message(item.id, item.seller_id, msg_content, skip_notification=True)
-        
         return redirect(url_for('admin_audit'))
 
     @app.route('/reject/<int:item_id>', methods=['POST'])
@@ -747,22 +805,25 @@ def register_views(app):
         
         item = Item.query.get_or_404(item_id)
         reason = request.form.get('reason', '')
+        was_pending = item.status == 'pending'
         
         item.status = 'rejected'
         item.rejection_reason = reason
+        # 发送系统私信 (跳过默认通知，因为已经发送了 auction_rejected)
+        msg_content = f'您的拍品 "{item.name}" 已被拒绝。理由: {reason}'
+        send_system_message(item.id, item.seller_id, msg_content, skip_notification=True)
         db.session.commit()
+        search_index.set_status(item.id, item.status)
+        if was_pending:
+            counters.add_pending('items', -1)
         
         # Notify seller via SocketIO
-        msg_content = f'您的拍品 "{item.name}" 已被拒绝。理由: {reason}'
         socketio.emit('auction_rejected', {
             'item_name': item.name,
             'reason': reason,
             'msg': msg_content
         }, room=f"user_{item.seller_id}")
         
-        # 发送系统私信 (跳过默认通知，因为已经发送了 auction_rejected)
-        send_system_message(item.id, item.seller_id, msg_content, skip_notification=True)
-        
         flash('已拒绝并在卖家端发送通知')
         return redirect(url_for('admin_audit'))
 
@@ -790,15 +851,24 @@ def register_views(app):
         if item.status in ['active', 'approved']:
             item.status = 'stopped' # 强制下架状态
             item.rejection_reason = reason # 下架原因
+
+            # 生成申诉链接 (指向新的申诉表单页面)
+            appeal_url = url_for('submit_appeal', item_id=item.id, _external=True)
+
+            # 发送系统私信给卖家 (跳过通用通知) - 私信中存储完整链接供点击
+            chat_msg_content = f'您的拍品 "{item.name}" 已被管理员强制下架。原因：{reason}。如果您对此操作有任何异议，可以点击链接进行申诉: {appeal_url}'
+            send_system_message(item.id, item.seller_id, chat_msg_content, skip_notification=True)
             db.session.commit()
+            bid_engine.evict(item.id)
+            listing_cache.invalidate()
+            search_index.set_status(item.id, item.status)
+            auction_scheduler.cancel('start', item.id)
+            auction_scheduler.cancel('end', item.id)
             
             # 如果正在进行，通知房间内用户
             socketio.emit('error', {'msg': f'管理员已强制终止此拍卖，原因：{reason}'}, room=f"item_{item.id}")
             socketio.emit('auction_ended', {'item_id': item.id, 'winner': '管理员终止'}, room=f"item_{item.id}")
             
-            # 生成申诉链接 (指向新的申诉表单页面)
-            appeal_url = url_for('submit_appeal', item_id=item.id, _external=True)
-            
             # 通知卖家 (Yellow Toast)
             # 使用 HTML <a> 标签包裹链接，配合前端 innerHTML 显示
             msg_content = f'您的拍品 "{item.name}" 已被管理员强制下架。原因：{reason}。如果您对此操作有任何异议，可以<a href="{appeal_url}" class="text-white fw-bold" style="text-decoration: underline;">点击此处</a>进行申诉'
@@ -808,10 +878,6 @@ def register_views(app):
                 'reason': reason,
                 'msg': msg_content
             }, room=f"user_{item.seller_id}")
-
-            # 发送系统私信给卖家 (跳过通用通知) - 私信中存储完整链接供点击
-            chat_msg_content = f'您的拍品 "{item.name}" 已被管理员强制下架。原因：{reason}。如果您对此操作有任何异议，可以点击链接进行申诉: {appeal_url}'
-            send_system_message(item.id, item.seller_id, chat_msg_content, skip_notification=True)
             
             flash(f'已强制停止拍品: {item.name}')
         else:
@@ -841,18 +907,21 @@ def register_views(app):
                     appeal.handled_at = datetime.now()
                     appeal.admin_reply = '管理员主动恢复'
 
+                # 发送系统私信 (跳过默认通知)
+                msg_content = f'您的拍品 "{item.name}" 已被管理员恢复上架！'
+                send_system_message(item.id, item.seller_id, msg_content, skip_notification=True)
                 db.session.commit()
+                listing_cache.invalidate()
+                search_index.set_status(item.id, item.status)
+                counters.add_pending('appeals', -len(pending_appeals))
+                auction_scheduler.schedule('end', item.id, item.end_time)
                 
                 # Notify seller via SocketIO (Green Toast)
-                msg_content = f'您的拍品 "{item.name}" 已被管理员恢复上架！'
                 socketio.emit('auction_restored', {
                     'item_name': item.name,
                     'msg': msg_content
                 }, room=f"user_{item.seller_id}")
 
-                # 发送系统私信 (跳过默认通知)
-                send_system_message(item.id, item.seller_id, msg_content, skip_notification=True)
-
                 flash(f'已恢复拍品: {item.name}')
             else:
                 flash('该拍品原定结束时间已过，无法恢复')
@@ -898,6 +967,7 @@ def register_views(app):
         )
         db.session.add(new_appeal)
         db.session.commit()
+        counters.add_pending('appeals', 1)
         
         flash('申诉提交成功，请等待管理员处理')
         
@@ -944,12 +1014,13 @@ def register_views(app):
             appeal.handled_at = datetime.now()
             appeal.admin_reply = reason
             
-            db.session.commit()
-            
             # Notify seller
             item = appeal.item
             msg = f'关于拍品 "{item.name}" 的申诉已被驳回。理由: {reason}。维持下架决定。'
             send_system_message(item.id, item.seller_id, msg)
+            db.session.commit()
+            counters.add_pending('appeals', -1)
+            
             socketio.emit('auction_rejected', { 
                 'item_name': item.name,
                 'reason': reason,
@@ -962,6 +1033,7 @@ def register_views(app):
 
     @app.route('/user/<int:user_id>')
     @login_required
+    @replica_reads()
     def user_profile(user_id):
         user = User.query.get_or_404(user_id)
         posts = query.get_user_posts(Post, user_id)
@@ -995,20 +1067,21 @@ def register_views(app):
             return redirect(url_for('user_profile', user_id=current_user.id))
             
         if file:
-            filename = secure_filename(file.filename)
-            # Add timestamp to filename
-            extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-            if not extension:
-                extension = 'jpg' # Default fallback
-            unique_filename = f"avatar_{current_user.id}_{int(time.time())}.{extension}"
-            
-            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(file_path)
+            upload_folder = current_app.config['UPLOAD_FOLDER']
+            try:
+                name = store_upload(file, upload_folder)
+            except ValueError as e:
+                flash(str(e))
+                return redirect(url_for('user_profile', user_id=current_user.id))
+            variants = existing_variants(upload_folder, name)
             
             # Update user avatar
             user = User.query.get(current_user.id)
-            user.avatar = unique_filename
+            user.avatar = name
+            user.avatar_variants = variants
             db.session.commit()
+            if variants is None:
+                image_pipeline.submit(upload_folder, [name])
             
             flash('头像更新成功')
             return redirect(url_for('user_profile', user_id=current_user.id))
@@ -1112,29 +1185,31 @@ def register_views(app):
             flash('钱包余额不足，无法完成支付。请先充值。')
             return redirect(url_for('wallet'))
 
-        # 扣除需支付金额，并标记保证金已使用
-        from models import WalletTransaction
-        new_balance = (balance - payable).quantize(Decimal('0.01'))
-        user.wallet_balance = new_balance
+        # 条件更新订单状态：重复提交 / 与超时取消并发时只有一方成功
+        paid_at = datetime.now()
+        updated = Item.query.filter_by(id=item.id, payment_status=item.payment_status).update(
+            {'payment_status': 'paid', 'paid_at': paid_at, 'ship_deadline': paid_at + SHIP_TIMEOUT},
+            synchronize_session='fetch'
+        )
+        if not updated:
+            db.session.rollback()
+            flash('订单状态已变化，请刷新后重试')
+            return redirect(url_for('item_detail', item_id=item_id))
+
+        # 扣除需支付金额 (记录买家支付流水)，并标记保证金已使用
+        try:
+            ledger.post([ledger.debit(user.id, payable, 'payment', f'支付订单：{item.order_hash}', item.id)])
+        except ledger.InsufficientBalance:
+            db.session.rollback()
+            flash('钱包余额不足，无法完成支付。请先充值。')
+            return redirect(url_for('wallet'))
         if dep and dep.status == 'frozen':
             dep.status = 'applied'
-        item.payment_status = 'paid'
-        item.paid_at = datetime.now() # Record payment time
-
-        # 记录支付交易（买家）
-        db.session.add(WalletTransaction(
-            user_id=user.id,
-            item_id=item.id,
-            type='payment',
-            direction='debit',
-            amount=payable,
-            balance_after=new_balance,
-            description=f'支付订单：{item.order_hash}'
-        ))
-        db.session.commit()
+            conn_states.mark_changed(user.id)
 
         # Notify Seller
         send_system_message(item.id, item.seller_id, f"订单 {item.order_hash} 已付款。请尽快安排发货。收货人：{item.shipping_name}，地址：{item.shipping_address}")
+        db.session.commit()
 
         flash('支付确认成功！')
         return redirect(url_for('item_detail', item_id=item_id))
@@ -1164,10 +1239,11 @@ def register_views(app):
         item.tracking_number = tracking_number
         item.shipping_status = 'shipped'
         item.shipped_at = datetime.now() # Record shipping time
-        db.session.commit()
+        item.auto_confirm_deadline = item.shipped_at + AUTO_CONFIRM_TIMEOUT
         
         # 通知买家
         send_system_message(item.id, item.highest_bidder_id, f"您的订单 {item.order_hash} 已发货！快递单号：{tracking_number}")
+        db.session.commit()
         
         flash('发货成功')
         return redirect(url_for('my_auctions'))
@@ -1189,30 +1265,21 @@ def register_views(app):
             flash('订单状态不正确，无法确认收货')
             return redirect(url_for('my_orders'))
             
-        item.shipping_status = 'received'
-        
-        # 为卖家入账成交总额
-        seller = item.seller
-        seller_balance = Decimal(seller.wallet_balance).quantize(Decimal('0.01'))
-        sale_total = Decimal(item.current_price).quantize(Decimal('0.01'))
-        seller_new_balance = (seller_balance + sale_total).quantize(Decimal('0.01'))
-        seller.wallet_balance = seller_new_balance
-
-        from models import WalletTransaction
-        db.session.add(WalletTransaction(
-            user_id=seller.id,
-            item_id=item.id,
-            type='payout',
-            direction='credit',
-            amount=sale_total,
-            balance_after=seller_new_balance,
-            description=f'出售拍品入账：{item.name}'
-        ))
+        # 条件更新：与自动确认收货并发时只入账一次
+        updated = Item.query.filter_by(id=item.id, shipping_status='shipped').update(
+            {'shipping_status': 'received'}, synchronize_session='fetch'
+        )
+        if not updated:
+            db.session.rollback()
+            flash('订单状态已变化，请刷新后重试')
+            return redirect(url_for('my_orders'))
 
-        db.session.commit()
+        # 为卖家入账成交总额
+        ledger.post([ledger.credit(item.seller_id, item.current_price, 'payout', f'出售拍品入账：{item.name}', item.id)])
         
         # 通知卖家
         send_system_message(item.id, item.seller_id, f"买家已确认收货，订单 {item.order_hash} 完成。资金已转入您的钱包。")
+        db.session.commit()
         
         flash('确认收货成功')
         return redirect(url_for('my_orders'))
@@ -1234,6 +1301,7 @@ def register_views(app):
             return redirect(url_for('my_orders'))
             
         item.shipping_extended_count += 1
+        item.auto_confirm_deadline = item.shipped_at + AUTO_CONFIRM_TIMEOUT + item.shipping_extended_count * RECEIPT_EXTENSION
         db.session.commit()
         
         flash('已延长收货 3 天')
@@ -0,0 +1,176 @@
+"""
+收藏与即将结束提醒
+
+收藏了拍品的用户通过各自的 user_<id> 房间收到该拍品的 watch_updates 提醒：
+- outbid: 收藏的拍品有了新的出价 (events.on_bid 发布，出价人自己不提醒)
+- ended: 收藏的拍品已结束 (tasks.end_auctions 发布，已收到拍卖结果通知的卖家 / 出价人不重复提醒)
+收藏者与出过价的用户在拍品结束前 ENDING_SOON_MINUTES (默认 10 分钟与 1 分钟) 收到 auction_result_toast
+(type=ending)。每个提前量是 auction_scheduler 的一类提前量任务，随 end 任务一起登记，防狙击延时重新登记
+end 任务时同步移动 (每次变化 O(log n))，触发时间按 ENDING_SOON_ALIGN 对齐，结束时间相近的拍品合并为一条提醒；
+到点时只查询到期的拍品，不做周期性扫描。
+发布只把提醒按 (拍品, 类型) 暂存 (同类只保留最新一条)，后台任务每 WATCH_FLUSH_MS 取出一批，
+按用户合并后每个用户每批只推送一次 watch_updates 与一次即将结束提醒。
+拍品 -> 收藏者 的反向索引在第一次投递该拍品的提醒时从 favorites 表加载，收藏 / 取消收藏时增量维护，
+加载超过 WATCHERS_TTL 秒后重新加载 (同步其他进程中的收藏变化)，拍品结束后移出索引。
+"""
+import os
+import threading
+import time
+from datetime import timedelta
+from extensions import db, socketio
+from models import Item, Favorite
+from scheduler import auction_scheduler
+from bid_engine import bid_engine
+
+# 合并推送的间隔 (毫秒)
+WATCH_FLUSH_MS = int(os.environ.get('WATCH_FLUSH_MS', '1000'))
+# 结束前多久提醒收藏者与出价人 (分钟，逗号分隔的多个提前量)
+ENDING_SOON_MINUTES = sorted({int(m) for m in os.environ.get('ENDING_SOON_MINUTES', '10,1').split(',') if m.strip()},
+                             reverse=True)
+# 即将结束提醒的触发时间对齐粒度：结束时间相近的拍品合并为同一条提醒
+ENDING_SOON_ALIGN = timedelta(seconds=30)
+# 收藏者缓存的有效期 (秒)
+WATCHERS_TTL = 60
+
+# 以即将结束提醒 (auction_result_toast) 推送的提醒类型，其余以 watch_updates 推送
+TOAST_KINDS = ('ending_soon',)
+
+# events: 发布的提醒数, deliveries: 送达的 (用户, 提醒) 数, emits: 实际推送次数
+WATCH_METRICS = {'events': 0, 'deliveries': 0, 'emits': 0}
+
+
+class Watchlist:
+    def __init__(self, flush_ms=WATCH_FLUSH_MS):
+        self.interval = flush_ms / 1000
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._watchers = {}   # item_id -> [加载时间 (monotonic), 拍品名称, {user_id}]
+        self._pending = {}    # (item_id, kind) -> (提醒内容, 不提醒的用户, 收藏者以外需要提醒的用户)
+        self._started = False
+
+    def publish(self, item_id, kind, payload, exclude=(), extra=()):
+        """
+        暂存一条拍品提醒，提醒该拍品的收藏者与 extra 中的用户 (exclude 中的除外)
+        :param payload: msg 为提示文案 ({name} 会替换为拍品名称)
+        """
+        if not self._started:
+            # 未启动后台任务的进程 (脚本、迁移) 不投递
+            return
+        with self._lock:
+            WATCH_METRICS['events'] += 1
+            self._pending[(item_id, kind)] = (dict(payload, kind=kind, item_id=item_id), set(exclude), set(extra))
+        self._wakeup.set()
+
+    def add(self, user_id, item_id):
+        with self._lock:
+            entry = self._watchers.get(item_id)
+            if entry is not None:
+                entry[2].add(user_id)
+
+    def remove(self, user_id, item_id):
+        with self._lock:
+            entry = self._watchers.get(item_id)
+            if entry is not None:
+                entry[2].discard(user_id)
+
+    def _load(self, item_ids):
+        """加载缺失或已过期的收藏者 (需在 app context 中调用)"""
+        now = time.monotonic()
+        with self._lock:
+            missing = [i for i in item_ids
+                       if i not in self._watchers or now - self._watchers[i][0] > WATCHERS_TTL]
+        if not missing:
+            return
+        entries = {item_id: [now, name, set()] for item_id, name in
+                   db.session.query(Item.id, Item.name).filter(Item.id.in_(missing)).all()}
+        for item_id, user_id in db.session.query(Favorite.item_id, Favorite.user_id).filter(
+            Favorite.item_id.in_(list(entries))
+        ).all():
+            entries[item_id][2].add(user_id)
+        with self._lock:
+            self._watchers.update(entries)
+
+    def flush(self):
+        """按用户合并推送暂存的提醒 (需在 app context 中调用)，返回推送次数"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        self._load({item_id for item_id, _ in pending})
+        batches = {}
+        toasts = {}
+        with self._lock:
+            for (item_id, kind), (payload, exclude, extra) in pending.items():
+                entry = self._watchers.get(item_id)
+                if entry is None:
+                    continue
+                payload['item_name'] = entry[1]
+                payload['msg'] = payload['msg'].replace('{name}', entry[1])
+                target = toasts if kind in TOAST_KINDS else batches
+                for user_id in (entry[2] | extra) - exclude:
+                    target.setdefault(user_id, []).append(payload)
+                if kind == 'ended':
+                    # 结束后不再有提醒
+                    del self._watchers[item_id]
+            # 过期的条目下次需要时会重新加载，不再保留
+            now = time.monotonic()
+            for item_id in [i for i, entry in self._watchers.items() if now - entry[0] > WATCHERS_TTL]:
+                del self._watchers[item_id]
+            WATCH_METRICS['deliveries'] += sum(len(updates) for updates in batches.values())
+            WATCH_METRICS['deliveries'] += sum(len(updates) for updates in toasts.values())
+            WATCH_METRICS['emits'] += len(batches) + len(toasts)
+        for user_id, updates in batches.items():
+            socketio.emit('watch_updates', {'updates': updates}, room=f"user_{user_id}")
+        for user_id, updates in toasts.items():
+            socketio.emit('auction_result_toast', {
+                'type': 'ending',
+                'msg': '\n'.join(u['msg'] for u in updates),
+                'items': updates,
+            }, room=f"user_{user_id}")
+        return len(batches) + len(toasts)
+
+    def start(self, app):
+        if self._started:
+            return
+        self._started = True
+        socketio.start_background_task(self._run, app)
+
+    def _run(self, app):
+        while True:
+            self._wakeup.wait()
+            # 等待一个合并间隔，收集这段时间内的其他提醒
+            socketio.sleep(self.interval)
+            self._wakeup.clear()
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Watchlist delivery error: {e}")
+                finally:
+                    db.session.remove()
+
+
+watchlist = Watchlist()
+
+
+def notify_ending_soon(app, item_ids, now):
+    """调度任务：进行中的拍品到达结束前的提醒时间点，提醒收藏者与出过价的用户"""
+    rows = db.session.query(Item.id, Item.end_time, Item.seller_id).filter(
+        Item.id.in_(item_ids), Item.status == 'active'
+    ).all()
+    # 出价人一次读取 (shared 模式下逐个读取是 N 次查询)
+    summaries = bid_engine.get_summaries([item_id for item_id, _, _ in rows])
+    for item_id, end_time, seller_id in rows:
+        # 触发时间最多提前一个对齐粒度，按最接近的整分钟显示
+        minutes = max(int(((end_time - now).total_seconds() + 30) // 60), 1)
+        watchlist.publish(item_id, 'ending_soon', {
+            'end_time': end_time.isoformat(),
+            'minutes_left': minutes,
+            'msg': f'【即将结束】拍品 "{{name}}" 将在 {minutes} 分钟后结束。',
+        }, exclude=(seller_id,), extra=summaries[item_id].bidders)
+
+
+for _minutes in ENDING_SOON_MINUTES:
+    auction_scheduler.register(f'ending_soon_{_minutes}', notify_ending_soon,
+                               before=('end', timedelta(minutes=_minutes)), align=ENDING_SOON_ALIGN)